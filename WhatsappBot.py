@@ -11,521 +11,570 @@ from selenium.common.exceptions import (
 )
 
 from datetime import datetime
-from itertools import permutations
-from textdistance import lcsstr
-import pandas as pd
-from utility_functions import Vehicle
+from parade_state import (
+    DR_WORKSHEET,
+    GEN_WORKSHEET,
+    PS_WORKSHEET,
+    SPREADSHEET_KEY,
+    ParadeState,
+)
+from adaptive_poll import AdaptivePoller
+from message_parser import tokenize
+from metrics import METRICS, dump_every, serve as serve_metrics
+from sheets_client import SheetsClient, TokenBucket
+from movement_history import MovementHistory
+from output_sinks import JsonFileSink, SheetsSink, WebhookSink
+from scheduler import MORNING_REFRESH, Scheduler, default_jobs
+from state_journal import StateJournal
+from structured_logging import event, events_enabled, setup_logging
+from whatsapp_scraper import (
+    SeenMessages,
+    current_chat,
+    drain_messages,
+    extract_messages,
+    install_observer,
+    message_key,
+    parse_pre_plain_text,
+    rendered_messages,
+    screenshot_if_requested,
+    scroll_back,
+    scroll_chat,
+    take_screenshot,
+)
 
 import gspread
+import atexit
+import os
 import time
 import logging
 import traceback
 import shutil
 
-logging.basicConfig(
-    level=logging.INFO,
-    filename="log.txt",
-    filemode="w",
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%d/%m/%y %H:%M:%S",
-)
-
 # Initializing Bot
 TO_UPDATE = "'Mandai TOs'"
+# Groups to watch, each with its own spreadsheet. With more than one, the chats
+# are scanned in turn (no observer, as only the open chat is rendered), and
+# parsing and sheet writes go to a shared pool of GROUP_WORKERS threads, see
+# group_monitor.py. "ps", "gen" and "dr" override the worksheet names.
+GROUPS = [
+    {"name": "mandai", "chat": TO_UPDATE, "spreadsheet": SPREADSHEET_KEY},
+]
+GROUP_WORKERS = 4
+# Minimum seconds between two writes of the same output. At 0, each output is
+# written at most once per poll.
+WRITE_DEBOUNCE = 0
+# "observer" picks up new messages as they are rendered, with a full scan
+# every FULL_SCAN_INTERVAL seconds as a fallback. "scan" does a full scan on
+# every poll. The observer's queue is drained every DRAIN_INTERVAL seconds,
+# with either RUNTIME.
+INGEST_MODE = "observer"
+DRAIN_INTERVAL = 1
+FULL_SCAN_INTERVAL = 300
+# With RUNTIME "loop" and INGEST_MODE "scan", full scans are every
+# MIN_POLL_INTERVAL seconds while messages come in, backing off to
+# MAX_POLL_INTERVAL when it's quiet, and to OFF_HOURS_POLL_INTERVAL outside
+# ACTIVE_HOURS. The refresh flag and the daily jobs are checked every
+# HOUSEKEEPING_INTERVAL seconds (off hours, every OFF_HOURS_POLL_INTERVAL).
+# Screenshots are only taken on errors, or when the file screenshot.request is
+# created.
+MIN_POLL_INTERVAL = 2
+MAX_POLL_INTERVAL = 30
+OFF_HOURS_POLL_INTERVAL = 300
+ACTIVE_HOURS = (7, 22)
+HOUSEKEEPING_INTERVAL = 60
+# "loop" does everything in turn in one thread. "async" runs scraping,
+# parsing, sheet writes and the scheduled jobs as separate tasks, see
+# async_runtime.py
+RUNTIME = "loop"
+# Sheets calls per second, and how many can go at once, to stay under the
+# quota (60 a minute per user)
+SHEETS_RATE = 0.9
+SHEETS_BURST = 10
+# Every change to the state is journalled here, so a restart picks up where it
+# left off. The journal is fsynced every JOURNAL_FSYNC_EVERY records, and at
+# every flush, and compacted into a snapshot every SNAPSHOT_EVERY records.
+JOURNAL_DIR = "state"
+JOURNAL_FSYNC_EVERY = 20
+SNAPSHOT_EVERY = 200
+# Every movement and RTU is also kept here for good, see movement_history.py
+HISTORY_DIR = "history"
+# Per stage timings and counters, served on http://127.0.0.1:METRICS_PORT/metrics
+# (None to not serve them), and dumped to METRICS_DUMP every
+# METRICS_DUMP_INTERVAL seconds. A message parsed more than INGEST_LAG_ALERT
+# seconds after it was sent is logged as a warning.
+METRICS_PORT = 9108
+METRICS_DUMP = "metrics.json"
+METRICS_DUMP_INTERVAL = 60
+INGEST_LAG_ALERT = 300
+# Outputs are written by sinks, each from its own thread with its own queue,
+# so a slow or failing one never holds up parsing, see output_sinks.py. Besides
+# the sheets, the latest of each output goes to OUTPUT_JSON_DIR/<group>.json
+# (None to not), and a summary is POSTed to OUTPUT_WEBHOOK_URL if set, e.g.
+# https://api.telegram.org/bot<token>/sendMessage with OUTPUT_WEBHOOK_CHAT_ID
+# ("webhook_chat_id" in GROUPS overrides it). With OUTPUT_SINKS False, the
+# sheets are written on every flush, in the thread calling it.
+OUTPUT_SINKS = True
+OUTPUT_JSON_DIR = "outputs"
+OUTPUT_WEBHOOK_URL = None
+OUTPUT_WEBHOOK_CHAT_ID = None
+# Logs go to LOG_FILE, and events (messages parsed, names matched, changes to
+# the state) to EVENTS_FILE as JSON lines, both written by a background thread
+# and rotated every LOG_MAX_BYTES, keeping LOG_BACKUPS old files. Events slow
+# logging down, so EVENTS_FILE is None (off) unless they are wanted, e.g.
+# "events.jsonl". See structured_logging.py.
+LOG_FILE = "log.txt"
+EVENTS_FILE = None
+LOG_LEVEL = logging.INFO
+LOG_MAX_BYTES = 10 * 2**20
+LOG_BACKUPS = 5
+# On start up, the chat is scrolled back to the last message parsed, and what
+# was sent meanwhile is parsed oldest first, BACKFILL_BATCH messages per
+# round trip, with one write to the sheets at the end. Waits
+# BACKFILL_SCROLL_WAIT seconds for older messages to load after each scroll,
+# and gives up after BACKFILL_MAX_SCROLLS scrolls, or with
+# BACKFILL_MAX_MESSAGES rendered.
+BACKFILL = True
+BACKFILL_BATCH = 200
+BACKFILL_SCROLL_WAIT = 1.5
+BACKFILL_MAX_SCROLLS = 200
+BACKFILL_MAX_MESSAGES = 5000
+
+
+def check_messages(driver, state, seen_messages, last_checked, chat=TO_UPDATE):
+    # Full scan of the chat. Messages before last_checked are ignored, e.g.
+    # yesterday's, and each message is only parsed once thanks to
+    # seen_messages.
+    return process_messages(
+        scan_messages(driver, chat), state, seen_messages, last_checked
+    )
 
 
-def match_name(df_to_match, name):
-    # Using longest common substring similarity (lcsstr).
-    # This is due to name variations being often rearrangements of each other.
-    # The matching occurs in two steps.
-    # First, the rank _must_ match.
-    # Second, from those with matching ranks, match len(lcsstr) > 3
-    rank = name.split()[0].upper()
-    name = "".join([x.lower() for x in name.split()[1:]])
+def open_chat(driver, chat=TO_UPDATE):
+    # Opens the chat if it isn't already
+    if current_chat(driver) == chat.strip("'"):
+        return
+    WebDriverWait(driver, 20).until(
+        EC.presence_of_element_located((By.XPATH, f"//*[contains(@title, {chat})]"))
+    )
+    driver.find_element_by_xpath(f"//*[contains(@title, {chat})]").click()
+    METRICS.inc("chat_opened")
 
-    # First, ensure the rank matches
-    matched_rank = df_to_match.RANK == rank
+    try:
+        results = driver.find_elements_by_class_name("message-in")
+        results[0].send_keys(Keys.PAGE_UP)
+        results[-1].send_keys(Keys.END)
+    except StaleElementReferenceException:
+        logging.warning("Stale Element Reference Exception during scrolling.")
 
-    def max_common_permutated_token(name_to_check, name):
-        possible_names = ["".join(p) for p in permutations(name_to_check.split())]
-        lcsseq_length = [len(lcsstr(name.lower(), x.lower())) for x in possible_names]
-        return max(lcsseq_length)
 
-    score = [max_common_permutated_token(x, name) for x in df_to_match.NAME]
+def scan_messages(driver, chat=TO_UPDATE):
+    # Returns every incoming message rendered in the chat
+    with METRICS.timer("scrape"):
+        open_chat(driver, chat)
+        # Everything in a single round trip
+        rows = extract_messages(driver)
+    METRICS.set("last_scan_time", time.time())
+    return rows
 
-    # Ensure that names with non-matching ranks do not get selected
-    # Reminder: [True, False] * [1, 2] = [1, 0]
-    matched_score = score * matched_rank
-    max_score = max(matched_score)
 
-    if max_score > 3:
-        match = [x == max_score for x in matched_score]
-        if sum(match) > 1:
-            logging.info(f"{name}: Multiple Names Matched!")
-            return [False] * len(score)
+def backfill(driver, state, seen_messages, last_checked, chat=TO_UPDATE):
+    # Parses what was sent since last_checked but is no longer rendered, e.g.
+    # after the bot was down. Returns the new last_checked. If it fails part
+    # way, what was parsed is kept and the normal scans carry on from there.
+    recovered = 0
+    cur_time = last_checked
+    with METRICS.timer("backfill"):
+        try:
+            open_chat(driver, chat)
+            rendered, reached = scroll_back(
+                driver,
+                last_checked,
+                seen_messages,
+                max_scrolls=BACKFILL_MAX_SCROLLS,
+                max_messages=BACKFILL_MAX_MESSAGES,
+                wait=BACKFILL_SCROLL_WAIT,
+            )
+            if not reached:
+                logging.warning(
+                    "Backfill gave up with %d messages rendered, some sent after %s were missed",
+                    rendered,
+                    last_checked,
+                )
+
+            # Nothing is written out until all of them are parsed
+            with state.lock:
+                for rows in rendered_messages(driver, BACKFILL_BATCH):
+                    # The ones from before last_checked would only push
+                    # handled keys out of seen_messages
+                    rows = [
+                        row
+                        for row in rows
+                        if not row[1] or parse_pre_plain_text(row[1])[0] >= last_checked
+                    ]
+                    recovered += count_new(rows, seen_messages)
+                    cur_time = max(
+                        cur_time, process_messages(rows, state, seen_messages, last_checked)
+                    )
+            scroll_chat(driver, to_top=False)
+        except:
+            logging.error(traceback.format_exc())
+            print(traceback.format_exc())
+            take_screenshot(driver)
+        finally:
+            state.flush()
+
+    METRICS.inc("backfill_messages", recovered)
+    logging.info("Backfill: %d messages since %s", recovered, last_checked)
+    return cur_time
+
+
+def count_new(rows, seen_messages):
+    return sum(1 for row in rows if message_key(*row) not in seen_messages)
+
+
+def process_messages(rows, state, seen_messages, last_checked):
+    # rows: [(message_id, pre_plain_text, text)], from a scan or the observer
+    cur_time = last_checked
+    for message_id, pre_plain_text, message in rows:
+        key = message_key(message_id, pre_plain_text, message)
+        if key in seen_messages:
+            continue
+
+        # Deleted message have no such element
+        if not pre_plain_text:
+            seen_messages.add(key)
+            METRICS.inc("messages_seen")
+            METRICS.inc("messages_skipped")
+            continue
+
+        try:
+            # Filters out irrelevant messages and detail forecast message
+            with METRICS.timer("classification"):
+                parsed = tokenize(message)
+            if parsed is not None:
+                message_time, time_str, sender_str = parse_pre_plain_text(pre_plain_text)
+        except:
+            # Not marked as seen, so it is tried again on the next full scan,
+            # and the rest of the batch still goes through
+            METRICS.inc("parse_errors")
+            logging.error(traceback.format_exc())
+            logging.error("%r %r", pre_plain_text, message)
+            print(traceback.format_exc())
+            continue
+        seen_messages.add(key)
+        METRICS.inc("messages_seen")
+
+        if parsed is None:
+            METRICS.inc("messages_skipped")
         else:
-            return match
-    else:  # No matching rank AND name
-        return [False] * len(score)
-
-
-def parse_reply(message, name, vcom_name):
-    # This is a reply to a message.
-    # This is quite annoying as nsometimes we get replies to replies.
-    # That we mean that we see only the sender, and not the full details.
-    logging.info(f"Parsing Reply: {name} commanded by {vcom_name}")
-
-    # Selecting the person who indicated an update
-    match = match_name(PS_df[["RANK", "NAME"]], name)
-    if vcom_name:
-        match_vcom = match_name(PS_df[["RANK", "NAME"]], vcom_name)
-        match = [any(t) for t in zip(match, match_vcom)]
-
-    row = PS_df[match].index
-    veh = None
-
-    # Let's join up the message for searching...
-    joined_msg = "".join([x.lower() for x in message])
-
-    # This is a good reply, praise the lord
-    # In addition, name and vcom_name should both be populated
-    # Unless one of them isn't our people, but then I don't
-    # care about it anyway.
-    if "to" in joined_msg and "vc" in joined_msg:
-        # Let's get the plate number
-        plate = ""
-        for m in message[1:]:
-            if ":" in m:
-                a, b = m.split(":")
-            elif len(m.split()) > 1:
-                a, b = m.split()
-            else:
-                a = ""
-                b = ""
-
-            if "mid" in a.lower():
-                plate = b.strip()
-                break
-
-        # Normally the case, unless detail left before bot started
-        if plate in ongoingDetails.keys():
-            veh = ongoingDetails[plate]
-
-    # This is a shitty reply :<
-    # Name and only name is always populated for shitty replies
-    elif len(ongoingDetails) > 0:
-        row_n = row.array[0]
-        formal_name = PS_df.at[row_n, "RANK/NAME"]
-        for k, v in ongoingDetails.items():
-            # Found the detail
-            if formal_name in [v.to, v.vcom]:
-                veh = v
-                row = PS_df[
-                    (PS_df["RANK/NAME"] == v.to) | (PS_df["RANK/NAME"] == v.vcom)
-                ].index
-                break
-    else:
-        # I don't understand how ongoingDetails can be empty and still parsing a reply
-        pass
-
-    # Updating latest message
-    PS_df.loc[row, "LatestUpdate"] = f"{datetime.today()}\n" + "\n".join(message)
-
-    # These would ensure that all 'RTU' then 'reach' messages are found
-    # ...regardless of destination
-    # Assessments always come back to MHC
-    for i in ["rtu", "assessment", "to mh"]:
-        if i in joined_msg and "reach" in joined_msg.split(i)[-1]:
-            PS_df.loc[row, "STATUS"] = "PRESENT"
-            try:
-                if veh:
-                    ongoingDetails.pop(veh.plate)
-                    logging.info(f"RTU: {', '.join(str(veh).splitlines())}")
-                    update_ongoingDetails()
-                break
-            except:
-                logging.error(traceback.format_exc())
-                logging.error(message)
-                print(traceback.format_exc())
-
-    update_PS()
-
-
-def parse_movement(message, name, vcom_name):
-    # We are sure that this is a movement from point A to B
-    # This would normally necessitate the creation of a new Vehicle class.
-    logging.info(f"Parsing Movement: {name} commanded by {vcom_name}")
-
-    # Selecting the person who indicated an update
-    match = match_name(PS_df[["RANK", "NAME"]], name)
-    if any(match):
-        name_row = PS_df[match].index.array[0]
-        name = PS_df.at[name_row, "RANK/NAME"]
-
-    if vcom_name:
-        match_vcom = match_name(PS_df[["RANK", "NAME"]], vcom_name)
-        match = [any(t) for t in zip(match, match_vcom)]
-
-        if any(match_vcom):
-            vcom_row = PS_df[match_vcom].index.array[0]
-            vcom_name = PS_df.at[vcom_row, "RANK/NAME"]
-
-    row = PS_df[match].index
-
-    # Updating Parade State
-    PS_df.loc[row, "LatestUpdate"] = f"{datetime.today()}\n" + "\n".join(message)
-    PS_df.loc[row, "STATUS"] = "DETAIL"
-    try:
-        # There is no need to check for existing detail because it is a new movement anyway
-        message_details = {
-            "model": message[0].lower().split("mov")[0].split("x")[-1].strip(),
-            "to": name,
-            "vcom": vcom_name,
-            "plate": None,
-            "purpose": None,
-        }
-
-        for m in message[1:]:
-            if ":" in m:
-                a, b = m.split(":")
-            elif len(m.split()) > 1:
-                fragments = m.split()
-                a = fragments[0]
-                b = " ".join(fragments[1:])
-            else:
-                a = ""
-                b = ""
-
-            if "mid" in a.lower():
-                message_details["plate"] = b.strip()
-            elif "purpose" in a.lower():
-                message_details["purpose"] = b.strip()
-
-        if message_details["plate"]:
-            veh = Vehicle(**message_details)
-            ongoingDetails[message_details["plate"]] = veh
-            logging.info(f"New movement logged: [{'], ['.join(str(veh).splitlines())}]")
-            update_ongoingDetails()
-    except:
-        logging.error(traceback.format_exc())
-        logging.error(message)
-        print(traceback.format_exc())
+            if message_time < last_checked:
+                METRICS.inc("messages_skipped")
+                continue
+
+            parsed.sender = sender_str
+            parsed.time = message_time
+            logging.info("Message sent at: %s", time_str)
+            ok = True
+            with state.lock:
+                try:
+                    with METRICS.timer("state_update"):
+                        state.parse_message(parsed)
+                    METRICS.inc("messages_parsed")
+                except:
+                    ok = False
+                    METRICS.inc("parse_errors")
+                    logging.error(traceback.format_exc())
+                    logging.error("%s", parsed.lines)
+                    print(traceback.format_exc())
+                # Even if it failed, parsing it again after a restart won't help
+                state.record_message(key, message_time)
+            lag = record_lag(message_time)
+            if events_enabled():
+                event(
+                    "message_parsed",
+                    key=key,
+                    sent=message_time,
+                    sender=sender_str,
+                    kind=parsed.kind,
+                    to=parsed.to,
+                    vc=parsed.vc,
+                    plate=parsed.plate,
+                    returned=parsed.returned,
+                    ok=ok,
+                    lag=round(lag, 1),
+                )
 
-    update_PS()
-
-
-def parse_message(message, sender_str=None):
-    name = None
-    vcom_name = None
-    for m in message:
-        if m.lower().startswith("to"):
-            name = m.split(":")[-1].strip()
-        elif m.lower().startswith("vc"):
-            vcom_name = m.split(":")[-1].strip()
-
-    # Suppose this is a reply to a reply, so no 'TO:'
-    # This is assuming I saved their contacts
-    # e.g. ['NAME', 'NAME', 'RTU', 'Reached', TIMESTAMP]
-    # Unexpected behaviour if we are assessing fam for external people
-    # in which case vcom and to is the same person.
-    if not name:
-        name_rank = sender_str.split(",")[0].replace("(", "")
-        name_split = name_rank.split()
-        name = " ".join(name_split[-1:] + name_split[:-1])
-
-    start_line = 0
-    if message[0][0].isnumeric():
-        start_line = 0
-    elif message[0] == message[1] or (
-        message[2][0].isnumeric() and ":" not in message[2]
-    ):
-        start_line = 2
-    else:
-        start_line = 1
+            # Minute granularity is fine, same-minute messages are told
+            # apart by seen_messages
+            cur_time = max(cur_time, message_time)
 
-    if message[0] == message[1] or "reach" in message[-2].lower():
-        parse_reply(message[start_line:], name, vcom_name)
-    else:
-        parse_movement(message[start_line:], name, vcom_name)
+    return cur_time
 
 
-def initialize_PS(keep_remarks=False):
-    PS_content = PSsheet.get_all_values()[1:]
-    if keep_remarks:
-        PS_df = pd.DataFrame(PS_content).drop(
-            columns=list(range(8, len(PS_content[0])))
-        )
-    else:
-        PS_df = pd.DataFrame(PS_content).drop(
-            columns=list(range(7, len(PS_content[0])))
-        )
-    PS_df.columns = [x.strip() for x in PS_df.iloc[0]]
-    PS_df = (
-        PS_df.set_index("S/N")
-        .drop(index="S/N")
-        .replace("", pd.NA)
-        .dropna(thresh=2)
-        .convert_dtypes()
-        .replace(pd.NA, "")
+def record_lag(message_time):
+    # Seconds from a message being sent to it being parsed. Message times are
+    # to the minute, so this reads up to a minute high.
+    # Only warns when going over the threshold, not for every message after
+    lag = max(0.0, (datetime.today() - message_time).total_seconds())
+    previous = METRICS.gauges.get("ingest_lag_seconds_last", 0)
+    METRICS.observe("ingest_lag_seconds", lag)
+    METRICS.set("ingest_lag_seconds_last", lag)
+    if lag > INGEST_LAG_ALERT:
+        METRICS.inc("ingest_lag_alerts")
+        if previous <= INGEST_LAG_ALERT:
+            logging.warning("Message from %s parsed %.0fs after it was sent", message_time, lag)
+    return lag
+
+
+def start_driver():
+    ## Starting WhatsApp Bot Chrome Driver
+    options = Options()
+    options.headless = True
+    options.add_argument("user-data-dir=D:\\Downloads\\whatsapp_profiles\\")
+    options.add_argument(
+        "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.102 Safari/537.36"
     )
-    PS_df.index = pd.to_numeric(PS_df.index)
-    PS_df["LatestUpdate"] = ""
-
-    # In case ASA cleared the STATUS, assuming they WFH
-    PS_df["STATUS"] = PS_df.STATUS.fillna("WFH")
-    PS_df["VOCATION"] = PS_df.VOCATION.fillna("TBD")
-    PS_df["PLATOON"] = PS_df.PLATOON.fillna("TBD")
-    PS_df["RANK/NAME"] = PS_df.RANK + " " + PS_df.NAME
-    logging.debug("INITIALIZATION: " + PS_df.to_string())
-    return PS_df
-
-
-def update_PS():
-    logging.debug("WRITING: " + PS_df.to_string())
-    sh.values_clear("'Auto_Generated'!A1:H100")
-    GENsheet.batch_update(
-        [
-            {"range": "I2", "values": [[str(datetime.today())]]},
-            {
-                "range": "A1",
-                "values": [list(PS_df.reset_index().columns)]
-                + PS_df.to_records().tolist(),
-            },
-        ]
+    options.add_argument("disable-gpu")
+    options.add_argument("window-size=960,1080")
+    driver = webdriver.Chrome(
+        executable_path=".\chromedriver_win32\chromedriver.exe", options=options
     )
-    logging.info(f"Parade State updated at: {datetime.today()}")
 
+    driver.get("https://web.whatsapp.com/")
+    time.sleep(15)
+    take_screenshot(driver)
 
-def update_ongoingDetails():
-    sh.values_clear("'Daily Reporting'!B2:B100")
-    DRsheet.update(
-        "B2",
-        [[str(datetime.today())], [], []]
-        + [[f"{k}\n{str(v)}"] for k, v in ongoingDetails.items()],
+    # Wait for QR code to be scanned, timeout 120 for Whatsapp Web
+    WebDriverWait(driver, 120).until(
+        EC.invisibility_of_element_located((By.CLASS_NAME, "landing-wrapper"))
     )
+    time.sleep(10)
+    return driver
 
 
-def check_messages(last_checked):
-    # Do not change last checked time if every element fails
-    cur_time = last_checked
-    WebDriverWait(driver, 20).until(
-        EC.presence_of_element_located(
-            (By.XPATH, f"//*[contains(@title, {TO_UPDATE})]")
-        )
-    )
-    driver.find_element_by_xpath(f"//*[contains(@title, {TO_UPDATE})]").click()
+def housekeeping(state, scheduler):
+    # The manual refresh flag and the daily jobs, every minute or so
+    time_now = datetime.today()
+    logging.debug("Last Run at: %s", time_now)
+    print(f"Last Run at: {time_now}", flush=True)
 
     try:
-        results = driver.find_elements_by_class_name("message-in")
-        results[0].send_keys(Keys.PAGE_UP)
-    except StaleElementReferenceException:
-        logging.warning("Stale Element Reference Exception during scrolling up.")
+        state.check_refresh_flag()
+        state.verify_outputs()
+    except:
+        logging.error(traceback.format_exc())
+        print(traceback.format_exc())
 
+    # Morning refresh and afternoon temperature list, caught up if missed.
+    # A job that fails (e.g. Sheets still down after the retries) waits until
+    # it is next due, the bot carries on.
     try:
-        results = driver.find_elements_by_class_name("message-in")
-        results[-1].send_keys(Keys.END)
-    except StaleElementReferenceException:
-        logging.warning("Stale Element Reference Exception during scrolling down.")
-
-    results = driver.find_elements_by_class_name("message-in")
-    for elem in results:
-
-        # The time of the message is hidden here
-        time_str_elements = elem.find_elements_by_class_name("copyable-text")
+        scheduler.run_pending()
+    except:
+        logging.error(traceback.format_exc())
+        print(traceback.format_exc())
 
-        # Deleted message have no such element
-        if len(time_str_elements) > 0:
-            # Parsing the time string
-            time_str = time_str_elements[0].get_attribute("data-pre-plain-text")
-            sender_str = time_str.split("]")[-1].strip()
-            time_str = time_str[time_str.find("[") + 1 : time_str.find("]")]
-
-            hour_str, date_str = time_str.split(",")
-            hour, minute = [int(x) for x in hour_str.split(":")]
-            day, month, year = [int(x) for x in date_str.split("/")]
-            message_time = datetime(year, month, day, hour % 24, minute)
-
-            # sanity check wtf why they switch the day and dates
-            if (message_time - datetime.today()).days > 1:
-                month, day, year = [int(x) for x in date_str.split("/")]
-                message_time = datetime(year, month, day, hour % 24, minute)
-
-            try:
-                message = elem.text
-                # Filters out irrelevant messages and detail forecast message
-                if (
-                    ("MID" in message)
-                    and any([x in message.lower() for x in ["to:", "to :"]])
-                ) or all([x in message.lower() for x in ["rtu", "reach"]]):
-                    message = message.splitlines()
-                    # Remove empty lines
-                    message = [x for x in message if x]
-                    if message_time >= last_checked:
-                        logging.info(f"Message sent at: {time_str}")
-                        parse_message(message, sender_str)
-
-                        # Update the checked time
-                        today = datetime.today()
-                        cur_time = datetime(
-                            today.year, today.month, today.day, today.hour, today.minute
-                        )
-
-            except StaleElementReferenceException:
-                logging.warning("Element expired while reading element text...")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Output writes: %s", state.outputs.stats())
+        if state.sinks is not None:
+            logging.debug("Output sinks: %s", state.sinks.stats())
+        logging.debug("Sheets quota: %s", state.PSsheet.client.stats())
+
+
+def run_loop(driver, state, seen_messages, last_checked, poller=None):
+    # Everything in turn in one thread. With the observer, its queue is
+    # drained every DRAIN_INTERVAL, as that is cheap and is how new messages
+    # get picked up. Otherwise full scans are often while messages are coming
+    # in and back off when it goes quiet, see adaptive_poll.py. Housekeeping
+    # backs off outside active hours either way.
+    poller = poller or AdaptivePoller(
+        MIN_POLL_INTERVAL,
+        MAX_POLL_INTERVAL,
+        OFF_HOURS_POLL_INTERVAL,
+        active_hours=ACTIVE_HOURS,
+    )
+    scheduler = Scheduler(default_jobs(state))
+    observe = INGEST_MODE == "observer"
+    if observe:
+        install_observer(driver)
+
+    next_scan = next_housekeeping = time.time()
+    while True:
+        new = 0
+        try:
+            rows = drain_messages(driver) if observe else []
+            # The observer only sees what is rendered, so a full scan of the
+            # chat every so often as a fallback
+            if not observe or time.time() >= next_scan:
+                rows += scan_messages(driver)
+                next_scan = time.time() + FULL_SCAN_INTERVAL
+            new = count_new(rows, seen_messages)
+            last_checked = process_messages(rows, state, seen_messages, last_checked)
+        except:
+            logging.error(traceback.format_exc())
+            print(traceback.format_exc())
+            take_screenshot(driver)
+
+        if time.time() >= next_housekeeping:
+            housekeeping(state, scheduler)
+            next_housekeeping = time.time() + (
+                HOUSEKEEPING_INTERVAL if poller.active() else OFF_HOURS_POLL_INTERVAL
+            )
+            logging.debug("Polling: %s", poller.stats())
 
-    return cur_time
+        # Write out everything that changed during this pass
+        state.flush()
+        screenshot_if_requested(driver)
 
+        interval = poller.update(new)
+        if observe:
+            interval = min(interval, DRAIN_INTERVAL)
+        METRICS.set("poll_interval_seconds", interval)
+        time.sleep(max(0, min(interval, next_housekeeping - time.time())))
 
-def generate_temperature_list(is_morning=True):
-    df = initialize_PS(keep_remarks=True)
-    df["STATUS"] = df.STATUS.fillna("WFH")
 
-    today = datetime.today()
-    if is_morning:
-        time_str = "0800hrs"
-    else:
-        time_str = "1500hrs"
-
-    return_str = (
-        "*Temperature Monitoring*\n\n"
-        + "Grouping : CMTL (Mandai Hill Node)\n"
-        + f"Date: {today.strftime('%d%m%y')}\n"
-        + f"Time: {time_str}\n\n"
-        + f"{'='*22}\n\n"
-        + f"Total Strength: {len(df)}\n"
-        + f"Present Strength: {sum(df.STATUS.str.contains('PRESENT').dropna()|df.STATUS.str.contains('REST').dropna())+1}\n"
-        + "({0[HQ PLATOON]} from HQ, {0[PLATOON 1]} from PLT 1, {0[PLATOON 2]} from PLT 2, 1 AMB TO)\n".format(
-            {p: sum(x.STATUS.str.contains("PRESENT")) for p, x in df.groupby("PLATOON")}
-        )
-        + f"Temperature Taking Strength: {sum(df.STATUS.str.contains('PRESENT').dropna())}\n"
-        + "({0[HQ PLATOON]} from HQ, {0[PLATOON 1]} from PLT 1, {0[PLATOON 2]} from PLT 2)\n\n\n".format(
-            {p: sum(x.STATUS.str.contains("PRESENT")) for p, x in df.groupby("PLATOON")}
-        )
-        + "Reason for not taking (Rank/Name & Reason):"
+def load_state(gc, config, bucket, journal_dir, history_dir):
+    # ParadeState for one of GROUPS, restored from its journal if there is one
+    sh = SheetsClient(gc.open_by_key(config["spreadsheet"]), bucket=bucket)
+    journal = StateJournal(
+        journal_dir, fsync_every=JOURNAL_FSYNC_EVERY, snapshot_every=SNAPSHOT_EVERY
     )
-
-    for label, gp in df.groupby("STATUS"):
-        return_str += "\n\n"
-        if any([x in label for x in ["PRESENT", "RS"]]):
-            return_str = return_str[:-2]
-        elif "AO" in label:
-            amb_gp = gp[gp.REMARKS.str.contains("AMB DUTY")]
-            return_str += "AMBULANCE DUTY (1 pax)\n" + "\n".join(
-                [
-                    "{0}. {1}".format(i + 1, amb_gp.iloc[i]["RANK/NAME"])
-                    for i in range(len(amb_gp))
-                ]
-            )
-            ao_gp = gp[~(gp.REMARKS.str.contains("AMB DUTY"))]
-            if len(ao_gp) > 0:
-                return_str += f"\n\nAO ({len(ao_gp)} pax)\n" + "\n".join(
-                    [
-                        "{0}. {1}".format(i + 1, ao_gp.iloc[i]["RANK/NAME"])
-                        for i in range(len(ao_gp))
-                    ]
+    state = ParadeState(
+        sh.worksheet(config.get("ps", PS_WORKSHEET)),
+        sh.worksheet(config.get("gen", GEN_WORKSHEET)),
+        sh.worksheet(config.get("dr", DR_WORKSHEET)),
+        write_debounce=WRITE_DEBOUNCE,
+        journal=journal,
+        sheets_batch=sh.batch,
+        history=MovementHistory(history_dir),
+    )
+    if OUTPUT_SINKS:
+        sinks = [SheetsSink(state)]
+        if OUTPUT_JSON_DIR:
+            os.makedirs(OUTPUT_JSON_DIR, exist_ok=True)
+            sinks.append(JsonFileSink(os.path.join(OUTPUT_JSON_DIR, f"{config['name']}.json")))
+        if OUTPUT_WEBHOOK_URL:
+            sinks.append(
+                WebhookSink(
+                    OUTPUT_WEBHOOK_URL,
+                    chat_id=config.get("webhook_chat_id", OUTPUT_WEBHOOK_CHAT_ID),
                 )
-        else:
-            return_str += f"{label} ({len(gp)} pax)\n" + "\n".join(
-                [
-                    "{0}. {1}".format(i + 1, gp.iloc[i]["RANK/NAME"])
-                    for i in range(len(gp))
-                ]
             )
+        # atexit goes last to first, so the final flush is published before
+        # the sinks are closed
+        atexit.register(state.use_sinks(sinks).close)
+    atexit.register(state.flush, force=True)
 
-    rs_gp = df[df.STATUS.str.contains("RS")]
-    return_str += (
-        f"\n\n{'='*22}\n\n"
-        + f"Any report sick ({len(rs_gp)} pax): (Rank/Name & Reason)\n"
-        + "\n".join(
-            [
-                "{0}. {1}".format(i + 1, rs_gp.iloc[i]["RANK/NAME"])
-                for i in range(len(rs_gp))
-            ]
-        )
-    )
-    DRsheet.batch_update(
-        [
-            {"range": "A2", "values": [[str(datetime.today())]]},
-            {"range": "A5", "values": [[return_str]]},
-        ]
-    )
-    logging.info(f"Temperature List Updated at: {datetime.today()}")
+    today = datetime.today()
+    last_checked = datetime(today.year, today.month, today.day, 8, 0)
+    seen_messages = SeenMessages()
+    if state.restore():
+        # Warm restart, carry on from the last message parsed
+        for key in state.applied_messages:
+            seen_messages.add(key)
+        if state.last_message_time:
+            last_checked = max(last_checked, state.last_message_time)
+        # The scheduler only catches up on what it missed while running, so a
+        # roster from before the last morning refresh (e.g. the bot was down
+        # overnight) is read again here, STATUS and all
+        refresh = next(job for job in default_jobs(state) if job.name == MORNING_REFRESH)
+        due = refresh.last_due(datetime.today())
+        if state.roster_loaded_at is None or (due and state.roster_loaded_at < due):
+            logging.info("Roster loaded at %s, before %s, refreshing", state.roster_loaded_at, due)
+            state.refresh()
+    else:
+        # On first initialization
+        state.load_roster()
+        state.generate_temperature_list(is_morning=datetime.today().hour < 12)
+    return state, seen_messages, last_checked
 
 
 ###############################################################################
 ### Starting Application                                                    ###
 ###############################################################################
 
-# Loading Parade State
-logging.info("Started")
-gc = gspread.service_account()
-sh = gc.open_by_key("1qxDItGZJWAXTyvR6HK8p2g4gF49rrtwQ6sTfZe7z9I4")
-
-PSsheet = sh.worksheet("MHN Parade State")  # Parade State
-GENsheet = sh.worksheet("Auto_Generated")  # Machine Generated Sheet
-DRsheet = sh.worksheet("Daily Reporting")  # Daily reporting sheet
-
-# On first initialization
-today = datetime.today()
-last_checked = datetime(today.year, today.month, today.day, 8, 0)
-PS_df = initialize_PS()
-generate_temperature_list(is_morning=datetime.today().hour < 12)
-
-## Starting WhatsApp Bot Chrome Driver
-options = Options()
-options.headless = True
-options.add_argument("user-data-dir=D:\\Downloads\\whatsapp_profiles\\")
-options.add_argument(
-    "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.102 Safari/537.36"
-)
-options.add_argument("disable-gpu")
-options.add_argument("window-size=960,1080")
-driver = webdriver.Chrome(
-    executable_path=".\chromedriver_win32\chromedriver.exe", options=options
-)
-
-driver.get("https://web.whatsapp.com/")
-time.sleep(15)
-driver.save_screenshot(".\screenshot.png")
-
-# Wait for QR code to be scanned, timeout 120 for Whatsapp Web
-WebDriverWait(driver, 120).until(
-    EC.invisibility_of_element_located((By.CLASS_NAME, "landing-wrapper"))
-)
-time.sleep(10)
 
-ongoingDetails = dict()
-# Run continuously
-while True:
-    try:
-        last_checked = check_messages(last_checked)
-    except:
-        logging.error(traceback.format_exc())
-        print(traceback.format_exc())
+def main():
+    setup_logging(
+        LOG_FILE,
+        EVENTS_FILE,
+        level=LOG_LEVEL,
+        max_bytes=LOG_MAX_BYTES,
+        backups=LOG_BACKUPS,
+    )
 
-    driver.save_screenshot(".\screenshot.png")
-    time_now = datetime.today()
-    logging.debug(f"Last Run at: {time_now}")
-    print(f"Last Run at: {time_now}", flush=True)
+    # Loading Parade State
+    logging.info("Started")
+    if METRICS_PORT is not None:
+        try:
+            serve_metrics(METRICS_PORT)
+        except OSError:
+            # e.g. the port is taken, the bot runs fine without it
+            logging.warning("Could not serve metrics on port %s", METRICS_PORT, exc_info=True)
+    if METRICS_DUMP:
+        dump_every(METRICS_DUMP, METRICS_DUMP_INTERVAL)
+    gc = gspread.service_account()
+    # The quota is per user, so every spreadsheet draws from the same bucket
+    bucket = TokenBucket(SHEETS_RATE, SHEETS_BURST)
+
+    if len(GROUPS) > 1:
+        from group_monitor import Group, GroupMonitor
+
+        groups = []
+        for config in GROUPS:
+            state, seen_messages, last_checked = load_state(
+                gc,
+                config,
+                bucket,
+                os.path.join(JOURNAL_DIR, config["name"]),
+                os.path.join(HISTORY_DIR, config["name"]),
+            )
+            groups.append(
+                Group(config["name"], config["chat"], state, last_checked, seen_messages)
+            )
+        driver = start_driver()
+        if BACKFILL:
+            for group in groups:
+                group.last_checked = backfill(
+                    driver, group.state, group.seen_messages, group.last_checked, group.chat
+                )
+        monitor = GroupMonitor(
+            driver,
+            groups,
+            scan=scan_messages,
+            process=process_messages,
+            workers=GROUP_WORKERS,
+        )
+        atexit.register(monitor.close)
+        monitor.run()
+        return
 
-    try:
-        if DRsheet.get("A4") == [["TRUE"]]:
-            PS_df = initialize_PS()
-            update_PS()
-            generate_temperature_list(is_morning=datetime.today().hour < 12)
-            DRsheet.update_cell(4, 1, "FALSE")
-    except:
-        logging.error(traceback.format_exc())
-        print(traceback.format_exc())
+    state, seen_messages, last_checked = load_state(
+        gc, GROUPS[0], bucket, JOURNAL_DIR, HISTORY_DIR
+    )
 
-    # Reinitialize on a weekday
-    if time_now.weekday() < 5:  # Monday == 0
-        if time_now.hour == 8 and time_now.minute == 10:
-            PS_df = initialize_PS()
-            update_PS()
-            generate_temperature_list(is_morning=True)
+    driver = start_driver()
+    if BACKFILL:
+        last_checked = backfill(driver, state, seen_messages, last_checked)
+    if RUNTIME == "async":
+        import asyncio
+        from async_runtime import AsyncRuntime
+
+        runtime = AsyncRuntime(
+            driver,
+            state,
+            seen_messages,
+            last_checked,
+            scan=scan_messages,
+            process=process_messages,
+            observe=INGEST_MODE == "observer",
+            drain_interval=DRAIN_INTERVAL,
+            scan_interval=FULL_SCAN_INTERVAL,
+        )
+        asyncio.run(runtime.run())
+        return
 
-        elif time_now.hour == 14 and time_now.minute == 10:
-            generate_temperature_list(is_morning=False)
+    run_loop(driver, state, seen_messages, last_checked)
 
-    time.sleep(60 - time.time() % 60)
+if __name__ == "__main__":
+    main()
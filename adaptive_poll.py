@@ -0,0 +1,60 @@
+# How often to look for new messages
+#
+# Polling at a fixed rate either wastes browser and network time when the
+# group is quiet (most of the day, and all night), or picks up messages late
+# when it is busy. AdaptivePoller goes down to min_interval as soon as a poll
+# finds something new, and backs off by `backoff` with every poll that finds
+# nothing, up to max_interval during active hours and off_hours_interval
+# outside them.
+from datetime import datetime
+
+
+class AdaptivePoller:
+    def __init__(
+        self,
+        min_interval=2,
+        max_interval=60,
+        off_hours_interval=300,
+        backoff=2.0,
+        active_hours=(7, 22),
+        clock=None,
+    ):
+        # Intervals in seconds. active_hours: (first hour, hour after the
+        # last), in local time.
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.off_hours_interval = off_hours_interval
+        self.backoff = backoff
+        self.active_hours = active_hours
+        self.clock = clock or datetime.today
+        self.interval = min_interval
+
+        self.polls = 0
+        self.busy_polls = 0
+
+    def active(self, now=None):
+        now = now or self.clock()
+        first, last = self.active_hours
+        return first <= now.hour < last
+
+    def ceiling(self, now=None):
+        return self.max_interval if self.active(now) else self.off_hours_interval
+
+    def update(self, new_messages, now=None):
+        # After a poll that found new_messages, seconds until the next one
+        self.polls += 1
+        if new_messages:
+            self.busy_polls += 1
+            self.interval = self.min_interval
+        else:
+            self.interval = self.interval * self.backoff
+        # Also brings the interval down when active hours start
+        self.interval = min(self.interval, self.ceiling(now))
+        return self.interval
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "polls": self.polls,
+            "busy_polls": self.busy_polls,
+        }
@@ -0,0 +1,170 @@
+# Asyncio runtime
+#
+# The plain loop in WhatsappBot.py does everything one after the other, so a
+# slow Sheets call holds up reading WhatsApp, and the scheduled jobs only run
+# if a pass lands in the right minute. Here each of these is its own task:
+#  - ingest: drains the observer queue (and does a full scan now and then),
+#  - parse: parses what ingest found,
+#  - output: flushes dirty outputs to Google Sheets,
+#  - manual refresh: polls the A4 flag, and reads back the generated blocks
+#    now and then to catch edits made by hand,
+#  - schedule: runs the daily jobs, catching up on any that were missed.
+# Selenium, parsing and Sheets calls are blocking, so each runs on its own
+# single thread; the event loop only coordinates. Ingest and parse are joined
+# by a bounded queue, so if parsing falls behind, scraping waits for it.
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import time
+import traceback
+
+from scheduler import Scheduler, default_jobs
+from whatsapp_scraper import (
+    drain_messages,
+    install_observer,
+    screenshot_if_requested,
+    take_screenshot,
+)
+
+
+class AsyncRuntime:
+    def __init__(
+        self,
+        driver,
+        state,
+        seen_messages,
+        last_checked,
+        scan,
+        process,
+        observe=True,
+        drain_interval=1,
+        scan_interval=60,
+        flush_interval=1,
+        refresh_interval=60,
+        schedule_interval=30,
+        queue_size=50,
+        jobs=None,
+    ):
+        # scan(driver) -> rows, process(rows, state, seen_messages, last_checked)
+        # -> last_checked; see WhatsappBot.scan_messages/process_messages
+        self.driver = driver
+        self.state = state
+        self.seen_messages = seen_messages
+        self.last_checked = last_checked
+        self.scan = scan
+        self.process = process
+        self.observe = observe
+        self.drain_interval = drain_interval
+        self.scan_interval = scan_interval
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self.schedule_interval = schedule_interval
+        self.queue_size = queue_size
+        self.scheduler = Scheduler(jobs if jobs is not None else default_jobs(state))
+
+        self.browser = ThreadPoolExecutor(1, thread_name_prefix="browser")
+        self.parser = ThreadPoolExecutor(1, thread_name_prefix="parser")
+        self.sheets = ThreadPoolExecutor(1, thread_name_prefix="sheets")
+
+    async def _run_in(self, executor, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    def _log_error(self):
+        logging.error(traceback.format_exc())
+        print(traceback.format_exc())
+
+    async def ingest(self):
+        if self.observe:
+            await self._run_in(self.browser, install_observer, self.driver)
+        next_scan = time.monotonic()
+        while True:
+            try:
+                if self.observe:
+                    rows = await self._run_in(self.browser, drain_messages, self.driver)
+                    if rows:
+                        await self.queue.put(rows)
+
+                if time.monotonic() >= next_scan:
+                    next_scan = time.monotonic() + self.scan_interval
+                    rows = await self._run_in(self.browser, self.scan, self.driver)
+                    await self.queue.put(rows)
+                    print(f"Last Run at: {time.strftime('%H:%M:%S')}", flush=True)
+                await self._run_in(self.browser, screenshot_if_requested, self.driver)
+            except Exception:
+                self._log_error()
+                await self._run_in(self.browser, take_screenshot, self.driver)
+
+            await asyncio.sleep(self.drain_interval if self.observe else self.scan_interval)
+
+    async def parse(self):
+        while True:
+            rows = await self.queue.get()
+            try:
+                self.last_checked = await self._run_in(
+                    self.parser,
+                    self.process,
+                    rows,
+                    self.state,
+                    self.seen_messages,
+                    self.last_checked,
+                )
+            except Exception:
+                self._log_error()
+            finally:
+                self.queue.task_done()
+            self.dirty.set()
+
+    async def output(self):
+        # Marks made while a flush is running, or during the pause after it,
+        # are picked up by the next flush
+        while True:
+            await self.dirty.wait()
+            self.dirty.clear()
+            try:
+                await self._run_in(self.sheets, self.state.flush)
+            except Exception:
+                self._log_error()
+            await asyncio.sleep(self.flush_interval)
+
+    async def manual_refresh(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                if await self._run_in(self.sheets, self.state.check_refresh_flag):
+                    self.dirty.set()
+                if await self._run_in(self.sheets, self.state.verify_outputs):
+                    self.dirty.set()
+            except Exception:
+                self._log_error()
+
+    async def schedule(self):
+        while True:
+            for due, job in self.scheduler.due():
+                try:
+                    await self._run_in(self.sheets, job.fn)
+                except Exception:
+                    self._log_error()
+                finally:
+                    self.scheduler.mark_run(job, due)
+                self.dirty.set()
+            await asyncio.sleep(self.schedule_interval)
+
+    async def run(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.dirty = asyncio.Event()
+        tasks = [
+            asyncio.create_task(self.ingest(), name="ingest"),
+            asyncio.create_task(self.parse(), name="parse"),
+            asyncio.create_task(self.output(), name="output"),
+            asyncio.create_task(self.manual_refresh(), name="manual refresh"),
+            asyncio.create_task(self.schedule(), name="schedule"),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Whatever was parsed still gets written
+            await self._run_in(self.sheets, self.state.flush, True)
+            for executor in [self.browser, self.parser, self.sheets]:
+                executor.shutdown(wait=False)
@@ -0,0 +1,156 @@
+# Benchmark for catching up after downtime
+#
+# Parses the first part of a day of messages, then "restarts" with the rest
+# of the day sent while the bot was down. WhatsApp Web only renders the last
+# --window of them, the others load as the chat is scrolled up. Compares:
+#
+#   scan          what a restart did before: one full scan of what is rendered
+#   per message   backfill, but writing to the sheets after every message
+#   backfill      backfill, one write to the sheets at the end
+#
+# and reports how many of the missed messages each recovered, whether the
+# state ends up the same as parsing every message in order, the WebDriver and
+# Sheets calls, and the peak Python memory for a few --batch sizes.
+#
+# Usage: python benchmarks/bench_backfill.py [--before 200] [--missed 2000]
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from replay import load_bot  # noqa: E402
+from stand_ins import FakeDriver, FakeSpreadsheet, FakeWorksheet  # noqa: E402
+from synthetic import synthetic_messages, synthetic_roster, synthetic_sheet  # noqa: E402
+
+
+def setup(bot, args):
+    # State with the first --before messages parsed, and a driver with the
+    # whole day in the chat, the last --window of it rendered
+    from parade_state import ParadeState
+    from whatsapp_scraper import SeenMessages
+
+    rng = random.Random(args.seed)
+    roster = synthetic_roster(200, rng)
+    today = datetime.today()
+    day = datetime(today.year, today.month, today.day, 8, 0) - timedelta(days=1)
+    messages = synthetic_messages(roster, args.before + args.missed, rng, start=day)
+
+    sh = FakeSpreadsheet(
+        [
+            FakeWorksheet("MHN Parade State", synthetic_sheet(roster, rng)),
+            FakeWorksheet("Auto_Generated"),
+            FakeWorksheet("Daily Reporting"),
+        ]
+    )
+    state = ParadeState.from_spreadsheet(sh)
+    state.load_roster()
+    seen_messages = SeenMessages()
+    last_checked = bot.process_messages(messages[: args.before], state, seen_messages, day)
+    state.flush()
+
+    driver = FakeDriver(window=args.window, page=args.page)
+    driver.chat = bot.TO_UPDATE.strip("'")
+    driver.messages = list(messages[-args.window :])
+    driver.older = list(messages[: -args.window])
+    return state, seen_messages, last_checked, driver, sh, messages
+
+
+def outcome(state):
+    return (
+        [p.status for p in state.roster],
+        sorted(v.plate for v in state.ongoingDetails),
+    )
+
+
+def run(bot, args, mode, batch=None):
+    state, seen_messages, last_checked, driver, sh, messages = setup(bot, args)
+    missed = {m[0] for m in messages[args.before :]}
+    calls, driver_calls = sh.api_calls(), driver.calls
+    bot.BACKFILL_BATCH = batch or args.batch
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if mode == "scan":
+        bot.check_messages(driver, state, seen_messages, last_checked)
+        state.flush()
+    elif mode == "per message":
+        # Scrolled back the same way, then written out one message at a time
+        bot.scroll_back(driver, last_checked, seen_messages, wait=0)
+        for rows in bot.rendered_messages(driver, bot.BACKFILL_BATCH):
+            for row in rows:
+                bot.process_messages([row], state, seen_messages, last_checked)
+                state.flush()
+    else:
+        bot.backfill(driver, state, seen_messages, last_checked)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "recovered": len(missed & set(seen_messages)),
+        "outcome": outcome(state),
+        "elapsed": elapsed,
+        "sheet_calls": sh.api_calls() - calls,
+        "driver_calls": driver.calls - driver_calls,
+        "scrolls": driver.scrolls,
+        "peak": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--before", type=int, default=200)
+    parser.add_argument("--missed", type=int, default=2000)
+    parser.add_argument("--window", type=int, default=100, help="Messages rendered")
+    parser.add_argument("--page", type=int, default=30, help="Loaded per scroll")
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        bot = load_bot()
+        bot.BACKFILL_SCROLL_WAIT = 0
+        bot.BACKFILL_MAX_MESSAGES = args.before + args.missed + args.window
+        bot.BACKFILL_MAX_SCROLLS = bot.BACKFILL_MAX_MESSAGES // args.page + 10
+
+        # Every message parsed in order, what the others should end up with
+        state, seen_messages, last_checked, _, _, messages = setup(bot, args)
+        bot.process_messages(messages[args.before :], state, seen_messages, last_checked)
+        expected = outcome(state)
+
+        results = {mode: run(bot, args, mode) for mode in ["scan", "per message", "backfill"]}
+        batches = {batch: run(bot, args, "backfill", batch) for batch in [50, 200, 1000, 10**9]}
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print(f"{args.missed} messages missed, {args.window} rendered, {args.page} loaded per scroll")
+    print(
+        f"{'':>12} {'recovered':>10} {'same state':>11} {'ms':>8} "
+        f"{'Sheets calls':>13} {'WebDriver calls':>16} {'scrolls':>8}"
+    )
+    for mode, r in results.items():
+        print(
+            f"{mode:>12} {r['recovered']:>10} {str(r['outcome'] == expected):>11} "
+            f"{r['elapsed'] * 1e3:8.1f} {r['sheet_calls']:>13} {r['driver_calls']:>16} "
+            f"{r['scrolls']:>8}"
+        )
+    print("Backfill peak Python memory by batch size:")
+    for batch, r in batches.items():
+        label = "all at once" if batch == 10**9 else str(batch)
+        print(f"  {label:>12} {r['peak'] / 1024:8.0f} KiB  {r['driver_calls']:>5} WebDriver calls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Benchmark for importing a chat export
+#
+# Writes days of synthetic messages to a temporary file in the format of an
+# Android "Export chat", then imports it into a ParadeState backed by the
+# in-memory spreadsheet, and reports lines/s and MB/s, the Sheets calls made
+# for the final flush, and the peak Python memory for a quarter of the export
+# and the whole of it, which should be about the same. Reading and filtering
+# alone are timed too, as name matching takes most of the time: the
+# synthetic names are written differently every time, so they are rarely
+# found in the cache.
+#
+# Usage: python benchmarks/bench_chat_import.py [--days 7] [--per-day 1000]
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from chat_import import (  # noqa: E402
+    ImportStats,
+    group_messages,
+    import_chat,
+    in_range,
+    read_lines,
+    updates,
+)
+from parade_state import ParadeState  # noqa: E402
+from sheets_client import SheetsClient  # noqa: E402
+from stand_ins import FakeSpreadsheet, FakeWorksheet  # noqa: E402
+from synthetic import synthetic_messages, synthetic_roster, synthetic_sheet  # noqa: E402
+from whatsapp_scraper import parse_pre_plain_text  # noqa: E402
+
+
+def write_export(path, roster, days, per_day, rng, start):
+    # Android format, without the time line the page adds at the end
+    with open(path, "w", encoding="utf-8") as f:
+        for day in range(days):
+            for _, pre_plain_text, text in synthetic_messages(
+                roster, per_day, rng, start=start + timedelta(days=day)
+            ):
+                sent, _, sender = parse_pre_plain_text(pre_plain_text)
+                lines = text.splitlines()[:-1]
+                f.write(f"{sent.strftime('%d/%m/%Y, %H:%M')} - {sender} {lines[0]}\n")
+                for line in lines[1:]:
+                    f.write(line + "\n")
+    return os.path.getsize(path)
+
+
+def run(path, roster, rng, until=None, trace=False):
+    sh = FakeSpreadsheet(
+        [
+            FakeWorksheet("MHN Parade State", synthetic_sheet(roster, rng)),
+            FakeWorksheet("Auto_Generated"),
+            FakeWorksheet("Daily Reporting"),
+        ]
+    )
+    client = SheetsClient(sh)
+    state = ParadeState.from_spreadsheet(client)
+    state.load_roster()
+    calls = sh.api_calls()
+
+    if trace:
+        tracemalloc.start()
+    stats = import_chat(path, state, until=until)
+    start = time.perf_counter()
+    state.flush(force=True)
+    flush = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace else None
+    if trace:
+        tracemalloc.stop()
+    return stats, sh.api_calls() - calls, flush, peak, state
+
+
+def read_only(path):
+    # Everything but parse_message
+    stats = ImportStats()
+    for _ in updates(in_range(group_messages(read_lines(path, stats), stats), stats)):
+        stats.updates += 1
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--per-day", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(args.seed)
+    roster = synthetic_roster(300, rng)
+    start = datetime(2024, 1, 1, 8, 0)
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    try:
+        size = write_export(path, roster, args.days, args.per_day, rng, start)
+        stats, calls, flush, _, state = run(path, roster, rng)
+        print(f"Export of {args.days} days, {size / 1e6:.1f} MB:")
+        print(f"  {stats}")
+        print(
+            f"  {stats.bytes / 1e6 / stats.elapsed():.1f} MB/s, "
+            f"{len(state.ongoingDetails)} details out at the end"
+        )
+        print(f"  final flush: {calls} Sheets calls in {flush * 1e3:.1f} ms")
+        stats = read_only(path)
+        print(
+            f"  reading and filtering only: {stats.lines / stats.elapsed():.0f} lines/s, "
+            f"{stats.bytes / 1e6 / stats.elapsed():.1f} MB/s"
+        )
+
+        print("Peak Python memory while importing:")
+        for days in [max(1, args.days // 4), args.days]:
+            until = start + timedelta(days=days)
+            stats, _, _, peak, _ = run(path, roster, rng, until=until, trace=True)
+            print(f"  {days:>4} days, {stats.lines:>9} lines: {peak / 1024:8.0f} KiB")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
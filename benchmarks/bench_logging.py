@@ -0,0 +1,163 @@
+# Benchmark for the logging pipeline
+#
+# Parses synthetic messages through process_messages and a ParadeState with
+# logging set up:
+#
+#   sync file         as the bot used to: basicConfig, writing log.txt from
+#                     the thread that logs
+#   queue             setup_logging: a listener thread writes log.txt and
+#                     events.jsonl
+#   queue, no events  setup_logging without events.jsonl, the bot's default
+#
+# on a normal disk, and on one that takes --slow-disk seconds per write. It
+# reports messages/s, the time per message (i.e. how long parsing is held
+# up), what was written, and records dropped.
+#
+# Usage: python benchmarks/bench_logging.py [--messages 2000] [--slow-disk 0.002]
+import argparse
+import atexit
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from replay import load_bot  # noqa: E402
+from stand_ins import FakeSpreadsheet, FakeWorksheet  # noqa: E402
+from synthetic import synthetic_messages, synthetic_roster, synthetic_sheet  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(p * (len(values) - 1))]
+
+
+def run(bot, args, mode, disk_latency, directory):
+    import structured_logging
+    from parade_state import ParadeState
+    from whatsapp_scraper import SeenMessages
+
+    rng = random.Random(args.seed)
+    roster = synthetic_roster(200, rng)
+    today = datetime.today()
+    start = datetime(today.year, today.month, today.day, 8, 0)
+    messages = synthetic_messages(roster, args.messages, rng, start=start)
+    sh = FakeSpreadsheet(
+        [
+            FakeWorksheet("MHN Parade State", synthetic_sheet(roster, rng)),
+            FakeWorksheet("Auto_Generated"),
+            FakeWorksheet("Daily Reporting"),
+        ]
+    )
+    state = ParadeState.from_spreadsheet(sh)
+    state.load_roster()
+
+    log_path = os.path.join(directory, "log.txt")
+    events_path = os.path.join(directory, "events.jsonl")
+    for path in [log_path, events_path]:
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Every write to a log file takes disk_latency
+    flush = logging.StreamHandler.flush
+
+    def slow_flush(self):
+        time.sleep(disk_latency)
+        flush(self)
+
+    logging.StreamHandler.flush = slow_flush
+    listener = None
+    try:
+        if mode == "sync file":
+            logging.basicConfig(
+                level=logging.INFO,
+                filename=log_path,
+                filemode="w",
+                format=structured_logging.TEXT_FORMAT,
+                datefmt=structured_logging.DATE_FORMAT,
+                force=True,
+            )
+            structured_logging.EVENTS.setLevel(logging.CRITICAL + 1)
+        else:
+            listener = structured_logging.setup_logging(
+                log_path, events_path if mode == "queue" else None
+            )
+        handler = logging.getLogger().handlers[0]
+
+        seen_messages = SeenMessages()
+        last_checked = start
+        per_message = []
+        for row in messages:
+            t = time.perf_counter()
+            last_checked = bot.process_messages([row], state, seen_messages, last_checked)
+            per_message.append(time.perf_counter() - t)
+        if listener is not None:
+            # What is left to write out
+            t = time.perf_counter()
+            listener.stop()
+            drain = time.perf_counter() - t
+            atexit.unregister(listener.stop)
+        else:
+            drain = 0.0
+    finally:
+        logging.StreamHandler.flush = flush
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+            h.close()
+
+    return {
+        "per_message": per_message,
+        "elapsed": sum(per_message),
+        "drain": drain,
+        "log_bytes": os.path.getsize(log_path) if os.path.exists(log_path) else 0,
+        "event_bytes": os.path.getsize(events_path) if os.path.exists(events_path) else 0,
+        "dropped": getattr(handler, "dropped", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--slow-disk", type=float, default=0.002)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        bot = load_bot()
+        results = {}
+        for disk in [0.0, args.slow_disk]:
+            for mode in ["sync file", "queue", "queue, no events"]:
+                results[mode, disk] = run(bot, args, mode, disk, directory)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(directory)
+
+    print(f"{args.messages} messages")
+    print(
+        f"{'':>16} {'disk ms':>8} {'msg/s':>8} {'p50 us':>8} {'p99 us':>8} "
+        f"{'drain s':>8} {'log KB':>7} {'events KB':>10} {'dropped':>8}"
+    )
+    for (mode, disk), r in results.items():
+        per_message = r["per_message"]
+        print(
+            f"{mode:>16} {disk * 1e3:8.1f} {len(per_message) / r['elapsed']:8.0f} "
+            f"{percentile(per_message, 0.5) * 1e6:8.0f} {percentile(per_message, 0.99) * 1e6:8.0f} "
+            f"{r['drain']:8.2f} {r['log_bytes'] / 1e3:7.0f} {r['event_bytes'] / 1e3:10.0f} "
+            f"{r['dropped']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
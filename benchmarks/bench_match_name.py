@@ -0,0 +1,120 @@
+# Benchmark for roster name matching
+#
+# Builds synthetic rosters of increasing size, and times lookups against
+# RosterMatcher and against the old permutation based match_name. Results of
+# both are compared on every query, so this doubles as a parity check.
+# The same queries are then repeated to time lookups served by the name cache.
+#
+# Usage: python benchmarks/bench_match_name.py [--sizes 50 500 5000] [--queries 200]
+import argparse
+import os
+import random
+import sys
+import time
+from itertools import permutations
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from name_matching import RosterMatcher  # noqa: E402
+from synthetic import RANKS, synthetic_roster  # noqa: E402
+
+try:
+    from textdistance import lcsstr
+
+    def lcs_length(a, b):
+        return len(lcsstr(a, b))
+
+
+except ImportError:
+
+    def lcs_length(a, b):
+        # Classic DP, keeping only the previous row
+        best = 0
+        prev = [0] * (len(b) + 1)
+        for ca in a:
+            cur = [0] * (len(b) + 1)
+            for j, cb in enumerate(b, 1):
+                if ca == cb:
+                    cur[j] = prev[j - 1] + 1
+                    best = max(best, cur[j])
+            prev = cur
+        return best
+
+
+def synthetic_query(roster, rng):
+    # Names in messages are usually a shuffled, partial, differently cased
+    # version of the roster name, e.g. "CPL Jun Wei Tan"
+    _, rank, name = rng.choice(roster)
+    tokens = name.split()
+    rng.shuffle(tokens)
+    tokens = tokens[: rng.randint(1, len(tokens))]
+    if rng.random() < 0.1:
+        rank = rng.choice(RANKS)
+    return " ".join([rank] + [x.title() for x in tokens])
+
+
+def legacy_match(roster, name):
+    # The old match_name, without pandas
+    rank = name.split()[0].upper()
+    name = "".join([x.lower() for x in name.split()[1:]])
+
+    def max_common_permutated_token(name_to_check, name):
+        possible_names = ["".join(p) for p in permutations(name_to_check.split())]
+        return max([lcs_length(name.lower(), x.lower()) for x in possible_names])
+
+    matched_score = [
+        max_common_permutated_token(n, name) if r == rank else 0 for _, r, n in roster
+    ]
+    max_score = max(matched_score)
+    if max_score > 3:
+        match = [sn for (sn, _, _), s in zip(roster, matched_score) if s == max_score]
+        if len(match) == 1:
+            return match[0]
+    return None
+
+
+def timed(fn, queries):
+    start = time.perf_counter()
+    results = [fn(q) for q in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int, default=[50, 100, 500, 1000, 5000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--legacy-max", type=int, default=1000,
+                        help="Skip the (slow) legacy matcher above this roster size")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'rows':>6} {'build ms':>9} {'new us/lookup':>14} {'cached us':>10} "
+        f"{'old us/lookup':>14} {'speedup':>8} {'parity':>7}"
+    )
+    for size in args.sizes:
+        rng = random.Random(args.seed + size)
+        roster = synthetic_roster(size, rng)
+        queries = [synthetic_query(roster, rng) for _ in range(args.queries)]
+
+        start = time.perf_counter()
+        matcher = RosterMatcher(roster, cache_size=len(queries))
+        build = time.perf_counter() - start
+
+        new, new_results = timed(matcher.match, queries)
+        cached, _ = timed(matcher.match, queries)
+        if size <= args.legacy_max:
+            old, old_results = timed(lambda q: legacy_match(roster, q), queries)
+            parity = "ok" if new_results == old_results else "FAIL"
+            old_str = f"{old * 1e6:14.1f}"
+            speedup = f"{old / new:7.1f}x"
+        else:
+            old_str, speedup, parity = f"{'-':>14}", f"{'-':>8}", "-"
+
+        print(
+            f"{size:>6} {build * 1e3:9.2f} {new * 1e6:14.1f} {cached * 1e6:10.2f} "
+            f"{old_str} {speedup} {parity:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Benchmark for the movement history
+#
+# Writes months of synthetic movements and RTUs (with one vehicle out for
+# almost all of it) to a MovementHistory in a temporary directory, then
+# reports how long it takes to write them, to open the store again (which
+# reads it all back), and to answer the queries: who was out in a two hour
+# window, one person's or one plate's details over a month, and a month of
+# vehicle utilization. Every query is checked against going through all the
+# details.
+#
+# Usage: python benchmarks/bench_movement_history.py [--days 180] [--per-day 40]
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from movement_history import MovementHistory  # noqa: E402
+from synthetic import MODELS, PURPOSES, synthetic_roster  # noqa: E402
+from utility_functions import Vehicle  # noqa: E402
+
+
+def write(history, roster, days, per_day, rng, start):
+    # Movements through the day, each coming back 20 minutes to 6 hours later
+    names = [f"{rank} {name}" for _, rank, name in roster]
+    plates = [str(40000 + i) for i in range(60)]
+    events = []
+    for day in range(days):
+        for _ in range(per_day):
+            out = start + timedelta(days=day, minutes=rng.randint(7 * 60, 19 * 60))
+            back = out + timedelta(minutes=rng.randint(20, 6 * 60))
+            to, vcom = rng.sample(names, 2)
+            veh = Vehicle(rng.choice(MODELS), rng.choice(plates), to, rng.choice(PURPOSES), vcom)
+            events.append((out, "out", veh))
+            # A few never RTU
+            if rng.random() < 0.97:
+                events.append((back, "back", veh))
+    # And one out for almost the whole time, which shouldn't slow every query
+    veh = Vehicle(MODELS[0], "39999", names[0], PURPOSES[0], names[1])
+    events.append((start + timedelta(hours=8), "out", veh))
+    events.append((start + timedelta(days=days - 1, hours=8), "back", veh))
+    events.sort(key=lambda e: e[0])
+
+    started = time.perf_counter()
+    for when, what, veh in events:
+        if what == "out":
+            history.start(veh, when)
+        else:
+            history.end(veh.plate, when)
+    history.sync()
+    return len(events), time.perf_counter() - started
+
+
+def timed(fn, calls):
+    start = time.perf_counter()
+    results = [fn(*args) for args in calls]
+    return (time.perf_counter() - start) / len(calls), results
+
+
+def scan_between(details, start, end):
+    return sorted(
+        [d for d in details if d.overlaps(start, end)], key=lambda d: (d.start_time, d.id)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--per-day", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    roster = synthetic_roster(300, rng)
+    start = datetime(2024, 1, 1)
+    directory = tempfile.mkdtemp()
+    try:
+        history = MovementHistory(directory)
+        n, elapsed = write(history, roster, args.days, args.per_day, rng, start)
+        history.close()
+        print(f"{n} events over {args.days} days: written at {n / elapsed:.0f} events/s")
+
+        t = time.perf_counter()
+        history = MovementHistory(directory)
+        print(f"Opened in {(time.perf_counter() - t) * 1e3:.1f} ms: {history.stats()}")
+        details = [d for d in history.details if d is not None]
+
+        windows = []
+        for _ in range(args.queries):
+            a = start + timedelta(days=rng.randrange(args.days), hours=rng.randint(6, 20))
+            windows.append((a, a + timedelta(hours=2)))
+        month = (start + timedelta(days=30), start + timedelta(days=60))
+        people = [(d.vehicles[0].to, *month) for d in rng.sample(details, args.queries)]
+        plates = [(d.plates[0], *month) for d in rng.sample(details, args.queries)]
+
+        for label, fn, calls, check in [
+            ("out in a 2h window", history.between, windows, lambda a, b: scan_between(details, a, b)),
+            (
+                "a person, one month",
+                history.for_person,
+                people,
+                lambda p, a, b: [d for d in scan_between(details, a, b) if p in d.people],
+            ),
+            (
+                "a plate, one month",
+                history.for_plate,
+                plates,
+                lambda p, a, b: [d for d in scan_between(details, a, b) if p in d.plates],
+            ),
+        ]:
+            per_query, results = timed(fn, calls)
+            scan, expected = timed(check, calls)
+            if [[d.id for d in r] for r in results] != [[d.id for d in r] for r in expected]:
+                raise AssertionError(f"{label}: differs from going through every detail")
+            print(
+                f"  {label:<22} {per_query * 1e3:8.3f} ms  "
+                f"(going through everything: {scan * 1e3:.3f} ms)"
+            )
+
+        t = time.perf_counter()
+        usage = history.utilization(*month, now=start + timedelta(days=args.days))
+        print(
+            f"  {'utilization, one month':<22} {(time.perf_counter() - t) * 1e3:8.3f} ms  "
+            f"({len(usage)} vehicles)"
+        )
+        history.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# Benchmark for the output sinks
+#
+# Parses synthetic messages a few per poll, --poll-interval seconds apart,
+# flushing after each poll as the bot does, against a spreadsheet that takes
+# --sheets-latency seconds per call and a local webhook
+# (fake_webhook_server.py). Runs it:
+#
+#   inline        the sheets written in flush(), no sinks
+#   sinks         sheets, JSON file and a slow webhook, each from its own thread
+#   webhook down  the same, with the webhook answering 503 for the first half
+#
+# and reports how long each poll took (i.e. how long parsing was held up),
+# what each sink wrote, and whether the sheets, the JSON file and the last
+# message to the webhook all ended up with the final state, and whether the
+# webhook got each message once.
+#
+# Usage: python benchmarks/bench_output_sinks.py [--messages 300] [--sheets-latency 0.2]
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_webhook_server import FakeWebhookServer  # noqa: E402
+from replay import load_bot  # noqa: E402
+from stand_ins import FakeSpreadsheet, FakeWorksheet  # noqa: E402
+from synthetic import synthetic_messages, synthetic_roster, synthetic_sheet  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(p * (len(values) - 1))]
+
+
+def run(bot, args, mode, directory):
+    from datetime import datetime
+
+    from output_sinks import (
+        ONGOING_DETAILS,
+        JsonFileSink,
+        Output,
+        SheetsSink,
+        WebhookSink,
+        summary,
+    )
+    from parade_state import ParadeState
+    from sheets_client import SheetsClient
+    from whatsapp_scraper import SeenMessages
+
+    rng = random.Random(args.seed)
+    roster = synthetic_roster(200, rng)
+    today = datetime.today()
+    start = datetime(today.year, today.month, today.day, 8, 0)
+    messages = synthetic_messages(roster, args.messages, rng, start=start)
+    sh = FakeSpreadsheet(
+        [
+            FakeWorksheet("MHN Parade State", synthetic_sheet(roster, rng)),
+            FakeWorksheet("Auto_Generated"),
+            FakeWorksheet("Daily Reporting"),
+        ],
+        latency=args.sheets_latency,
+    )
+    client = SheetsClient(sh, rate=1000, burst=1000)
+    state = ParadeState.from_spreadsheet(client)
+    state.load_roster()
+    state.PSsheet.client = types.SimpleNamespace(stats=dict)
+
+    with FakeWebhookServer(latency=args.webhook_latency) as webhook:
+        json_path = os.path.join(directory, f"{mode.replace(' ', '_')}.json")
+        fanout = None
+        if mode != "inline":
+            fanout = state.use_sinks(
+                [
+                    SheetsSink(state),
+                    JsonFileSink(json_path),
+                    WebhookSink(webhook.url, chat_id=1, min_interval=0, max_retry_delay=2),
+                ]
+            )
+        if mode == "webhook down":
+            webhook.status = 503
+
+        seen_messages = SeenMessages()
+        last_checked = start
+        polls = []
+        for i in range(0, len(messages), args.per_poll):
+            if mode == "webhook down" and i >= len(messages) // 2:
+                webhook.status = 200
+            t = time.perf_counter()
+            last_checked = bot.process_messages(
+                messages[i : i + args.per_poll], state, seen_messages, last_checked
+            )
+            state.flush()
+            polls.append(time.perf_counter() - t)
+            # The bot's wait until the next poll
+            time.sleep(max(0, args.poll_interval - polls[-1]))
+        elapsed = sum(polls)
+
+        state.flush(force=True)
+        if fanout is not None:
+            fanout.close(timeout=60)
+
+        # What everything should show at the end
+        expected = state.output(ONGOING_DETAILS)
+        dr = sh.worksheet("Daily Reporting")
+        # Rows no longer used are blanked to "", or were never written
+        written = [
+            dr.cells.get((5 + i, 2)) or None for i in range(len(expected.data["cells"]) + 1)
+        ]
+        ok = {"sheets": written == expected.data["cells"] + [None]}
+        if fanout is not None:
+            with open(json_path) as f:
+                ok["json"] = json.load(f)[ONGOING_DETAILS]["data"]["cells"] == (
+                    expected.data["cells"]
+                )
+            last = [m["text"] for m in webhook.received]
+            ok["webhook"] = bool(last) and last[-1].splitlines()[1:] == (
+                summary(Output(ONGOING_DETAILS, expected.data)).splitlines()[1:]
+            )
+            # Nothing sent twice after a failure
+            ok["webhook once"] = len(last) == fanout.stats()["webhook"]["written"]
+        return {
+            "polls": polls,
+            "elapsed": elapsed,
+            "sinks": fanout.stats() if fanout else {},
+            "ok": ok,
+            "webhook": (webhook.requests, webhook.failed),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--per-poll", type=int, default=5)
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--sheets-latency", type=float, default=0.2)
+    parser.add_argument("--webhook-latency", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    directory = tempfile.mkdtemp()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        bot = load_bot()
+        results = {
+            mode: run(bot, args, mode, directory)
+            for mode in ["inline", "sinks", "webhook down"]
+        }
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(directory)
+
+    print(
+        f"{args.messages} messages, {args.per_poll} per poll every {args.poll_interval}s, "
+        f"sheets {args.sheets_latency}s per call, webhook {args.webhook_latency}s"
+    )
+    print(f"{'':>13} {'poll ms: mean':>14} {'p95':>7} {'max':>7} {'busy s':>8}  final state")
+    for mode, r in results.items():
+        polls = r["polls"]
+        print(
+            f"{mode:>13} {sum(polls) / len(polls) * 1e3:14.1f} "
+            f"{percentile(polls, 0.95) * 1e3:7.1f} {max(polls) * 1e3:7.1f} "
+            f"{r['elapsed']:8.2f}  {r['ok']}"
+        )
+    for mode, r in results.items():
+        for name, stats in r["sinks"].items():
+            print(f"  {mode}, {name}: {stats}")
+        if r["sinks"]:
+            requests, failed = r["webhook"]
+            print(f"  {mode}, webhook server: {requests} requests, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
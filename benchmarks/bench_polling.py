@@ -0,0 +1,304 @@
+# Benchmark for the polling loop
+#
+# Runs a simulated day, on a virtual clock, through the bot's loop runtime
+# (run_loop, with adaptive polling) and through the fixed loop it replaced:
+# drain every second, then every minute re-open the chat, scroll, scan,
+# screenshot and read the refresh flag. Messages arrive in bursts during the
+# day and hardly at all at night. For each, it reports per hour of the day the
+# WebDriver round trips, screenshots, Sheets calls and CPU time, plus how long
+# after being sent messages were picked up.
+#
+# Usage: python benchmarks/bench_polling.py [--ingest observer] [--max-interval 30]
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+import types
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from replay import load_bot  # noqa: E402
+from stand_ins import FakeDriver, FakeSpreadsheet, FakeWorksheet  # noqa: E402
+from synthetic import synthetic_messages, synthetic_roster, synthetic_sheet  # noqa: E402
+
+HOURS = 24
+
+
+class DayOver(Exception):
+    pass
+
+
+class VirtualClock:
+    # time.time/time.sleep and datetime.today for the simulated day. Sleeping
+    # is what moves time on, and delivers the messages sent meanwhile.
+    def __init__(self, start, end, arrivals, driver):
+        self.now = start.timestamp()
+        self.end = end.timestamp()
+        self.arrivals = arrivals  # [(timestamp, row)], sorted
+        self.driver = driver
+        self._next = 0
+        clock = self
+
+        class VirtualDatetime(datetime):
+            @classmethod
+            def today(cls):
+                return cls.fromtimestamp(clock.now)
+
+            now = today
+
+        self.datetime = VirtualDatetime
+        self.time = types.SimpleNamespace(
+            time=self.time_, sleep=self.sleep, strftime=time.strftime, monotonic=self.time_
+        )
+        self._deliver()
+
+    def time_(self):
+        return self.now
+
+    def _deliver(self):
+        while self._next < len(self.arrivals) and self.arrivals[self._next][0] <= self.now:
+            self.driver.post([self.arrivals[self._next][1]])
+            self._next += 1
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0.001)
+        if self.now >= self.end:
+            raise DayOver
+        self._deliver()
+
+
+class CountingDriver(FakeDriver):
+    # Notes when each message is first read off the page
+    def __init__(self):
+        super().__init__()
+        self.clock = None
+        self.first_seen = {}
+        self.calls_by_hour = [0] * HOURS
+        self.screenshots_by_hour = [0] * HOURS
+
+    def hour(self):
+        return datetime.fromtimestamp(self.clock.now).hour
+
+    def _count(self):
+        self.calls_by_hour[self.hour()] += 1
+
+    def find_element(self, by=None, value=None):
+        self._count()
+        return super().find_element(by, value)
+
+    def find_elements_by_class_name(self, name):
+        self._count()
+        return super().find_elements_by_class_name(name)
+
+    def execute_script(self, script, *args):
+        self._count()
+        result = super().execute_script(script, *args)
+        if isinstance(result, list):
+            for row in result:
+                self.first_seen.setdefault(row[0], self.clock.now)
+        return result
+
+    def save_screenshot(self, path):
+        self._count()
+        self.screenshots_by_hour[self.hour()] += 1
+        return super().save_screenshot(path)
+
+
+def day_of_messages(roster, day, bursts, per_burst, rng):
+    # [(timestamp, row)]: bursts of messages a minute or so apart between
+    # 07:30 and 19:00, and a couple at night
+    texts = synthetic_messages(roster, bursts * per_burst + 2, rng, start=day)
+    times = []
+    for _ in range(bursts):
+        t = day + timedelta(minutes=rng.randint(7 * 60 + 30, 19 * 60))
+        for _ in range(per_burst):
+            times.append(t)
+            t += timedelta(seconds=rng.randint(10, 120))
+    times += [day + timedelta(hours=23, minutes=15), day + timedelta(hours=2, minutes=40)]
+    times.sort()
+
+    arrivals = []
+    for sent, (message_id, _, text) in zip(times, texts):
+        sender = texts[0][1].split("] ")[-1]
+        pre_plain_text = f"[{sent.strftime('%H:%M, %d/%m/%Y')}] {sender}"
+        lines = text.splitlines()[:-1] + [sent.strftime("%H:%M")]
+        arrivals.append((sent.timestamp(), (message_id, pre_plain_text, "\n".join(lines))))
+    return arrivals
+
+
+def legacy_loop(bot, driver, state, seen_messages, last_checked, observe):
+    # The fixed loop: drain every second, and once a minute re-open the chat,
+    # scroll, scan, screenshot and read the refresh flag
+    def scan():
+        bot.WebDriverWait(driver, 20).until(
+            bot.EC.presence_of_element_located(
+                (bot.By.XPATH, f"//*[contains(@title, {bot.TO_UPDATE})]")
+            )
+        )
+        driver.find_element_by_xpath(f"//*[contains(@title, {bot.TO_UPDATE})]").click()
+        results = driver.find_elements_by_class_name("message-in")
+        if results:
+            results[0].send_keys(bot.Keys.PAGE_UP)
+            results[-1].send_keys(bot.Keys.END)
+        return bot.extract_messages(driver)
+
+    if observe:
+        bot.install_observer(driver)
+    next_scan = bot.time.time()
+    while True:
+        if observe:
+            last_checked = bot.process_messages(
+                bot.drain_messages(driver), state, seen_messages, last_checked
+            )
+        if bot.time.time() >= next_scan:
+            last_checked = bot.process_messages(scan(), state, seen_messages, last_checked)
+            driver.save_screenshot(".\\screenshot.png")
+            state.check_refresh_flag()
+            now = bot.time.time()
+            next_scan = now + 60 - now % 60
+        state.flush()
+        if observe:
+            bot.time.sleep(max(0, min(bot.DRAIN_INTERVAL, next_scan - bot.time.time())))
+        else:
+            bot.time.sleep(max(0, next_scan - bot.time.time()))
+
+
+def simulate(loop, args):
+    import adaptive_poll
+    import parade_state
+    import scheduler
+    import whatsapp_scraper
+    from parade_state import ParadeState
+    from whatsapp_scraper import SeenMessages
+
+    bot = load_bot()
+    rng = random.Random(args.seed)
+    roster = synthetic_roster(200, rng)
+    today = datetime.today()
+    day = datetime(today.year, today.month, today.day) - timedelta(days=1)
+    arrivals = day_of_messages(roster, day, args.bursts, args.per_burst, rng)
+
+    sh = FakeSpreadsheet(
+        [
+            FakeWorksheet("MHN Parade State", synthetic_sheet(roster, rng)),
+            FakeWorksheet("Auto_Generated"),
+            FakeWorksheet("Daily Reporting"),
+        ]
+    )
+    state = ParadeState.from_spreadsheet(sh)
+    state.PSsheet.client = types.SimpleNamespace(stats=dict)
+    state.load_roster()
+
+    driver = CountingDriver()
+    clock = VirtualClock(day, day + timedelta(hours=HOURS), arrivals, driver)
+    driver.clock = clock
+    saved = {}
+    for module in [bot, adaptive_poll, parade_state, scheduler, whatsapp_scraper]:
+        saved[module] = (module.__dict__.get("datetime"), module.__dict__.get("time"))
+        if "datetime" in module.__dict__:
+            module.datetime = clock.datetime
+        if "time" in module.__dict__:
+            module.time = clock.time
+    bot.INGEST_MODE = args.ingest
+    for name in ["MIN_POLL_INTERVAL", "MAX_POLL_INTERVAL", "OFF_HOURS_POLL_INTERVAL"]:
+        value = getattr(args, name.lower().replace("_poll", ""))
+        if value is not None:
+            setattr(bot, name, value)
+
+    sheet_calls = [0] * HOURS
+    cpu = [0.0] * HOURS
+    calls, cpu_start = sh.api_calls(), time.process_time()
+    sleep = clock.sleep
+
+    def sleep_and_count(seconds):
+        # Books the Sheets calls and CPU time since the last sleep to the hour
+        nonlocal calls, cpu_start
+        h = datetime.fromtimestamp(clock.now).hour
+        sheet_calls[h] += sh.api_calls() - calls
+        cpu[h] += time.process_time() - cpu_start
+        calls = sh.api_calls()
+        sleep(seconds)
+        cpu_start = time.process_time()
+
+    clock.time.sleep = sleep_and_count
+    try:
+        loop(bot, driver, state, SeenMessages(), day)
+    except DayOver:
+        pass
+    finally:
+        for module, (dt, tm) in saved.items():
+            if dt is not None:
+                module.datetime = dt
+            if tm is not None:
+                module.time = tm
+
+    delays = sorted(
+        driver.first_seen.get(row[0], clock.end) - sent for sent, row in arrivals
+    )
+    return {
+        "calls": driver.calls_by_hour,
+        "screenshots": driver.screenshots_by_hour,
+        "sheet_calls": sheet_calls,
+        "cpu": cpu,
+        "delay_mean": sum(delays) / len(delays),
+        "delay_p95": delays[int(0.95 * (len(delays) - 1))],
+        "delay_max": delays[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bursts", type=int, default=15)
+    parser.add_argument("--per-burst", type=int, default=6)
+    parser.add_argument("--ingest", choices=["observer", "scan"], default="observer")
+    parser.add_argument("--min-interval", type=float, help="Default: MIN_POLL_INTERVAL")
+    parser.add_argument("--max-interval", type=float, help="Default: MAX_POLL_INTERVAL")
+    parser.add_argument("--off-hours-interval", type=float, help="Default: OFF_HOURS_POLL_INTERVAL")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    loops = {
+        "fixed": lambda bot, *a: legacy_loop(bot, *a, observe=args.ingest == "observer"),
+        "adaptive": lambda bot, *a: bot.run_loop(*a),
+    }
+    results = {}
+    for label, loop in loops.items():
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            results[label] = simulate(loop, args)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    print(f"{args.bursts * args.per_burst + 2} messages over a day, ingest: {args.ingest}")
+    print(f"{'':>9} {'WebDriver calls/h':>24} {'screenshots/h':>14} {'Sheets calls/h':>15} {'CPU ms/h':>9}")
+    print(f"{'':>9} {'busy':>7} {'quiet':>7} {'night':>8}")
+    for label, r in results.items():
+        busy = [h for h in range(8, 19)]
+        quiet = [7, 19, 20, 21]
+        night = [h for h in range(HOURS) if h not in busy and h not in quiet]
+
+        def per_hour(values, hours):
+            return sum(values[h] for h in hours) / len(hours)
+
+        print(
+            f"{label:>9} {per_hour(r['calls'], busy):7.0f} {per_hour(r['calls'], quiet):7.0f} "
+            f"{per_hour(r['calls'], night):8.0f} {sum(r['screenshots']) / HOURS:14.1f} "
+            f"{sum(r['sheet_calls']) / HOURS:15.1f} {sum(r['cpu']) * 1e3 / HOURS:9.1f}"
+        )
+    for label, r in results.items():
+        print(
+            f"{label:>9}: picked up {r['delay_mean']:.1f}s after being sent on average, "
+            f"p95 {r['delay_p95']:.1f}s, max {r['delay_max']:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# Benchmark for the roster store
+#
+# Compares RosterStore against the old DataFrame parade state on synthetic
+# rosters of increasing size: memory held by the roster, and latency of what
+# each parsed message does to it (a movement setting LatestUpdate and STATUS
+# on two people, a reply looking people up by RANK/NAME) and of building the
+# sheet payload. Both are loaded from the same sheet values and compared, so
+# this doubles as a parity check of RosterStore.from_values.
+#
+# Usage: python benchmarks/bench_roster_store.py [--sizes 50 500 5000] [--updates 2000]
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pandas as pd  # noqa: E402
+
+from roster_store import RosterStore  # noqa: E402
+from sheet_output import grid_to_cells  # noqa: E402
+from synthetic import synthetic_roster, synthetic_sheet  # noqa: E402
+
+
+def legacy_initialize_PS(values, keep_remarks=False):
+    # The old initialize_PS, given what get_all_values()[1:] returns
+    width = 8 if keep_remarks else 7
+    PS_df = pd.DataFrame(values).drop(columns=list(range(width, len(values[0]))))
+    PS_df.columns = [x.strip() for x in PS_df.iloc[0]]
+    PS_df = (
+        PS_df.set_index("S/N")
+        .drop(index="S/N")
+        .replace("", pd.NA)
+        .dropna(thresh=2)
+        .convert_dtypes()
+        .replace(pd.NA, "")
+    )
+    PS_df.index = pd.to_numeric(PS_df.index)
+    PS_df["LatestUpdate"] = ""
+    PS_df["RANK/NAME"] = PS_df.RANK + " " + PS_df.NAME
+    return PS_df
+
+
+class DataFrameRoster:
+    # What parse_movement/parse_reply/update_PS used to do to PS_df
+    def __init__(self, df):
+        self.df = df
+
+    def movement(self, rows, message):
+        self.df.loc[rows, "LatestUpdate"] = message
+        self.df.loc[rows, "STATUS"] = "DETAIL"
+
+    def reply(self, sn, to, vcom):
+        formal_name = self.df.at[sn, "RANK/NAME"]
+        rows = self.df[(self.df["RANK/NAME"] == to) | (self.df["RANK/NAME"] == vcom)].index
+        self.df.loc[rows, "LatestUpdate"] = formal_name
+        self.df.loc[rows, "STATUS"] = "PRESENT"
+
+    def payload(self):
+        return grid_to_cells(
+            [list(self.df.reset_index().columns)] + self.df.to_records().tolist()
+        )
+
+
+class StoreRoster:
+    def __init__(self, store):
+        self.store = store
+
+    def movement(self, rows, message):
+        self.store.set(rows, "LatestUpdate", message)
+        self.store.set(rows, "STATUS", "DETAIL")
+
+    def reply(self, sn, to, vcom):
+        formal_name = self.store.get(sn).rank_name
+        rows = self.store.with_rank_name(to, vcom)
+        self.store.set(rows, "LatestUpdate", formal_name)
+        self.store.set(rows, "STATUS", "PRESENT")
+
+    def payload(self):
+        return grid_to_cells([["S/N"] + self.store.columns] + self.store.rows())
+
+
+def retained_bytes(build):
+    # Memory still held by what build() returns
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def timed(fn, calls):
+    start = time.perf_counter()
+    for args in calls:
+        fn(*args)
+    return (time.perf_counter() - start) / len(calls)
+
+
+def check_parity(values):
+    for keep_remarks in [False, True]:
+        df = legacy_initialize_PS(values, keep_remarks).astype(str)
+        store_df = RosterStore.from_values(values, keep_remarks).to_df().astype(str)
+        if not df.equals(store_df) or list(df.index) != list(store_df.index):
+            raise AssertionError(f"RosterStore differs from initialize_PS (keep_remarks={keep_remarks})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int, default=[50, 200, 1000, 5000])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'roster':>7} {'':>10} {'memory':>10} {'movement':>10} "
+        f"{'reply':>10} {'payload':>10}"
+    )
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        roster = synthetic_roster(size, rng)
+        values = synthetic_sheet(roster, rng)[1:]
+        # A few empty rows at the bottom, like the real sheet
+        values += [[str(size + i + 1), "", "", "", "", "", "", ""] for i in range(3)]
+        check_parity(values)
+
+        sns = [sn for sn, _, _ in roster]
+        names = {sn: f"{rank} {name}" for sn, rank, name in roster}
+        movements = [(rng.sample(sns, 2), f"update {i}") for i in range(args.updates)]
+        replies = []
+        for _ in range(args.updates):
+            to, vcom = rng.sample(sns, 2)
+            replies.append((to, names[to], names[vcom]))
+
+        for label, build in [
+            ("DataFrame", lambda: DataFrameRoster(legacy_initialize_PS(values))),
+            ("store", lambda: StoreRoster(RosterStore.from_values(values))),
+        ]:
+            memory = retained_bytes(build)
+            r = build()
+            movement = timed(r.movement, movements)
+            reply = timed(r.reply, replies)
+            payload = timed(r.payload, [()] * max(1, args.updates // 100))
+            print(
+                f"{size:>7} {label:>10} {memory / 1e3:>8.0f}KB "
+                f"{movement * 1e6:>8.1f}us {reply * 1e6:>8.1f}us {payload * 1e3:>8.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
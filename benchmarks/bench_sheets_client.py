@@ -0,0 +1,129 @@
+# Benchmark for SheetsClient against a fake Sheets server
+#
+# Replays synthetic messages through a ParadeState whose spreadsheet is served
+# over HTTP by FakeSheetsServer, with 429s injected at random and/or over a
+# per-minute quota, and latency on every request. Run once talking to the
+# server directly and once through SheetsClient, it reports the requests
+# made, 429s hit, failed writes, and whether the sheet ends up matching the
+# state, i.e. whether any update was lost.
+#
+# Usage: python benchmarks/bench_sheets_client.py [--throttle 0.2] [--latency 0.01]
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_sheets_server import HttpSpreadsheet, serve  # noqa: E402
+from replay import load_bot  # noqa: E402
+from synthetic import synthetic_messages, synthetic_roster, synthetic_sheet  # noqa: E402
+
+
+def sheet_matches(server, state):
+    # Every roster cell of the generated sheet is what the state says
+    ws = server.worksheets["Auto_Generated"]
+    grid = [["S/N"] + state.roster.columns] + state.roster.rows()
+    for r, values in enumerate(grid, 1):
+        for c, value in enumerate(values, 1):
+            if str(ws.cells.get((r, c), "")) != str(value):
+                return False
+    return True
+
+
+def run(use_client, roster, messages, poll_size, args):
+    from parade_state import ParadeState
+    from sheets_client import SheetsClient
+    from whatsapp_scraper import SeenMessages
+
+    bot = load_bot()
+    rng = random.Random(args.seed)
+    with serve(
+        {
+            "MHN Parade State": synthetic_sheet(roster, rng),
+            "Auto_Generated": [],
+            "Daily Reporting": [],
+        },
+        throttle=args.throttle,
+        quota_per_minute=args.quota,
+        latency=args.latency,
+        seed=args.seed,
+    ) as server:
+        sh = HttpSpreadsheet(server.url)
+        client = None
+        if use_client:
+            # Short backoff, so that the benchmark doesn't take minutes
+            client = SheetsClient(
+                sh, rate=args.rate, burst=args.burst, base_delay=0.05, max_delay=1.0
+            )
+            sh = client
+
+        state = ParadeState.from_spreadsheet(sh)
+        start = time.perf_counter()
+        try:
+            state.load_roster()
+        except Exception:
+            # Without retries, even the first read can be throttled
+            state.load_roster()
+
+        today = datetime.today()
+        last_checked = datetime(today.year, today.month, today.day, 8, 0)
+        seen_messages = SeenMessages()
+        for i in range(0, len(messages), poll_size):
+            last_checked = bot.process_messages(
+                messages[i : i + poll_size], state, seen_messages, last_checked
+            )
+            state.flush()
+        # One last flush, like on shutdown
+        state.flush(force=True)
+        elapsed = time.perf_counter() - start
+
+        failed = sum(s["failed"] for s in state.outputs.stats().values())
+        return {
+            "mode": "client" if use_client else "direct",
+            "seconds": elapsed,
+            "requests": server.requests,
+            "throttled": server.throttled,
+            "failed_writes": failed,
+            "still_dirty": [n for n in ["PS", "ongoingDetails"] if state.outputs.is_dirty(n)],
+            "sheet_matches_state": sheet_matches(server, state),
+            "client": client.stats() if client else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--roster-size", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--poll-size", type=int, default=10)
+    parser.add_argument("--throttle", type=float, default=0.2, help="Chance of a 429")
+    parser.add_argument("--quota", type=int, help="Requests allowed per minute")
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds per request")
+    parser.add_argument("--rate", type=float, default=50, help="Client requests per second")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(args.seed)
+    roster = synthetic_roster(args.roster_size, rng)
+    messages = synthetic_messages(roster, args.messages, random.Random(args.seed + 1))
+
+    for use_client in [False, True]:
+        result = run(use_client, roster, messages, args.poll_size, args)
+        print(
+            f"{result['mode']:>6}: {result['seconds']:6.2f}s, {result['requests']} requests, "
+            f"{result['throttled']} throttled, {result['failed_writes']} failed writes, "
+            f"sheet matches state: {result['sheet_matches_state']}"
+        )
+        if result["client"]:
+            print(f"        {result['client']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# Benchmark for message tokenizing
+#
+# Times message_parser.tokenize against the old way of reading a message
+# (is_update, then parse_message, then parse_reply or parse_movement each
+# splitting the lines again), without any of the state updates. Runs over
+# synthetic messages in the formats seen in the group, plus a few awkward ones,
+# or over a recorded corpus. Counts the messages the old way crashed on, and
+# checks that both agree on everything else. Each way is timed --repeat
+# times, taking turns, and the best time is reported.
+#
+# Usage: python benchmarks/bench_tokenizer.py [--messages 20000] [--repeat 7] [--corpus recorded.jsonl]
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from message_parser import REPLY, sender_name, tokenize  # noqa: E402
+from replay import load_corpus  # noqa: E402
+from synthetic import synthetic_messages, synthetic_roster  # noqa: E402
+
+# Messages the old parsing fell over on
+AWKWARD = [
+    # More than one ":" on a line
+    "1x ouv MOV\nTO: CPL Wei Tan\nVC: 3SG Lim Jun\nMID: 12:34\nPurpose: Admin: run\n13:45",
+    # Quoting a movement, from someone whose rank starts with a digit
+    "3SG Lim Jun\n1x 5ton MOV\nTO: CPL Wei Tan\nVC: 3SG Lim Jun\nMID: 41234\nRTU reached\n14:02",
+    # Too short to have any quoted names
+    "RTU reached\n14:02",
+]
+
+
+def legacy_parse(text, sender_str):
+    # The old is_update/parse_message/parse_reply/parse_movement, reading
+    # the same fields as ParsedMessage
+    if not (
+        (("MID" in text) and any([x in text.lower() for x in ["to:", "to :"]]))
+        or all([x in text.lower() for x in ["rtu", "reach"]])
+    ):
+        return None
+    message = [x for x in text.splitlines() if x]
+
+    name = None
+    vcom_name = None
+    for m in message:
+        if m.lower().startswith("to"):
+            name = m.split(":")[-1].strip()
+        elif m.lower().startswith("vc"):
+            vcom_name = m.split(":")[-1].strip()
+    if not name:
+        name_rank = sender_str.split(",")[0].replace("(", "")
+        name_split = name_rank.split()
+        name = " ".join(name_split[-1:] + name_split[:-1])
+
+    if message[0][0].isnumeric():
+        start_line = 0
+    elif message[0] == message[1] or (message[2][0].isnumeric() and ":" not in message[2]):
+        start_line = 2
+    else:
+        start_line = 1
+
+    fields = {"to": name, "vc": vcom_name, "plate": None, "purpose": None, "returned": False}
+    body = message[start_line:]
+    joined_msg = "".join([x.lower() for x in body])
+    if message[0] == message[1] or "reach" in message[-2].lower():
+        fields["kind"] = REPLY
+        if "to" in joined_msg and "vc" in joined_msg:
+            for m in body[1:]:
+                if ":" in m:
+                    a, b = m.split(":")
+                elif len(m.split()) > 1:
+                    a, b = m.split()
+                else:
+                    a = ""
+                    b = ""
+                if "mid" in a.lower():
+                    fields["plate"] = b.strip()
+                    break
+        for i in ["rtu", "assessment", "to mh"]:
+            if i in joined_msg and "reach" in joined_msg.split(i)[-1]:
+                fields["returned"] = True
+                break
+    else:
+        fields["kind"] = "movement"
+        fields["model"] = body[0].lower().split("mov")[0].split("x")[-1].strip()
+        for m in body[1:]:
+            if ":" in m:
+                a, b = m.split(":")
+            elif len(m.split()) > 1:
+                fragments = m.split()
+                a = fragments[0]
+                b = " ".join(fragments[1:])
+            else:
+                a = ""
+                b = ""
+            if "mid" in a.lower():
+                fields["plate"] = b.strip()
+            elif "purpose" in a.lower():
+                fields["purpose"] = b.strip()
+    return fields
+
+
+def new_parse(text, sender_str):
+    parsed = tokenize(text)
+    if parsed is None:
+        return None
+    parsed.sender = sender_str
+    return parsed
+
+
+def as_fields(parsed):
+    # What legacy_parse reads, from a ParsedMessage
+    fields = {
+        "kind": parsed.kind,
+        "to": parsed.to or sender_name(parsed.sender),
+        "vc": parsed.vc,
+        "plate": parsed.plate if parsed.kind != REPLY or parsed.has_details else None,
+        "purpose": parsed.purpose if parsed.kind != REPLY else None,
+        "returned": parsed.returned if parsed.kind == REPLY else False,
+    }
+    if parsed.kind != REPLY:
+        fields["model"] = parsed.model
+    return fields
+
+
+def run(parse, corpus):
+    results = []
+    crashes = 0
+    start = time.perf_counter()
+    for text, sender_str in corpus:
+        try:
+            results.append(parse(text, sender_str))
+        except Exception:
+            results.append(Exception)
+            crashes += 1
+    return time.perf_counter() - start, results, crashes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--roster-size", type=int, default=200)
+    parser.add_argument("--corpus", help="Recorded messages, one JSON object per line")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.corpus:
+        messages = load_corpus(args.corpus)
+    else:
+        rng = random.Random(args.seed)
+        roster = synthetic_roster(args.roster_size, rng)
+        messages = synthetic_messages(roster, args.messages, rng)
+        sender = messages[0][1]
+        messages += [(f"awkward_{i}", sender, text) for i, text in enumerate(AWKWARD)]
+    corpus = [(text, pre_plain_text.split("]")[-1].strip()) for _, pre_plain_text, text in messages]
+
+    old_time = new_time = float("inf")
+    for _ in range(args.repeat):
+        t, old, old_crashes = run(legacy_parse, corpus)
+        old_time = min(old_time, t)
+        t, new, new_crashes = run(new_parse, corpus)
+        new_time = min(new_time, t)
+
+    updates = sum(1 for r in new if r is not None and r is not Exception)
+    differ = [
+        corpus[i][0]
+        for i, (o, n) in enumerate(zip(old, new))
+        if o is not Exception and n is not Exception and (o is None) != (n is None)
+        or o not in (None, Exception) and n not in (None, Exception) and o != as_fields(n)
+    ]
+    print(f"{len(corpus)} messages, {updates} updates")
+    print(f"  old: {len(corpus) / old_time:10.0f} msg/s, {old_crashes} crashed")
+    print(f"  new: {len(corpus) / new_time:10.0f} msg/s, {new_crashes} crashed")
+    print(f"  {len(differ)} read differently where the old way didn't crash")
+    for text in differ[:5]:
+        print("    " + text.replace("\n", " | "))
+
+
+if __name__ == "__main__":
+    main()
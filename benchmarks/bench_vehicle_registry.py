@@ -0,0 +1,133 @@
+# Benchmark for the ongoing-details registry
+#
+# Compares VehicleRegistry against the old plate -> Vehicle dict with growing
+# numbers of details out: finding the detail of whoever sent a reply with only
+# their name (the "shitty reply"), a movement going out and coming back, and
+# building the Daily Reporting list after each change. Both find the same
+# detail for every lookup, which is checked.
+#
+# Usage: python benchmarks/bench_vehicle_registry.py [--details 10 100 1000] [--lookups 5000]
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic import MODELS, PURPOSES, synthetic_roster  # noqa: E402
+from utility_functions import Vehicle  # noqa: E402
+from vehicle_registry import VehicleRegistry  # noqa: E402
+
+
+class DictDetails:
+    # What parse_reply/parse_movement/update_ongoingDetails used to do
+    def __init__(self):
+        self.details = {}
+
+    def add(self, veh):
+        self.details[veh.plate] = veh
+
+    def pop(self, plate):
+        return self.details.pop(plate)
+
+    def for_person(self, formal_name):
+        for k, v in self.details.items():
+            if formal_name in [v.to, v.vcom]:
+                return v
+        return None
+
+    def cells(self):
+        return [[f"{k}\n{str(v)}"] for k, v in self.details.items()]
+
+
+class RegistryDetails:
+    def __init__(self):
+        self.details = VehicleRegistry()
+
+    def add(self, veh):
+        self.details.add(veh)
+
+    def pop(self, plate):
+        return self.details.pop(plate)
+
+    def for_person(self, formal_name):
+        return self.details.for_person(formal_name)
+
+    def cells(self):
+        return [[cell] for cell in self.details.cells()]
+
+
+def vehicles(roster, count, rng):
+    names = [f"{rank} {name}" for _, rank, name in roster]
+    start = datetime(2024, 1, 1, 8)
+    return [
+        Vehicle(
+            model=rng.choice(MODELS),
+            plate=str(10000 + i),
+            to=names[(2 * i) % len(names)],
+            purpose=rng.choice(PURPOSES),
+            vcom=names[(2 * i + 1) % len(names)],
+            started=start + timedelta(minutes=i),
+        )
+        for i in range(count)
+    ]
+
+
+def timed(fn, calls):
+    start = time.perf_counter()
+    for args in calls:
+        fn(*args)
+    return (time.perf_counter() - start) / len(calls)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--details", nargs="+", type=int, default=[10, 100, 1000])
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'details':>7} {'':>8} {'lookup':>10} {'move+rtu':>10} {'list':>10}")
+    for count in args.details:
+        rng = random.Random(args.seed)
+        roster = synthetic_roster(max(200, 2 * count + 50), rng)
+        out = vehicles(roster, count, rng)
+        extra = vehicles(roster[-50:], 50, rng)
+        for i, veh in enumerate(extra):
+            veh.plate = f"X{i}"
+        people = [v.to for v in out] + [v.vcom for v in out] + [v.to for v in extra]
+        lookups = [(rng.choice(people),) for _ in range(args.lookups)]
+
+        found = {}
+        for label, cls in [("dict", DictDetails), ("registry", RegistryDetails)]:
+            details = cls()
+            for veh in out:
+                details.add(veh)
+            lookup = timed(details.for_person, lookups)
+            found[label] = [
+                v.plate if v else None for v in map(details.for_person, (n for n, in lookups))
+            ]
+
+            # A movement going out, the list written, it coming back, the list written
+            def move(veh):
+                details.add(veh)
+                details.cells()
+                details.pop(veh.plate)
+                details.cells()
+
+            move_rtu = timed(move, [(v,) for v in extra])
+            listing = timed(details.cells, [()] * 200)
+            print(
+                f"{count:>7} {label:>8} {lookup * 1e6:>8.2f}us "
+                f"{move_rtu * 1e6:>8.1f}us {listing * 1e6:>8.1f}us"
+            )
+        if found["dict"] != found["registry"]:
+            raise AssertionError("VehicleRegistry found a different detail than the dict")
+
+
+if __name__ == "__main__":
+    main()
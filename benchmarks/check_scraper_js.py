@@ -0,0 +1,184 @@
+# Runs the scripts whatsapp_scraper.py puts into the page in a real browser
+#
+# Everything else in benchmarks/ uses FakeDriver, which answers the scripts in
+# Python, so the JavaScript itself (the MutationObserver, draining its queue,
+# reading messages) is never run there. This loads fixtures/whatsapp_chat.html
+# in headless Chrome and checks that:
+#  - extract_messages reads the messages already on the page, deleted ones
+#    with no data-pre-plain-text,
+#  - install_observer only installs one observer, however often it is run,
+#  - drain_messages returns each message added with addIncoming once, in
+#    order, and nothing that was there before,
+#  - after a reload, drain_messages puts the observer back, and only keeps
+#    the newest max_queued messages when nobody drains,
+#  - oldest_message, rendered_messages and current_chat agree with the page,
+#    and open_chat's XPath finds the chat.
+#
+# Needs selenium and Chrome (or chromedriver) on the PATH. Exits non-zero if
+# any check fails.
+#
+# Usage: python benchmarks/check_scraper_js.py [--show]
+import argparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from whatsapp_scraper import (  # noqa: E402
+    current_chat,
+    drain_messages,
+    extract_messages,
+    install_observer,
+    oldest_message,
+    parse_pre_plain_text,
+    rendered_messages,
+)
+
+FIXTURE = os.path.join(BENCH_DIR, "fixtures", "whatsapp_chat.html")
+CHAT_ID = "false_120363000000000000@g.us_"
+# WhatsappBot.TO_UPDATE, which has the quotes for the XPath in open_chat
+TO_UPDATE = "'Mandai TOs'"
+
+
+def start_driver(show=False):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    if not show:
+        options.add_argument("--headless=new")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-gpu")
+    return webdriver.Chrome(options=options)
+
+
+def add_incoming(driver, message_id, pre_plain_text, text):
+    driver.execute_script(
+        "addIncoming(arguments[0], arguments[1], arguments[2])",
+        message_id,
+        pre_plain_text,
+        text,
+    )
+
+
+def incoming(n, start=0):
+    # (message_id, pre_plain_text, text) as addIncoming renders them
+    return [
+        (
+            f"{CHAT_ID}NEW{i}",
+            f"[09:{i % 60:02d}, 17/10/2026] Kai Lim (LCP, PLT 2): ",
+            f"1x OUV MOV\nTO: LCP Lim Kai\nVC: CPL Tan Wei\nMID: {50000 + i}\n"
+            f"Purpose: Message {i}",
+        )
+        for i in range(start, start + n)
+    ]
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+
+    def check(self, what, ok, got=None):
+        print(f"{'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            self.failed += 1
+            print(f"     got: {got!r}")
+
+
+def run(driver, checks):
+    check = checks.check
+    driver.get("file://" + FIXTURE)
+
+    # What is on the page to begin with
+    rows = extract_messages(driver)
+    check("extract_messages reads both incoming messages", len(rows) == 2, rows)
+    movement, deleted = rows
+    check(
+        "a message has its data-id, data-pre-plain-text and text",
+        movement[0] == f"{CHAT_ID}3EB0A1"
+        and movement[1] == "[08:05, 17/10/2026] Wei Tan (CPL, PLT 1): "
+        and movement[2].startswith("1x 5ton MOV\nTO: CPL Tan Wei\nVC: 3SG Lim Jun"),
+        movement,
+    )
+    parsed = parse_pre_plain_text(movement[1])[1:]
+    check(
+        "the time and sender are read from data-pre-plain-text",
+        parsed == ("08:05, 17/10/2026", "Wei Tan (CPL, PLT 1):"),
+        parsed,
+    )
+    check(
+        "a deleted message has no data-pre-plain-text",
+        deleted[0] == f"{CHAT_ID}3EB0A3" and deleted[1] is None,
+        deleted,
+    )
+    from selenium.webdriver.common.by import By
+
+    chat = current_chat(driver)
+    check("current_chat is the chat header, as open_chat compares it", chat == "Mandai TOs", chat)
+    found = driver.find_elements(By.XPATH, f"//*[contains(@title, {TO_UPDATE})]")
+    check("open_chat's XPath finds the chat", len(found) == 2, found)
+
+    # The observer
+    install_observer(driver)
+    install_observer(driver)
+    check("nothing is queued before anything is added", drain_messages(driver) == [])
+
+    added = incoming(3)
+    for row in added:
+        add_incoming(driver, *row)
+    drained = drain_messages(driver)
+    check("drain_messages returns what was added, in order", drained == added, drained)
+    check("one observer, however often it was installed", len(drained) == 3, drained)
+    check("a second drain returns nothing", drain_messages(driver) == [])
+
+    rows = extract_messages(driver)
+    check("extract_messages sees the old and new messages", rows[2:] == added, rows)
+
+    count, oldest = oldest_message(driver)
+    check(
+        "oldest_message is the first on the page",
+        count == 5 and oldest == rows[0],
+        (count, oldest),
+    )
+    batches = list(rendered_messages(driver, batch=2))
+    check(
+        "rendered_messages reads everything, oldest first, in batches",
+        [len(b) for b in batches] == [2, 2, 1] and sum(batches, []) == rows,
+        batches,
+    )
+
+    # A reload loses the observer
+    driver.refresh()
+    check(
+        "drain_messages after a reload returns nothing",
+        drain_messages(driver, max_queued=2) == [],
+    )
+    added = incoming(5, start=3)
+    for row in added:
+        add_incoming(driver, *row)
+    drained = drain_messages(driver)
+    check(
+        "the observer is back, keeping the newest max_queued",
+        drained == added[-2:],
+        drained,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--show", action="store_true", help="not headless")
+    args = parser.parse_args()
+
+    checks = Checks()
+    driver = start_driver(args.show)
+    try:
+        run(driver, checks)
+    finally:
+        driver.quit()
+    print(f"{checks.failed} failed" if checks.failed else "All passed")
+    sys.exit(1 if checks.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# A local stand-in for the Google Sheets HTTP API
+#
+# Serves the few values endpoints the bot uses, over real HTTP, and can be
+# made to answer with 429s (at random, or once over a per-minute quota) and
+# to add latency to every request. HttpSpreadsheet talks to it with the same
+# methods as a gspread Spreadsheet, so SheetsClient can be run against it
+# unchanged.
+#
+#   GET  /v4/spreadsheets/<key>/values/<range>
+#   PUT  /v4/spreadsheets/<key>/values/<range>?valueInputOption=RAW
+#   POST /v4/spreadsheets/<key>/values:batchUpdate
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import quote, unquote, urlparse
+from urllib.request import Request, urlopen
+
+from stand_ins import FakeWorksheet, parse_range
+from sheet_output import to_a1
+
+
+class FakeSheetsServer:
+    def __init__(self, worksheets, throttle=0.0, quota_per_minute=None, latency=0.0, seed=0):
+        # worksheets: [FakeWorksheet] holding the cells. throttle: chance of a
+        # 429 on any request. quota_per_minute: requests allowed in any 60s.
+        self.worksheets = {ws.title: ws for ws in worksheets}
+        self.throttle = throttle
+        self.quota_per_minute = quota_per_minute
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.requests = 0
+        self.throttled = 0
+        self.writes = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server._handle(self, "GET")
+
+            def do_PUT(self):
+                server._handle(self, "PUT")
+
+            def do_POST(self):
+                server._handle(self, "POST")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _over_quota(self):
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self._recent and self._recent[0] < now - 60:
+                self._recent.popleft()
+            if self.rng.random() < self.throttle or (
+                self.quota_per_minute is not None and len(self._recent) >= self.quota_per_minute
+            ):
+                self.throttled += 1
+                return True
+            self._recent.append(now)
+            return False
+
+    def _reply(self, handler, status, body):
+        data = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _handle(self, handler, method):
+        if self.latency:
+            time.sleep(self.latency)
+        if self._over_quota():
+            return self._reply(
+                handler,
+                429,
+                {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "Quota exceeded"}},
+            )
+
+        url = urlparse(handler.path)
+        path = url.path.split("/values", 1)[1]
+        body = None
+        if method in ["PUT", "POST"]:
+            body = json.loads(handler.rfile.read(int(handler.headers["Content-Length"])))
+
+        with self._lock:
+            if method == "POST" and path == ":batchUpdate":
+                for d in body["data"]:
+                    self._write(d["range"], d["values"])
+                return self._reply(handler, 200, {"totalUpdatedRanges": len(body["data"])})
+            range_str = unquote(path[1:])
+            if method == "PUT":
+                self._write(range_str, body["values"])
+                return self._reply(handler, 200, {"updatedRange": range_str})
+            return self._reply(handler, 200, {"range": range_str, "values": self._read(range_str)})
+
+    def _write(self, range_str, values):
+        sheet, start, _ = parse_range(range_str)
+        self.worksheets[sheet]._write(start, values)
+        self.writes += 1
+
+    def _read(self, range_str):
+        if "!" not in range_str:
+            return self.worksheets[range_str.strip("'")].get_all_values()
+        sheet = range_str.split("!")[0].strip("'")
+        return self.worksheets[sheet].get(range_str)
+
+
+class Response:
+    # What SheetsClient looks at on a failed call, like requests' Response
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class SheetsHTTPError(Exception):
+    def __init__(self, status_code, headers, message):
+        super().__init__(f"{status_code}: {message}")
+        self.response = Response(status_code, headers)
+
+
+class HttpSpreadsheet:
+    def __init__(self, base_url, key="fake"):
+        self.base_url = f"{base_url}/v4/spreadsheets/{key}"
+        self.calls = 0
+
+    def request(self, method, path, body=None):
+        self.calls += 1
+        data = json.dumps(body).encode() if body is not None else None
+        request = Request(self.base_url + path, data=data, method=method)
+        request.add_header("Content-Type", "application/json")
+        try:
+            with urlopen(request) as response:
+                return json.loads(response.read())
+        except HTTPError as e:
+            raise SheetsHTTPError(e.code, dict(e.headers), e.read().decode()) from None
+
+    def worksheet(self, title):
+        return HttpWorksheet(self, title)
+
+    def values_batch_update(self, body):
+        return self.request("POST", "/values:batchUpdate", body)
+
+
+class HttpWorksheet:
+    def __init__(self, spreadsheet, title):
+        self.spreadsheet = spreadsheet
+        self.title = title
+
+    def _path(self, range_name=None):
+        range_str = f"'{self.title}'" + (f"!{range_name}" if range_name else "")
+        return "/values/" + quote(range_str)
+
+    def get_all_values(self):
+        return self.spreadsheet.request("GET", self._path())["values"]
+
+    def get(self, range_name):
+        return self.spreadsheet.request("GET", self._path(range_name))["values"]
+
+    def update(self, range_name, values, value_input_option="RAW"):
+        return self.spreadsheet.request(
+            "PUT",
+            f"{self._path(range_name)}?valueInputOption={value_input_option}",
+            {"values": values},
+        )
+
+    def batch_update(self, data, value_input_option="RAW"):
+        return self.spreadsheet.values_batch_update(
+            {
+                "valueInputOption": value_input_option,
+                "data": [
+                    {"range": f"'{self.title}'!{d['range']}", "values": d["values"]}
+                    for d in data
+                ],
+            }
+        )
+
+    def update_cell(self, row, col, value):
+        return self.update(to_a1(row, col), [[value]], value_input_option="USER_ENTERED")
+
+
+def serve(rows_by_title, **kwargs):
+    # FakeSheetsServer over fresh worksheets, e.g. serve({"Sheet1": rows})
+    return FakeSheetsServer(
+        [FakeWorksheet(title, rows) for title, rows in rows_by_title.items()], **kwargs
+    )
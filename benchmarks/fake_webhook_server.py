@@ -0,0 +1,65 @@
+# A local stand-in for a chat webhook, e.g. Telegram's sendMessage
+#
+# Accepts JSON POSTs on any path and keeps them, answering like Telegram
+# does. It can be made slow (latency added to every request) or down (every
+# request answered with `status`), and both can be changed while it runs, to
+# see how WebhookSink copes.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeWebhookServer:
+    def __init__(self, latency=0.0, status=200):
+        self.latency = latency
+        self.status = status
+        self._lock = threading.Lock()
+        self.received = []
+        self.requests = 0
+        self.failed = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                server._handle(self)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/sendMessage"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handle(self, handler):
+        body = json.loads(handler.rfile.read(int(handler.headers["Content-Length"])))
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            status = self.status
+            if status == 200:
+                self.received.append(body)
+            else:
+                self.failed += 1
+
+        reply = {"ok": status == 200}
+        if status == 200:
+            reply["result"] = {"message_id": len(self.received), "text": body.get("text")}
+        else:
+            reply["error_code"] = status
+        data = json.dumps(reply).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
@@ -0,0 +1,298 @@
+# Offline replay benchmark
+#
+# Feeds movement/RTU/reply messages through check_messages and a ParadeState
+# backed by an in-memory spreadsheet and a fake WhatsApp driver, and reports
+# throughput, per-stage latency and peak memory. Results are written as JSON
+# so that runs of different versions can be compared.
+#
+# Usage:
+#   python benchmarks/replay.py --roster-sizes 50 500 --messages 1000
+#   python benchmarks/replay.py --corpus recorded.jsonl --output results.json
+#
+# A recorded corpus is one JSON object per line with "pre_plain_text" and
+# "text" (and optionally "id"), i.e. what check_messages reads off the page.
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stand_ins import FakeDriver, FakeSpreadsheet, FakeWorksheet, install_stand_ins  # noqa: E402
+from synthetic import synthetic_messages, synthetic_roster, synthetic_sheet  # noqa: E402
+
+# Stage each of the bot's functions is counted under. Time is exclusive, i.e.
+# the time spent in match_name is not counted again under state update.
+BOT_STAGES = {
+    "extract_messages": "scrape",
+    "drain_messages": "scrape",
+    "check_messages": "classification",
+}
+STATE_STAGES = {
+    "parse_message": "classification",
+    "match_name": "match_name",
+    "parse_reply": "state update",
+    "parse_movement": "state update",
+    "update_PS": "sheet write",
+    "update_ongoingDetails": "sheet write",
+}
+
+
+def load_bot():
+    # WhatsappBot.py is the Selenium/gspread runtime, its imports need either
+    # the real packages or the stand-ins
+    install_stand_ins()
+    import WhatsappBot
+
+    return WhatsappBot
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._stack = []
+
+    def wrap(self, stage, fn):
+        def wrapped(*args, **kwargs):
+            self._stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = self._stack.pop()
+                self.samples[stage].append(elapsed - nested)
+                if self._stack:
+                    self._stack[-1] += elapsed
+
+        return wrapped
+
+    def summary(self):
+        return {stage: summarize(samples) for stage, samples in self.samples.items()}
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return 0.0
+    k = min(len(sorted_samples) - 1, int(round(p / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[k]
+
+
+def summarize(samples):
+    s = sorted(samples)
+    return {
+        "calls": len(s),
+        "total_ms": sum(s) * 1e3,
+        "p50_us": percentile(s, 50) * 1e6,
+        "p99_us": percentile(s, 99) * 1e6,
+    }
+
+
+def setup(roster_size, seed, sheet_latency=0, ingest="scan"):
+    # A ParadeState wired to stand-ins with the roster loaded, and
+    # check_messages (scan) or the observer queue bound to a fake driver
+    from parade_state import ParadeState
+    from whatsapp_scraper import SeenMessages
+
+    rng = random.Random(seed)
+    roster = synthetic_roster(roster_size, rng)
+    sh = FakeSpreadsheet(
+        [
+            FakeWorksheet("MHN Parade State", synthetic_sheet(roster, rng), sheet_latency),
+            FakeWorksheet("Auto_Generated", latency=sheet_latency),
+            FakeWorksheet("Daily Reporting", latency=sheet_latency),
+        ]
+    )
+
+    bot = load_bot()
+    timer = StageTimer()
+    state = ParadeState.from_spreadsheet(sh, write_debounce=bot.WRITE_DEBOUNCE)
+    for name, stage in STATE_STAGES.items():
+        setattr(state, name, timer.wrap(stage, getattr(state, name)))
+    state.outputs.register("PS", state.update_PS)
+    state.outputs.register("ongoingDetails", state.update_ongoingDetails)
+    state.load_roster()
+
+    # The wrapped functions are swapped back in after every call, so that
+    # several setups can coexist
+    extract = timer.wrap(BOT_STAGES["extract_messages"], bot.extract_messages)
+    drain = timer.wrap(BOT_STAGES["drain_messages"], bot.drain_messages)
+    driver = FakeDriver()
+    seen_messages = SeenMessages()
+    if ingest == "observer":
+        bot.install_observer(driver)
+
+    def poll(last_checked):
+        if ingest == "observer":
+            return bot.process_messages(drain(driver), state, seen_messages, last_checked)
+        original = bot.extract_messages
+        bot.extract_messages = extract
+        try:
+            return bot.check_messages(driver, state, seen_messages, last_checked)
+        finally:
+            bot.extract_messages = original
+
+    today = datetime.today()
+    return {
+        "sh": sh,
+        "state": state,
+        "driver": driver,
+        "poll": timer.wrap(BOT_STAGES["check_messages"], poll),
+        "last_checked": datetime(today.year, today.month, today.day, 8, 0),
+    }, roster, timer
+
+
+def replay(env, messages, poll_size):
+    # Posts messages to the fake chat poll_size at a time, running one
+    # check_messages and one flush per poll like the main loop does
+    driver = env["driver"]
+    last_checked = env["last_checked"]
+    latencies = []
+    for i in range(0, len(messages), poll_size):
+        driver.post(messages[i : i + poll_size])
+        start = time.perf_counter()
+        last_checked = env["poll"](last_checked)
+        env["state"].flush()
+        latencies.append((time.perf_counter() - start) / poll_size)
+    return latencies
+
+
+def load_corpus(path):
+    messages = []
+    with open(path) as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                m = json.loads(line)
+                messages.append((m.get("id") or f"corpus_{i}", m["pre_plain_text"], m["text"]))
+    return messages
+
+
+def run(
+    roster_size,
+    n_messages,
+    poll_size,
+    seed,
+    corpus=None,
+    sheet_latency=0,
+    memory=True,
+    ingest="scan",
+):
+    env, roster, timer = setup(roster_size, seed, sheet_latency, ingest)
+    if corpus:
+        messages = corpus[:n_messages] if n_messages else corpus
+    else:
+        messages = synthetic_messages(roster, n_messages, random.Random(seed + 1))
+
+    start = time.perf_counter()
+    per_message = replay(env, messages, poll_size)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "roster_size": roster_size,
+        "messages": len(messages),
+        "poll_size": poll_size,
+        "ingest": ingest,
+        "seconds": elapsed,
+        "messages_per_sec": len(messages) / elapsed if elapsed else 0.0,
+        "per_message": summarize(per_message),
+        "stages": timer.summary(),
+        "sheet_api_calls": env["sh"].api_calls(),
+        "sheet_cells_written": env["sh"].cells_written(),
+        "driver_calls": env["driver"].calls,
+        "outputs": env["state"].outputs.stats(),
+    }
+
+    if memory:
+        # Separate pass, as tracemalloc slows everything down
+        env, roster, _ = setup(roster_size, seed, sheet_latency, ingest)
+        tracemalloc.start()
+        replay(env, messages, poll_size)
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--roster-sizes", nargs="+", type=int, default=[50, 200, 1000])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--poll-size", type=int, default=20, help="Messages per poll")
+    parser.add_argument(
+        "--ingest",
+        choices=["scan", "observer"],
+        default="scan",
+        help="Full chat scan every poll, or drain the observer queue",
+    )
+    parser.add_argument("--corpus", help="Recorded messages, one JSON object per line")
+    parser.add_argument("--sheet-latency", type=float, default=0, help="Seconds per sheet call")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory pass")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    # The bot logs at INFO, keep that out of the timings
+    logging.disable(logging.CRITICAL)
+    corpus = load_corpus(args.corpus) if args.corpus else None
+
+    runs = []
+    for size in args.roster_sizes:
+        result = run(
+            size,
+            args.messages,
+            args.poll_size,
+            args.seed,
+            corpus=corpus,
+            sheet_latency=args.sheet_latency,
+            memory=not args.no_memory,
+            ingest=args.ingest,
+        )
+        runs.append(result)
+        print(
+            f"roster {size:>5}: {result['messages_per_sec']:8.1f} msg/s, "
+            f"{result['sheet_api_calls']} sheet calls, "
+            f"peak {result.get('peak_memory_bytes', 0) / 1e6:.1f} MB"
+        )
+        for stage, s in sorted(result["stages"].items()):
+            print(
+                f"    {stage:<15} {s['calls']:>6} calls  "
+                f"p50 {s['p50_us']:10.1f} us  p99 {s['p99_us']:10.1f} us"
+            )
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "args": vars(args),
+        "runs": runs,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
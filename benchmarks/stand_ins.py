@@ -0,0 +1,290 @@
+# In-memory stand-ins for gspread and Selenium
+#
+# Enough of both APIs for the bot's functions to run without a spreadsheet or
+# a browser. Every call is counted, and an optional delay can be added to each
+# sheet call to mimic network latency.
+import re
+import sys
+import time
+import types
+
+_A1 = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+def a1_to_rowcol(a1):
+    m = _A1.match(a1)
+    col = 0
+    for c in m.group(1):
+        col = col * 26 + ord(c) - 64
+    return int(m.group(2)), col
+
+
+def parse_range(range_str):
+    # "'Sheet'!A1:H100" or "B2" -> (sheet or None, (row, col), (row, col) or None)
+    sheet = None
+    if "!" in range_str:
+        sheet, range_str = range_str.split("!")
+        sheet = sheet.strip("'")
+    if ":" in range_str:
+        start, end = range_str.split(":")
+        return sheet, a1_to_rowcol(start), a1_to_rowcol(end)
+    return sheet, a1_to_rowcol(range_str), None
+
+
+class FakeWorksheet:
+    def __init__(self, title, rows=None, latency=0):
+        self.title = title
+        self.latency = latency
+        self.cells = {}
+        self.calls = 0
+        self.cells_written = 0
+        for r, values in enumerate(rows or [], 1):
+            for c, value in enumerate(values, 1):
+                self.cells[(r, c)] = value
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _write(self, start, values):
+        row, col = start
+        for r, row_values in enumerate(values):
+            for c, value in enumerate(row_values):
+                # None leaves the cell as it is, like the Sheets API
+                if value is not None:
+                    self.cells[(row + r, col + c)] = value
+                    self.cells_written += 1
+
+    def clear(self, start, end):
+        for r in range(start[0], end[0] + 1):
+            for c in range(start[1], end[1] + 1):
+                self.cells.pop((r, c), None)
+
+    def get_all_values(self):
+        self._call()
+        if not self.cells:
+            return []
+        n_rows = max(r for r, _ in self.cells)
+        n_cols = max(c for _, c in self.cells)
+        return [
+            [str(self.cells.get((r, c), "")) for c in range(1, n_cols + 1)]
+            for r in range(1, n_rows + 1)
+        ]
+
+    def get(self, range_str):
+        self._call()
+        _, start, end = parse_range(range_str)
+        end = end or start
+        return [
+            [str(self.cells.get((r, c), "")) for c in range(start[1], end[1] + 1)]
+            for r in range(start[0], end[0] + 1)
+        ]
+
+    def update(self, range_str, values, value_input_option="RAW"):
+        self._call()
+        self._write(parse_range(range_str)[1], values)
+
+    def batch_update(self, data, value_input_option="RAW"):
+        self._call()
+        for d in data:
+            self._write(parse_range(d["range"])[1], d["values"])
+
+    def update_cell(self, row, col, value):
+        self._call()
+        self.cells[(row, col)] = value
+        self.cells_written += 1
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets, latency=0):
+        self.worksheets = {ws.title: ws for ws in worksheets}
+        self.latency = latency
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def worksheet(self, title):
+        return self.worksheets[title]
+
+    def values_clear(self, range_str):
+        self._call()
+        sheet, start, end = parse_range(range_str)
+        self.worksheets[sheet].clear(start, end or start)
+
+    def values_batch_update(self, body):
+        # One call for ranges on any of the worksheets
+        self._call()
+        for d in body["data"]:
+            sheet, start, _ = parse_range(d["range"])
+            self.worksheets[sheet]._write(start, d["values"])
+
+    def api_calls(self):
+        return self.calls + sum(ws.calls for ws in self.worksheets.values())
+
+    def cells_written(self):
+        return sum(ws.cells_written for ws in self.worksheets.values())
+
+
+class FakeElement:
+    def __init__(self, on_click=None):
+        self.on_click = on_click
+
+    def click(self):
+        if self.on_click:
+            self.on_click()
+
+    def send_keys(self, *keys):
+        pass
+
+
+class FakeDriver:
+    # Renders the last `window` messages of the chat, like WhatsApp Web does,
+    # and queues new ones for drain_messages once the observer is installed.
+    # Clicking an element found by "contains(@title, 'X')" opens chat X.
+    # Scrolling to the top renders `page` more of `older`, the messages from
+    # before the ones rendered.
+    def __init__(self, window=100, page=30):
+        self.window = window
+        self.page = page
+        self.messages = []
+        self.older = []
+        self.scrolls = 0
+        self.observed = None
+        self.chat = None
+        self.calls = 0
+        self.screenshots = 0
+
+    def post(self, messages):
+        self.messages.extend(messages)
+        del self.messages[: -self.window]
+        if self.observed is not None:
+            self.observed.extend(messages)
+
+    def find_element(self, by=None, value=None):
+        self.calls += 1
+        title = re.search(r"@title, '([^']*)'", value or "")
+        if title:
+            return FakeElement(lambda: setattr(self, "chat", title.group(1)))
+        return FakeElement()
+
+    def find_element_by_xpath(self, xpath):
+        return self.find_element("xpath", xpath)
+
+    def find_elements_by_class_name(self, name):
+        self.calls += 1
+        return [FakeElement() for _ in self.messages]
+
+    def execute_script(self, script, *args):
+        from whatsapp_scraper import (
+            CURRENT_CHAT_JS,
+            DRAIN_QUEUE_JS,
+            EXTRACT_RANGE_JS,
+            INSTALL_OBSERVER_JS,
+            OLDEST_MESSAGE_JS,
+            SCROLL_CHAT_JS,
+        )
+
+        self.calls += 1
+        if script == INSTALL_OBSERVER_JS:
+            if self.observed is None:
+                self.observed = []
+            return True
+        if script == DRAIN_QUEUE_JS:
+            if self.observed is None:
+                return None
+            queued, self.observed = self.observed, []
+            return [list(m) for m in queued]
+        if script == CURRENT_CHAT_JS:
+            return self.chat
+        if script == OLDEST_MESSAGE_JS:
+            if not self.messages:
+                return [0, None, None, None]
+            return [len(self.messages)] + list(self.messages[0])
+        if script == SCROLL_CHAT_JS:
+            if args[0] and self.older:
+                self.scrolls += 1
+                loaded = self.older[-self.page :]
+                del self.older[-self.page :]
+                self.messages[:0] = loaded
+            return bool(self.messages)
+        if script == EXTRACT_RANGE_JS:
+            start, count = args
+            return [list(m) for m in self.messages[start : start + count]]
+        return [list(m) for m in self.messages]
+
+    def save_screenshot(self, path):
+        self.calls += 1
+        self.screenshots += 1
+        return True
+
+
+def install_stand_ins():
+    # Registers bare modules for selenium and gspread if they are not
+    # installed, so that the bot's imports resolve. The installed packages are
+    # used when available.
+    try:
+        import selenium  # noqa: F401
+    except ImportError:
+        _install_selenium()
+    try:
+        import gspread  # noqa: F401
+    except ImportError:
+        sys.modules["gspread"] = types.SimpleNamespace(service_account=None)
+
+
+def _install_selenium():
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+        return mod
+
+    class WebDriverWait:
+        def __init__(self, driver, timeout):
+            self.driver = driver
+
+        def until(self, condition):
+            return condition(self.driver)
+
+    def presence_of_element_located(locator):
+        return lambda driver: driver.find_element(*locator)
+
+    def invisibility_of_element_located(locator):
+        return lambda driver: True
+
+    class Keys:
+        PAGE_UP = ""
+        END = ""
+
+    class By:
+        XPATH = "xpath"
+        CLASS_NAME = "class name"
+
+    module("selenium")
+    module("selenium.webdriver", Chrome=FakeDriver)
+    module("selenium.webdriver.common")
+    module("selenium.webdriver.common.keys", Keys=Keys)
+    module("selenium.webdriver.common.by", By=By)
+    module("selenium.webdriver.support")
+    module("selenium.webdriver.support.ui", WebDriverWait=WebDriverWait)
+    module(
+        "selenium.webdriver.support.expected_conditions",
+        presence_of_element_located=presence_of_element_located,
+        invisibility_of_element_located=invisibility_of_element_located,
+    )
+    sys.modules["selenium.webdriver.support"].expected_conditions = sys.modules[
+        "selenium.webdriver.support.expected_conditions"
+    ]
+    module("selenium.webdriver.chrome")
+    module("selenium.webdriver.chrome.options", Options=object)
+    module("selenium.common")
+    module(
+        "selenium.common.exceptions",
+        StaleElementReferenceException=type("StaleElementReferenceException", (Exception,), {}),
+        NoSuchElementException=type("NoSuchElementException", (Exception,), {}),
+    )
+    sys.modules["selenium"].webdriver = sys.modules["selenium.webdriver"]
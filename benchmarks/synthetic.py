@@ -0,0 +1,120 @@
+# Synthetic rosters and messages for the benchmarks
+#
+# Messages follow the formats the bot sees in the group, e.g.
+#
+#   1x 5ton MOV            CPL Tan Wei          RTU
+#   TO: CPL Wei Tan        1x 5ton MOV          Reached
+#   VC: 3SG Lim Jun        TO: CPL Wei Tan      14:05
+#   MID: 41234             ...
+#   Purpose: Training      RTU reached
+#   13:45                  14:02
+from datetime import datetime, timedelta
+
+RANKS = ["PTE", "LCP", "CPL", "CFC", "3SG", "2SG", "1SG", "SSG", "2LT", "LTA", "CPT"]
+SURNAMES = ["TAN", "LIM", "LEE", "NG", "ONG", "WONG", "GOH", "CHUA", "CHAN", "KOH",
+            "TEO", "ANG", "YEO", "TAY", "HO", "LOW", "TOH", "SIM", "CHONG", "CHIA"]
+GIVEN = ["WEI", "JUN", "MING", "JIE", "HAO", "KAI", "YONG", "XIAN", "ZHI", "HONG",
+         "KIAN", "BOON", "SENG", "HUI", "YI", "EN", "JIA", "RUI", "ZHENG", "LONG",
+         "MUHAMMAD", "HAFIZ", "IRFAN", "ARJUN", "RAJ", "DANIEL", "RYAN", "MARCUS"]
+PLATOONS = ["HQ PLATOON", "PLATOON 1", "PLATOON 2"]
+STATUSES = ["PRESENT"] * 8 + ["WFH", "OFF", "LEAVE", "MC", "AO", "RS"]
+MODELS = ["5ton", "ambulance", "ouv", "mb"]
+PURPOSES = ["Training", "Medical Cover", "Admin Run", "Resupply", "Assessment"]
+CHATTER = ["Noted", "ok sir", "Will do", "Anyone has the list for tmr?", "Thanks!"]
+
+
+def synthetic_roster(size, rng):
+    # [(S/N, RANK, NAME)], with no two people sharing a name
+    roster = []
+    taken = set()
+    for sn in range(1, size + 1):
+        while True:
+            tokens = [rng.choice(SURNAMES)] + rng.sample(GIVEN, rng.randint(1, 4))
+            name = " ".join(tokens)
+            if name not in taken:
+                break
+        taken.add(name)
+        roster.append((sn, rng.choice(RANKS), name))
+    return roster
+
+
+def synthetic_sheet(roster, rng):
+    # What PSsheet.get_all_values() returns for the roster: a title row, a
+    # header row, then one row per person, with REMARKS after the 7 columns
+    # that initialize_PS keeps
+    rows = [["MHN Parade State", "", "", "", "", "", "", ""]]
+    rows.append(["S/N", "RANK", "NAME", "PLATOON", "VOCATION", "STATUS", "CONTACT", "REMARKS"])
+    for sn, rank, name in roster:
+        remarks = "AMB DUTY" if rng.random() < 0.02 else ""
+        rows.append(
+            [
+                str(sn),
+                rank,
+                name,
+                rng.choice(PLATOONS),
+                "TO",
+                rng.choice(STATUSES),
+                f"9{rng.randint(1000000, 9999999)}",
+                remarks,
+            ]
+        )
+    return rows
+
+
+def written_name(rank, name, rng):
+    # How people write a name: shuffled, partial and in title case
+    tokens = name.split()
+    rng.shuffle(tokens)
+    tokens = tokens[: rng.randint(min(2, len(tokens)), len(tokens))]
+    return " ".join([rank] + [x.title() for x in tokens])
+
+
+def sender_str(rank, name):
+    # Contacts are saved as "Wei Tan (CPL, PLT 1)", see message_parser.sender_name
+    return f"{name.title()} ({rank}, PLT 1):"
+
+
+def synthetic_messages(roster, count, rng, start=None):
+    # [(message_id, pre_plain_text, text)], two messages a minute,
+    # mixing new movements, both kinds of RTU replies, and chatter that the
+    # filter in check_messages drops
+    if start is None:
+        today = datetime.today()
+        start = datetime(today.year, today.month, today.day, 8, 0)
+
+    out = []  # vehicles currently out: (plate, to, vc, movement lines)
+    messages = []
+    for i in range(count):
+        sent = start + timedelta(seconds=30 * i)
+        _, rank, name = rng.choice(roster)
+        sender = sender_str(rank, name)
+        kind = rng.random()
+
+        if kind < 0.4 or not out:
+            to = rng.choice(roster)
+            vc = rng.choice(roster)
+            plate = str(rng.randint(10000, 99999))
+            lines = [
+                f"1x {rng.choice(MODELS)} MOV",
+                f"TO: {written_name(to[1], to[2], rng)}",
+                f"VC: {written_name(vc[1], vc[2], rng)}",
+                f"MID: {plate}",
+                f"Purpose: {rng.choice(PURPOSES)}",
+            ]
+            out.append((plate, to, vc, list(lines)))
+            sender = sender_str(to[1], to[2])
+        elif kind < 0.6:
+            plate, to, vc, movement = out.pop(rng.randrange(len(out)))
+            lines = [written_name(to[1], to[2], rng)] + movement + ["RTU reached"]
+            sender = sender_str(to[1], to[2])
+        elif kind < 0.8:
+            plate, to, vc, movement = out.pop(rng.randrange(len(out)))
+            lines = ["RTU", "Reached"]
+            sender = sender_str(to[1], to[2])
+        else:
+            lines = [rng.choice(CHATTER)]
+
+        lines.append(sent.strftime("%H:%M"))
+        pre_plain_text = f"[{sent.strftime('%H:%M, %d/%m/%Y')}] {sender} "
+        messages.append((f"false_group_{i:08d}", pre_plain_text, "\n".join(lines)))
+    return messages
@@ -0,0 +1,260 @@
+# Rebuilding the state from a WhatsApp chat export
+#
+# "Export chat" gives a .txt with one message after the other, each starting
+# with the time and the sender, e.g.
+#
+#   17/10/2026, 13:45 - Wei Tan (CPL, PLT 1): 1x 5ton MOV      (Android)
+#   [17/10/2026, 13:45:12] Wei Tan (CPL, PLT 1): 1x 5ton MOV   (iOS)
+#   [13:45, 17/10/2026] Wei Tan (CPL, PLT 1): 1x 5ton MOV      (as on the page)
+#
+# with the other lines of a message following on their own. The export is
+# streamed through generators, one message at a time, into the same parsing
+# as the bot's (tokenize, then ParadeState.parse_message), so exports of
+# hundreds of MB go through in constant memory. Nothing is written to the
+# sheets until the end, which is a single flush.
+#
+# Usage:
+#   python chat_import.py export.txt --since 2026-10-01 --until 2026-10-17
+#   python chat_import.py export.txt --dry-run
+#   python chat_import.py export.txt --journal state   # for the bot to carry on from
+import argparse
+from datetime import datetime, timedelta
+import logging
+import re
+import time
+import traceback
+
+from message_parser import tokenize
+from whatsapp_scraper import message_key, parse_pre_plain_text
+
+# date, time, rest of the line
+HEADERS = [
+    # Android: "17/10/2026, 13:45 - " or "17/10/26, 1:45 pm - "
+    re.compile(
+        r"^(\d{1,2}/\d{1,2}/\d{2,4}), (\d{1,2}:\d{2})(?::\d{2})?(\s?[AaPp]\.?[Mm]\.?)? - (.*)$"
+    ),
+    # iOS: "[17/10/2026, 13:45:12] "
+    re.compile(
+        r"^\[(\d{1,2}/\d{1,2}/\d{2,4}), (\d{1,2}:\d{2})(?::\d{2})?(\s?[AaPp]\.?[Mm]\.?)?\] (.*)$"
+    ),
+]
+# Like data-pre-plain-text: "[13:45, 17/10/2026] "
+PAGE_HEADER = re.compile(r"^\[(\d{1,2}:\d{2}), (\d{1,2}/\d{1,2}/\d{2,4})\] (.*)$")
+
+# Added by iOS before attachments and some system messages
+MARKS = "\u200e\u200f"
+
+
+class ImportStats:
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        self.messages = 0
+        self.in_range = 0
+        self.updates = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def __str__(self):
+        elapsed = self.elapsed()
+        return (
+            f"{self.lines} lines ({self.bytes / 1e6:.1f} MB), {self.messages} messages, "
+            f"{self.in_range} in range, {self.updates} updates parsed, {self.errors} errors "
+            f"in {elapsed:.1f}s: {self.lines / max(elapsed, 1e-9):.0f} lines/s"
+        )
+
+
+def read_lines(path, stats):
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            stats.lines += 1
+            stats.bytes += len(line)
+            yield line.rstrip("\r\n")
+
+
+def parse_header(line):
+    # (pre_plain_text, first line of the message) if the line starts a
+    # message, "" as the pre_plain_text for system messages, which have no
+    # sender. None if the line carries on the message before.
+    line = line.lstrip(MARKS)
+    match = PAGE_HEADER.match(line)
+    if match:
+        time_str, date_str, rest = match.groups()
+    else:
+        for header in HEADERS:
+            match = header.match(line)
+            if match:
+                break
+        else:
+            return None
+        date_str, time_str, am_pm, rest = match.groups()
+        if am_pm:
+            hour, minute = time_str.split(":")
+            hour = int(hour) % 12 + (12 if am_pm.strip()[0] in "Pp" else 0)
+            time_str = f"{hour:02d}:{minute}"
+        day, month, year = date_str.split("/")
+        if len(year) == 2:
+            date_str = f"{day}/{month}/20{year}"
+
+    sender, sep, text = rest.partition(": ")
+    if not sep:
+        return "", rest
+    return f"[{time_str}, {date_str}] {sender}: ", text
+
+
+def group_messages(lines, stats):
+    # (pre_plain_text, text) per message. The text ends with the time on its
+    # own line, like the message's innerText on the page, which tokenize
+    # relies on to tell replies apart.
+    pre_plain_text, text = None, []
+    for line in lines:
+        header = parse_header(line)
+        if header is None:
+            if pre_plain_text is not None:
+                text.append(line)
+            continue
+        if pre_plain_text:
+            stats.messages += 1
+            yield pre_plain_text, "\n".join(text + [pre_plain_text[1:].split(",")[0]])
+        pre_plain_text, first = header
+        text = [first.lstrip(MARKS)]
+    if pre_plain_text:
+        stats.messages += 1
+        yield pre_plain_text, "\n".join(text + [pre_plain_text[1:].split(",")[0]])
+
+
+def in_range(messages, stats, since=None, until=None):
+    # (message_time, pre_plain_text, text) of the messages sent from since
+    # and before until. Exports are in order, so it stops at until.
+    for pre_plain_text, text in messages:
+        try:
+            message_time = parse_pre_plain_text(pre_plain_text)[0]
+        except ValueError:
+            # A date it can't read, the rest of the export still goes in
+            stats.errors += 1
+            logging.warning("Skipping a message with the header %r", pre_plain_text)
+            continue
+        if since is not None and message_time < since:
+            continue
+        if until is not None and message_time >= until:
+            return
+        stats.in_range += 1
+        yield message_time, pre_plain_text, text
+
+
+def updates(messages):
+    # The same filter as check_messages: (key, message_time, ParsedMessage)
+    # of the movements and RTUs. Exported replies don't have the quoted
+    # message, their first line is already what was said.
+    for message_time, pre_plain_text, text in messages:
+        parsed = tokenize(text, quoted=False)
+        if parsed is None:
+            continue
+        parsed.sender = parse_pre_plain_text(pre_plain_text)[2]
+        parsed.time = message_time
+        yield message_key(None, pre_plain_text, text), message_time, parsed
+
+
+def apply_updates(state, parsed_updates, stats):
+    # Into the state, with no writes to the sheets. Details nobody sent an
+    # RTU for are dropped at the start of every day, as the morning refresh
+    # does for the bot.
+    day = None
+    with state.lock:
+        for key, message_time, parsed in parsed_updates:
+            if key in state.applied_messages:
+                continue
+            if message_time.date() != day:
+                if day is not None:
+                    state.expire_details(now=message_time)
+                day = message_time.date()
+            try:
+                state.parse_message(parsed)
+                stats.updates += 1
+            except Exception:
+                stats.errors += 1
+                logging.error(traceback.format_exc())
+                logging.error(parsed.lines)
+            state.record_message(key, message_time)
+
+
+def import_chat(path, state, since=None, until=None):
+    # Parses the export at path into state, and returns the ImportStats.
+    # Nothing is written out, see state.flush().
+    stats = ImportStats()
+    lines = read_lines(path, stats)
+    messages = in_range(group_messages(lines, stats), stats, since, until)
+    apply_updates(state, updates(messages), stats)
+    return stats
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the parade state from a chat export")
+    parser.add_argument("export", help="The .txt from WhatsApp's Export chat")
+    parser.add_argument("--since", type=parse_date, help="First day to import, YYYY-MM-DD")
+    parser.add_argument("--until", type=parse_date, help="Last day to import, YYYY-MM-DD")
+    parser.add_argument("--spreadsheet", help="Key of the spreadsheet, default SPREADSHEET_KEY")
+    parser.add_argument(
+        "--journal", help="Journal directory to write the result to, e.g. the bot's JOURNAL_DIR"
+    )
+    parser.add_argument("--history", help="MovementHistory directory to add the movements to")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Don't write to the sheets, --journal or --history",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+
+    # Only needed here, the functions above work on any ParadeState
+    import gspread
+
+    from movement_history import MovementHistory
+    from parade_state import SPREADSHEET_KEY, ParadeState
+    from sheets_client import SheetsClient
+    from state_journal import StateJournal
+
+    sh = SheetsClient(gspread.service_account().open_by_key(args.spreadsheet or SPREADSHEET_KEY))
+    # A dry run doesn't write anything, the journal and history included
+    journal = history = None
+    if args.journal and not args.dry_run:
+        journal = StateJournal(args.journal, fsync_every=0)
+        # So that numbering carries on from what is already there. The state
+        # itself is rebuilt from the sheet and the export.
+        journal.load()
+    if args.history and not args.dry_run:
+        history = MovementHistory(args.history)
+    state = ParadeState.from_spreadsheet(sh, journal=journal, history=history)
+    # The roster as the sheet has it, the export is applied on top
+    state.load_roster()
+
+    until = args.until + timedelta(days=1) if args.until else None
+    stats = import_chat(args.export, state, args.since, until)
+    print(stats)
+    print(f"{len(state.ongoingDetails)} details still out:")
+    for veh in state.ongoingDetails:
+        print("  " + ", ".join(str(veh).splitlines()))
+
+    if args.dry_run:
+        return
+    # The one write to the sheets, plus the journal's snapshot
+    state.flush(force=True)
+    if state.history is not None:
+        state.history.close()
+    print(f"Written, Sheets calls: {sh.stats()}")
+
+
+if __name__ == "__main__":
+    main()
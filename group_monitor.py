@@ -0,0 +1,154 @@
+# Watching several WhatsApp groups from one browser
+#
+# Each group has its own roster and spreadsheet, i.e. its own ParadeState.
+# WhatsApp Web only renders the chat that is open, so the one driver goes
+# round the groups in turn, opening each chat and reading what it shows.
+# Everything else for a group (parsing, the manual refresh flag, the daily
+# jobs, writing to its sheet) is handed to a worker pool shared by all groups.
+#
+# A group's tasks run one at a time and in order, so its messages are parsed
+# in the order they were read. A group only holds one worker per turn: with
+# tasks left over, it goes to the back of the pool's queue, so a busy group
+# can't starve the others.
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+import traceback
+
+from scheduler import Scheduler, default_jobs
+from whatsapp_scraper import SeenMessages, screenshot_if_requested, take_screenshot
+
+
+class Group:
+    def __init__(self, name, chat, state, last_checked, seen_messages=None):
+        # chat: title of the WhatsApp chat, as in TO_UPDATE
+        self.name = name
+        self.chat = chat
+        self.state = state
+        self.last_checked = last_checked
+        self.seen_messages = seen_messages or SeenMessages()
+        self.scheduler = Scheduler(default_jobs(state))
+
+        self._tasks = deque()
+        self._busy = False
+        self.scans = 0
+        self.tasks_run = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return f"Group({self.name!r}, {self.chat!r})"
+
+
+class GroupMonitor:
+    def __init__(self, driver, groups, scan, process, workers=4, scan_interval=60):
+        # scan(driver, chat) -> rows, process(rows, state, seen_messages,
+        # last_checked) -> last_checked, see WhatsappBot. Every chat is
+        # scanned once per scan_interval.
+        self.driver = driver
+        self.groups = list(groups)
+        self.scan = scan
+        self.process = process
+        self.scan_interval = scan_interval
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="group")
+        self._lock = threading.Lock()
+        self._turn = 0
+
+    def submit(self, group, fn):
+        # Runs fn in the pool, after the group's earlier tasks
+        with self._lock:
+            group._tasks.append(fn)
+            if group._busy:
+                return
+            group._busy = True
+        self.pool.submit(self._run, group)
+
+    def _run(self, group):
+        # Whatever the group had queued when its turn came, then its worker
+        # goes back to the pool
+        with self._lock:
+            tasks = list(group._tasks)
+            group._tasks.clear()
+        for fn in tasks:
+            try:
+                fn()
+            except Exception:
+                group.errors += 1
+                logging.error("%s: %s", group.name, traceback.format_exc())
+                print(traceback.format_exc())
+            group.tasks_run += 1
+
+        with self._lock:
+            if not group._tasks:
+                group._busy = False
+                return
+        self.pool.submit(self._run, group)
+
+    def _process(self, group, rows):
+        group.last_checked = self.process(
+            rows, group.state, group.seen_messages, group.last_checked
+        )
+        group.state.flush()
+
+    def _housekeeping(self, group):
+        # What the single group bot does once a minute, besides scanning
+        group.state.check_refresh_flag()
+        group.state.verify_outputs()
+        group.scheduler.run_pending()
+        group.state.flush()
+
+    def tick(self):
+        # Scans the next group's chat, returns that group
+        group = self.groups[self._turn % len(self.groups)]
+        self._turn += 1
+        rows = self.scan(self.driver, group.chat)
+        group.scans += 1
+        self.submit(group, lambda: self._process(group, rows))
+        return group
+
+    def run(self):
+        next_tick = time.monotonic()
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                logging.error(traceback.format_exc())
+                print(traceback.format_exc())
+                take_screenshot(self.driver)
+            screenshot_if_requested(self.driver)
+
+            # Once round all of them
+            if self._turn % len(self.groups) == 0:
+                for g in self.groups:
+                    self.submit(g, lambda g=g: self._housekeeping(g))
+                print(f"Last Run at: {time.strftime('%H:%M:%S')}", flush=True)
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug("Groups: %s", self.stats())
+
+            next_tick += self.scan_interval / len(self.groups)
+            time.sleep(max(0, next_tick - time.monotonic()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                g.name: {
+                    "scans": g.scans,
+                    "tasks_run": g.tasks_run,
+                    "queued": len(g._tasks),
+                    "errors": g.errors,
+                }
+                for g in self.groups
+            }
+
+    def close(self):
+        # Lets every group finish what it has queued. Groups put themselves
+        # back in the pool, so wait for them to be idle before shutting it.
+        while True:
+            with self._lock:
+                if not any(g._busy for g in self.groups):
+                    break
+            time.sleep(0.05)
+        self.pool.shutdown(wait=True)
+        for g in self.groups:
+            g.state.flush(force=True)
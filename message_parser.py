@@ -0,0 +1,185 @@
+# Reading a WhatsApp message into what the bot needs from it
+#
+# A message used to be looked at several times over: lowercased for the
+# filter, scanned for TO/VC, split on ":" again for MID and Purpose by the
+# reply and the movement code, and re-split for every RTU keyword. tokenize()
+# does it all in one go and returns a ParsedMessage, or None for messages
+# that aren't updates.
+#
+# Messages look like one of
+#
+#   1x 5ton MOV            CPL Tan Wei          NAME
+#   TO: CPL Wei Tan        1x 5ton MOV          NAME
+#   VC: 3SG Lim Jun        TO: CPL Wei Tan      RTU
+#   MID: 41234             ...                  Reached
+#   Purpose: Training      RTU reached          14:05
+#   13:45                  14:02
+#
+# i.e. a movement, a reply quoting the movement, or a reply to a reply, which
+# only has the sender to go on. Replies start with the name(s) of who is being
+# replied to, which are skipped. Chat exports leave the quote out, see
+# chat_import.py.
+import re
+
+MOVEMENT = "movement"
+REPLY = "reply"
+
+# "1x 5ton MOV", "2 x ouv mov", "5ton MOV", but not "3SG Lim Jun"
+MOVEMENT_HEADER = re.compile(r"^\d+\s*x|^\d.*mov", re.IGNORECASE)
+# Any of these followed later on by "reach" means they are back.
+# Assessments always come back to MHC.
+RETURN_KEYWORDS = ["rtu", "assessment", "to mh"]
+
+
+class ParsedMessage:
+    __slots__ = (
+        "kind",
+        "lines",
+        "body",
+        "to",
+        "vc",
+        "model",
+        "plate",
+        "purpose",
+        "has_details",
+        "rtu",
+        "reached",
+        "returned",
+        "sender",
+        "time",
+    )
+
+    def __init__(self, lines):
+        # lines: every non-empty line. body: the lines after the quoted names.
+        self.lines = lines
+        self.kind = None
+        self.body = lines
+        self.to = None
+        self.vc = None
+        self.model = None
+        self.plate = None
+        self.purpose = None
+        # Quotes the whole movement, i.e. has both the TO and the VC
+        self.has_details = False
+        self.rtu = False
+        self.reached = False
+        self.returned = False
+        # From data-pre-plain-text, see parse_pre_plain_text
+        self.sender = None
+        self.time = None
+
+    def __repr__(self):
+        return (
+            f"ParsedMessage({self.kind!r}, to={self.to!r}, vc={self.vc!r}, "
+            f"plate={self.plate!r}, returned={self.returned})"
+        )
+
+
+def _is_update(message, lower):
+    # Filters out irrelevant messages and detail forecast message
+    return (("MID" in message) and ("to:" in lower or "to :" in lower)) or (
+        "rtu" in lower and "reach" in lower
+    )
+
+
+def split_message(message):
+    # Message text -> lines, without the empty ones (there rarely are any)
+    lines = message.splitlines()
+    if "" in lines:
+        return [x for x in lines if x]
+    return lines
+
+
+def split_field(line):
+    # "MID: 41234" / "MID 41234" -> ("MID", "41234"). Only the first ":"
+    # counts, so "MID: 12:34" is ("MID", "12:34").
+    if ":" in line:
+        key, _, value = line.partition(":")
+        return key, value
+    fragments = line.split()
+    if len(fragments) > 1:
+        return fragments[0], " ".join(fragments[1:])
+    return "", ""
+
+
+def start_line(lines):
+    # Index of the first line after the quoted names
+    if len(lines) < 3:
+        return 0
+    if MOVEMENT_HEADER.match(lines[0]):
+        return 0
+    if lines[0] == lines[1] or (MOVEMENT_HEADER.match(lines[2]) and ":" not in lines[2]):
+        return 2
+    return 1
+
+
+def sender_name(sender_str):
+    # Contacts are saved as "Wei Tan (CPL, PLT 1):" -> "CPL Wei Tan"
+    if not sender_str:
+        return None
+    name_split = sender_str.split(",")[0].replace("(", "").split()
+    return " ".join(name_split[-1:] + name_split[:-1])
+
+
+def tokenize(message, quoted=True):
+    # ParsedMessage for an update, None for anything else. quoted: replies
+    # start with the quoted names, as on the page. Without, the body is the
+    # whole message.
+    lower = message.lower()
+    if not _is_update(message, lower):
+        return None
+
+    lines = split_message(message)
+    # Lowercasing never adds or removes line breaks, so these line up
+    lower_lines = split_message(lower)
+    parsed = ParsedMessage(lines)
+
+    previous = lower_lines[-2] if len(lower_lines) > 1 else ""
+    if (len(lines) > 1 and lines[0] == lines[1]) or "reach" in previous:
+        parsed.kind = REPLY
+    else:
+        parsed.kind = MOVEMENT
+
+    start = start_line(lines) if quoted else 0
+    parsed.body = lines[start:]
+    body_lower = lower_lines[start:]
+    if body_lower:
+        # "1x 5ton mov" -> "5ton"
+        parsed.model = body_lower[0].partition("mov")[0].rpartition("x")[2].strip()
+
+    # One pass for TO/VC (anywhere) and MID/Purpose (after the body's first line)
+    to = vc = plate = purpose = None
+    for i, low in enumerate(lower_lines):
+        head = low[:2]
+        if head == "to":
+            line = lines[i]
+            to = line.partition(":")[2].strip() if ":" in line else line.strip()
+        elif head == "vc":
+            line = lines[i]
+            vc = line.partition(":")[2].strip() if ":" in line else line.strip()
+        if i <= start or ("mid" not in low and "purpose" not in low):
+            continue
+        key, value = split_field(lines[i])
+        key = key.lower()
+        if "mid" in key:
+            if plate is None:
+                plate = value.strip()
+        elif "purpose" in key:
+            if purpose is None:
+                purpose = value.strip()
+    parsed.to = to
+    parsed.vc = vc
+    parsed.plate = plate
+    parsed.purpose = purpose
+
+    joined = "".join(body_lower)
+    parsed.has_details = "to" in joined and "vc" in joined
+    parsed.rtu = "rtu" in joined
+    parsed.reached = "reach" in joined
+    if parsed.reached:
+        for keyword in RETURN_KEYWORDS:
+            i = joined.rfind(keyword)
+            if i != -1 and joined.find("reach", i + len(keyword)) != -1:
+                parsed.returned = True
+                break
+    return parsed
@@ -0,0 +1,215 @@
+# Where a poll's time goes
+#
+# Counters and latency histograms for each stage of the bot (scraping the
+# chat, reading messages, matching names, updating the state, writing to the
+# sheets, the temperature list), kept in process. They can be read off a local
+# HTTP endpoint in the Prometheus text format (/metrics, or /metrics.json),
+# and dumped to a JSON file every so often, e.g. for something else to alert
+# on when ingestion lags behind.
+#
+# Everything records to METRICS, so there is nothing to pass around:
+#
+#   with METRICS.timer("scrape"):
+#       ...
+#   METRICS.inc("messages_parsed")
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import threading
+import time
+
+PREFIX = "whatsappbot"
+# Seconds, from a dict lookup to a slow Sheets call
+LATENCY_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900,
+)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # Per bucket, not cumulative, the last one being +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # Upper bound of the bucket the q-th observation falls in
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # Time spent per stage, and anything else measured in seconds
+        self.stages = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        # Times the block under `stage`, errors included
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "time": time.time(),
+                "uptime": time.time() - self.started,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "stages": {k: h.as_dict() for k, h in self.stages.items()},
+                "histograms": {k: h.as_dict() for k, h in self.histograms.items()},
+            }
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                lines.append(f"{PREFIX}_{name}_total {value}")
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {PREFIX}_{name} gauge")
+                lines.append(f"{PREFIX}_{name} {value}")
+            if self.stages:
+                lines.append(f"# TYPE {PREFIX}_stage_seconds histogram")
+                for stage, h in sorted(self.stages.items()):
+                    lines += _render_histogram(f"{PREFIX}_stage_seconds", h, f'stage="{stage}"')
+            for name, h in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {PREFIX}_{name} histogram")
+                lines += _render_histogram(f"{PREFIX}_{name}", h)
+            lines.append(f"# TYPE {PREFIX}_uptime_seconds gauge")
+            lines.append(f"{PREFIX}_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        # as_dict() to path, replacing it in one go so a reader never sees
+        # half a file
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.as_dict(), f, indent=1)
+        os.replace(tmp, path)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.stages.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+
+def _render_histogram(name, h, labels=""):
+    sep = "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, n in zip(h.buckets, h.counts):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {h.count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {h.sum}")
+    lines.append(f"{name}_count{suffix} {h.count}")
+    return lines
+
+
+METRICS = Metrics()
+
+
+def serve(port, metrics=METRICS, host="127.0.0.1"):
+    # /metrics in the Prometheus text format, /metrics.json as JSON, served
+    # from a daemon thread. Returns the server, port 0 picks a free port.
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.render().encode()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(metrics.as_dict()).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True, name="metrics").start()
+    logging.info("Metrics on http://%s:%s/metrics", host, httpd.server_address[1])
+    return httpd
+
+
+def dump_every(path, interval, metrics=METRICS):
+    # Dumps to path every interval seconds, from a daemon thread
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                metrics.dump(path)
+            except Exception:
+                logging.warning("Could not dump metrics to %s", path, exc_info=True)
+
+    thread = threading.Thread(target=run, daemon=True, name="metrics-dump")
+    thread.start()
+    return thread
@@ -0,0 +1,366 @@
+# Every movement and RTU, kept for good
+#
+# ongoingDetails forgets a vehicle once it RTUs, and LatestUpdate only has
+# the last message per person, so "who was out between 10:00 and 12:00" or
+# "how much was each vehicle out this month" meant scrolling through the chat.
+# MovementHistory appends every movement going out and coming back to a local
+# store, and answers those from an index kept in memory.
+#
+# The store is one directory per day, each with one file per column of fixed
+# width values (the event time, what happened, the detail, and the plate,
+# model, TO, VCOM and purpose as numbers into strings.jsonl). Files are only
+# ever appended to. On start up, every day's columns are memory-mapped and the
+# index is built from them a row at a time, without copying a whole column out
+# first. The index is then kept up to date as events come in.
+#
+#   history/
+#     strings.jsonl
+#     2024-01-15/time.q  kind.b  detail.q  plate.i  model.i  to.i  vcom.i  purpose.i
+#     2024-01-16/...
+#
+# The index has a bucket per day with every detail out at some point that day,
+# so a time range query only looks at the days in the range, plus the details
+# still out. One detail left out for a week doesn't make every query look a
+# week back.
+from bisect import bisect_left, bisect_right, insort
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+from utility_functions import Detail, Vehicle
+
+# Column -> struct format, q: 8 byte int, i: 4 byte int, b: 1 byte int
+COLUMNS = {
+    "time": "q",
+    "kind": "b",
+    "detail": "q",
+    "plate": "i",
+    "model": "i",
+    "to": "i",
+    "vcom": "i",
+    "purpose": "i",
+}
+STRINGS_FILE = "strings.jsonl"
+
+# Event kinds
+OUT = 0
+RTU = 1
+DROPPED = 2  # Expired, or the plate was sent out again without an RTU
+
+NO_STRING = -1
+
+
+class MovementHistory:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = threading.Lock()
+
+        # Dictionary encoding of the string columns
+        self._strings = []
+        self._string_ids = {}
+
+        # Detail id -> Detail
+        self.details = []
+        # Plate -> id of the detail it is out on
+        self._open = {}
+        # Day (date ordinal) -> ids of the details out at some point that day.
+        # Details still out are only in the bucket of the day they started.
+        self._by_day = {}
+        # The days with a bucket, sorted
+        self._days = []
+        self._by_person = {}
+        self._by_plate = {}
+
+        self._day = None
+        self._files = None
+        self._strings_file = None
+        # Files written to since the last sync
+        self._unsynced = set()
+        self.events = 0
+        self._load()
+
+    ###########################################################################
+    # Reading the store
+    ###########################################################################
+
+    def _load(self):
+        path = os.path.join(self.directory, STRINGS_FILE)
+        if os.path.exists(path):
+            # Where the last whole string ends
+            end = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError
+                        value = json.loads(line)
+                    except ValueError:
+                        # Cut short by a crash, nothing refers to it
+                        break
+                    end += len(line)
+                    self._add_string(value)
+                size = f.seek(0, os.SEEK_END)
+            if size > end:
+                # Or the next string added would be glued onto it
+                logging.warning(
+                    "%s ends with %d bytes of a partial string, removing them",
+                    path,
+                    size - end,
+                )
+                os.truncate(path, end)
+
+        for day in sorted(os.listdir(self.directory)):
+            day_dir = os.path.join(self.directory, day)
+            if os.path.isdir(day_dir):
+                for row in self._read_day(day_dir):
+                    self._apply(*row)
+                    self.events += 1
+
+    def _read_day(self, day_dir):
+        # Rows of one day, as tuples in COLUMNS order, read from the mapped
+        # columns as they are asked for
+        paths = [(os.path.join(day_dir, f"{name}.{fmt}"), fmt) for name, fmt in COLUMNS.items()]
+        if not all(os.path.exists(path) for path, _ in paths):
+            return
+
+        # A crash half way through a row leaves some columns longer. They are
+        # cut back, so that rows appended later line up again.
+        n = min(os.path.getsize(path) // struct.calcsize(fmt) for path, fmt in paths)
+        for path, fmt in paths:
+            if os.path.getsize(path) != n * struct.calcsize(fmt):
+                with open(path, "r+b") as f:
+                    f.truncate(n * struct.calcsize(fmt))
+        if n == 0:
+            return
+
+        with ExitStack() as stack:
+            columns = []
+            for path, fmt in paths:
+                f = stack.enter_context(open(path, "rb"))
+                m = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                view = stack.enter_context(memoryview(m))
+                columns.append(stack.enter_context(view.cast(fmt)))
+            yield from zip(*columns)
+
+    def _add_string(self, value):
+        self._string_ids[value] = len(self._strings)
+        self._strings.append(value)
+
+    def _string(self, i):
+        return self._strings[i] if i != NO_STRING else None
+
+    def _apply(self, timestamp, kind, detail_id, plate, model, to, vcom, purpose):
+        when = datetime.fromtimestamp(timestamp)
+        if kind == OUT:
+            veh = Vehicle(
+                model=self._string(model),
+                plate=self._string(plate),
+                to=self._string(to),
+                purpose=self._string(purpose),
+                vcom=self._string(vcom),
+                started=when,
+            )
+            detail = Detail(veh, start_time=when, id=detail_id)
+            while len(self.details) <= detail_id:
+                self.details.append(None)
+            self.details[detail_id] = detail
+            self._open[veh.plate] = detail_id
+            self._add_to_days(detail_id, when, when)
+            for name in detail.people:
+                self._by_person.setdefault(name, []).append(detail_id)
+            self._by_plate.setdefault(veh.plate, []).append(detail_id)
+        else:
+            detail = self.details[detail_id] if detail_id < len(self.details) else None
+            if detail is None:
+                return
+            detail.end_time = when
+            detail.returned = kind == RTU
+            for plate in detail.plates:
+                if self._open.get(plate) == detail_id:
+                    del self._open[plate]
+            # Already in the bucket of the day it started
+            self._add_to_days(detail_id, detail.start_time + timedelta(days=1), when)
+
+    def _add_to_days(self, detail_id, first, last):
+        for day in range(first.toordinal(), last.toordinal() + 1):
+            if day not in self._by_day:
+                self._by_day[day] = []
+                insort(self._days, day)
+            self._by_day[day].append(detail_id)
+
+    ###########################################################################
+    # Writing
+    ###########################################################################
+
+    def _string_id(self, value):
+        # Number for a string column, adding it to strings.jsonl if new
+        if value is None:
+            return NO_STRING
+        value = str(value)
+        if value not in self._string_ids:
+            if self._strings_file is None:
+                self._strings_file = open(os.path.join(self.directory, STRINGS_FILE), "a")
+            self._strings_file.write(json.dumps(value) + "\n")
+            # Before any row refers to it
+            self._strings_file.flush()
+            self._unsynced.add(self._strings_file)
+            self._add_string(value)
+        return self._string_ids[value]
+
+    def _append(self, when, kind, detail_id, strings=(None,) * 5):
+        # Writes one row to the day of `when`, and applies it
+        row = (int(when.timestamp()), kind, detail_id) + tuple(
+            self._string_id(s) for s in strings
+        )
+        day = when.strftime("%Y-%m-%d")
+        if day != self._day:
+            self._close_files()
+            day_dir = os.path.join(self.directory, day)
+            os.makedirs(day_dir, exist_ok=True)
+            self._files = [
+                (open(os.path.join(day_dir, f"{name}.{fmt}"), "ab"), fmt)
+                for name, fmt in COLUMNS.items()
+            ]
+            self._day = day
+        for (f, fmt), value in zip(self._files, row):
+            f.write(struct.pack(fmt, value))
+            self._unsynced.add(f)
+        self._apply(*row)
+        self.events += 1
+
+    def start(self, veh, when):
+        # A vehicle going out. Returns the new Detail, or the one already
+        # recorded if this is the same movement again, e.g. a message parsed
+        # again after a crash.
+        with self._lock:
+            detail_id = self._open.get(veh.plate)
+            if detail_id is not None:
+                detail = self.details[detail_id]
+                out = detail.vehicles[0]
+                if detail.start_time == when.replace(microsecond=0) and (out.to, out.vcom) == (
+                    veh.to,
+                    veh.vcom,
+                ):
+                    return detail
+                # Sent out again without an RTU
+                self._append(when, DROPPED, detail_id)
+
+            detail_id = len(self.details)
+            self._append(
+                when,
+                OUT,
+                detail_id,
+                (veh.plate, veh.model, veh.to, veh.vcom, veh.purpose),
+            )
+            return self.details[detail_id]
+
+    def end(self, plate, when, returned=True):
+        # The vehicle back (returned), or given up on. None if it wasn't out.
+        with self._lock:
+            detail_id = self._open.get(plate)
+            if detail_id is None:
+                return None
+            self._append(when, RTU if returned else DROPPED, detail_id)
+            return self.details[detail_id]
+
+    def sync(self):
+        # Everything written so far to disk. Only the files written to since
+        # the last time, it is called every second or so.
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        for f in self._unsynced:
+            f.flush()
+            os.fsync(f.fileno())
+        self._unsynced.clear()
+
+    def _close_files(self):
+        # The day is over, so nothing else syncs them
+        self._sync()
+        for f, _ in self._files or []:
+            f.close()
+        self._files = None
+        self._day = None
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            self._close_files()
+            if self._strings_file is not None:
+                self._strings_file.close()
+                self._strings_file = None
+
+    ###########################################################################
+    # Queries. Times are datetimes, and a detail counts for a range if it was
+    # out at any point in it.
+    ###########################################################################
+
+    def between(self, start, end):
+        # Details out at some point between start and end, by start time
+        with self._lock:
+            lo = bisect_left(self._days, start.toordinal())
+            hi = bisect_right(self._days, end.toordinal())
+            ids = set(self._open.values())
+            for day in self._days[lo:hi]:
+                ids.update(self._by_day[day])
+            found = [self.details[i] for i in ids]
+        found = [d for d in found if d.overlaps(start, end)]
+        found.sort(key=lambda d: (d.start_time, d.id))
+        return found
+
+    def people_out(self, start, end):
+        # RANK/NAME of everyone out at some point between start and end
+        people = []
+        for detail in self.between(start, end):
+            for name in detail.people:
+                if name not in people:
+                    people.append(name)
+        return people
+
+    def _select(self, index, key, start, end):
+        with self._lock:
+            found = [self.details[i] for i in index.get(key, [])]
+        if start is not None or end is not None:
+            start = start or datetime.min
+            end = end or datetime.max
+            found = [d for d in found if d.overlaps(start, end)]
+        return found
+
+    def for_person(self, rank_name, start=None, end=None):
+        # Details rank_name was on as TO or VCOM
+        return self._select(self._by_person, rank_name, start, end)
+
+    def for_plate(self, plate, start=None, end=None):
+        return self._select(self._by_plate, plate, start, end)
+
+    def ongoing(self):
+        with self._lock:
+            return [self.details[i] for i in self._open.values()]
+
+    def utilization(self, start, end, now=None):
+        # {plate: time out between start and end}
+        now = now or datetime.today()
+        out = {}
+        for detail in self.between(start, end):
+            overlap = min(detail.end_time or now, end) - max(detail.start_time, start)
+            if overlap > timedelta(0):
+                for plate in detail.plates:
+                    out[plate] = out.get(plate, timedelta(0)) + overlap
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {
+                "details": len(self.details),
+                "ongoing": len(self._open),
+                "events": self.events,
+                "strings": len(self._strings),
+            }
+
@@ -0,0 +1,210 @@
+# Roster name matching
+#
+# Names in messages are often rearrangements of the roster NAME, so the old
+# matcher tried every permutation of every roster name's tokens and kept the
+# longest common substring (lcsstr) with the message name. That is n! lcsstr
+# calls per row, per lookup. The matcher below is built once per roster load
+# and gives the same answer without enumerating permutations:
+#  - rows are bucketed by RANK, since the rank _must_ match,
+#  - a character bigram index picks out the only rows that can score > 3,
+#  - the scorer walks token chains instead of permutations.
+# On top of that, resolved names are kept in a small LRU cache, since the same
+# few dozen TO/VC names and senders repeat all day.
+from collections import OrderedDict, defaultdict
+import logging
+
+# Only scores above this are considered a match
+MIN_SCORE = 3
+
+# Cached outcomes that are not a S/N
+AMBIGUOUS = "ambiguous"
+NO_MATCH = "no match"
+
+
+def _split_name(name):
+    # Returns (RANK, lowercase joined name) for a name as written in a message
+    tokens = name.split()
+    return tokens[0].upper(), "".join([x.lower() for x in tokens[1:]])
+
+
+def _bigrams(s):
+    return {s[i : i + 2] for i in range(len(s) - 1)}
+
+
+def _common_prefix(s, start, token):
+    n = 0
+    for a, b in zip(s[start:], token):
+        if a != b:
+            break
+        n += 1
+    return n
+
+
+def token_chain_score(name, tokens):
+    # Length of the longest common substring between `name` and any
+    # concatenation of any permutation of `tokens`.
+    #
+    # A common substring either lies inside one token, or it is a suffix of
+    # some token, followed by zero or more whole tokens, followed by a prefix
+    # of another token. Each token is used at most once, which is tracked
+    # with a bitmask, so the search is over token chains and not over n!
+    # orderings.
+    positions = defaultdict(list)
+    for i, c in enumerate(name):
+        positions[c].append(i)
+
+    memo = {}
+
+    def extend(pos, used):
+        # Longest run of unused tokens that can be read off name[pos:]
+        key = (pos, used)
+        if key in memo:
+            return memo[key]
+        longest = 0
+        for k, t in enumerate(tokens):
+            if used & (1 << k):
+                continue
+            if name.startswith(t, pos):
+                longest = max(longest, len(t) + extend(pos + len(t), used | (1 << k)))
+            else:
+                longest = max(longest, _common_prefix(name, pos, t))
+        memo[key] = longest
+        return longest
+
+    best = 0
+    for k, t in enumerate(tokens):
+        for j, c in enumerate(t):
+            for i in positions.get(c, ()):
+                run = _common_prefix(name, i, t[j:])
+                if j + run == len(t):
+                    # Ran off the end of this token, try to chain on
+                    run += extend(i + run, 1 << k)
+                if run > best:
+                    best = run
+    return best
+
+
+class ResolutionCache:
+    # Bounded LRU of normalized name -> S/N, AMBIGUOUS or NO_MATCH
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+class RosterMatcher:
+    def __init__(self, roster, cache_size=256):
+        # roster: iterable of (S/N, RANK, NAME)
+        # The cache belongs to this roster, so reloading the roster (which
+        # builds a new matcher) drops it as well.
+        self.cache = ResolutionCache(cache_size)
+        self._entries = []
+        self._by_rank = defaultdict(list)
+        self._bigram_index = defaultdict(lambda: defaultdict(set))
+        # Rows with single-letter tokens can chain into a match without
+        # sharing a bigram with the query, so they are always scored.
+        self._short_token_rows = defaultdict(set)
+
+        for sn, rank, name in roster:
+            tokens = [x.lower() for x in str(name).split()]
+            rank = str(rank)
+            pos = len(self._entries)
+            self._entries.append((sn, tokens))
+            self._by_rank[rank].append(pos)
+            for t in tokens:
+                for bg in _bigrams(t):
+                    self._bigram_index[rank][bg].add(pos)
+                if len(t) == 1:
+                    self._short_token_rows[rank].add(pos)
+
+    @classmethod
+    def from_df(cls, df, cache_size=256):
+        return cls(zip(df.index, df.RANK, df.NAME), cache_size=cache_size)
+
+    @classmethod
+    def from_store(cls, roster, cache_size=256):
+        return cls(((p.sn, p.rank, p.name) for p in roster), cache_size=cache_size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def candidates(self, rank, name):
+        # Any common substring longer than MIN_SCORE either has a piece of
+        # at least two characters inside one token, or passes through a
+        # whole single-letter token. Everything else cannot score high enough.
+        if rank not in self._by_rank:
+            return []
+        index = self._bigram_index[rank]
+        found = set(self._short_token_rows[rank])
+        for bg in _bigrams(name):
+            found |= index.get(bg, set())
+        return sorted(found)
+
+    def scores(self, rank, name):
+        # [(S/N, score)] for every candidate row with a matching rank
+        return [
+            (self._entries[pos][0], token_chain_score(name, self._entries[pos][1]))
+            for pos in self.candidates(rank, name)
+        ]
+
+    def resolve(self, name):
+        # Returns the S/N of the best matching row, AMBIGUOUS if more than one
+        # row ties for the best score, or NO_MATCH
+        rank, name = _split_name(name)
+        key = f"{rank} {name}"
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        scored = self.scores(rank, name)
+        max_score = max([score for _, score in scored], default=0)
+        if max_score <= MIN_SCORE:
+            result = NO_MATCH
+        else:
+            matched = [sn for sn, score in scored if score == max_score]
+            if len(matched) > 1:
+                logging.info("%s: Multiple Names Matched!", name)
+                result = AMBIGUOUS
+            else:
+                result = matched[0]
+
+        self.cache.put(key, result)
+        return result
+
+    def match(self, name):
+        # Returns the S/N of the matching row, or None
+        result = self.resolve(name)
+        if result in (AMBIGUOUS, NO_MATCH):
+            return None
+        return result
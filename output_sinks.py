@@ -0,0 +1,332 @@
+# Where the state is written out to
+#
+# Writing to the sheets used to happen in the same call stack as parsing, so
+# a slow or failing Sheets API held up the next messages, and there was no
+# way to send the state anywhere else. ParadeState now publishes an Output
+# (the parade state, the ongoing details or the temperature list) to a
+# SinkFanout, which hands it to every sink without waiting.
+#
+# Each OutputSink has its own bounded queue and worker thread. The worker
+# takes what was published, waits up to `linger` seconds for more, and writes
+# it in one go (or `write_batch` at a time), at most once every
+# `min_interval` seconds. Only the latest Output of each kind is kept (unless
+# coalesce is False), as each one has the whole of it. A write that fails is
+# retried with backoff, merged with whatever came in meanwhile, and never
+# affects the other sinks. When the
+# queue is full, the oldest Output in it is dropped.
+#
+# Sinks: SheetsSink (the bot's usual sheets), JsonFileSink (a local JSON
+# snapshot) and WebhookSink (POSTs a text summary, e.g. to Telegram's
+# sendMessage).
+from datetime import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+import urllib.request
+
+from metrics import METRICS
+
+# Published by ParadeState
+PS = "PS"
+ONGOING_DETAILS = "ongoingDetails"
+TEMPERATURE_LIST = "temperature_list"
+
+_STOP = object()
+
+
+class Output:
+    __slots__ = ("kind", "data", "time")
+
+    def __init__(self, kind, data, time=None):
+        # data: plain lists and dicts, so that sinks on other threads never
+        # see it change
+        self.kind = kind
+        self.data = data
+        self.time = time or datetime.today()
+
+    def as_dict(self):
+        return {"kind": self.kind, "time": self.time.isoformat(), "data": self.data}
+
+    def __repr__(self):
+        return f"Output({self.kind!r}, {self.time})"
+
+
+class OutputSink:
+    # Subclasses implement write(outputs)
+    name = "sink"
+    # Most Outputs given to one write, None for everything pending. A write
+    # that fails is retried as a whole, so a sink that can't undo the part
+    # that went through (e.g. messages sent) writes one at a time.
+    write_batch = None
+
+    def __init__(
+        self,
+        kinds=None,
+        maxsize=100,
+        max_batch=50,
+        linger=0.5,
+        min_interval=0,
+        retry_delay=1.0,
+        max_retry_delay=60,
+        coalesce=True,
+    ):
+        # kinds: the kinds of Output wanted, None for all of them
+        self.kinds = kinds
+        self.max_batch = max_batch
+        self.linger = linger
+        self.min_interval = min_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.coalesce = coalesce
+        self.queue = queue.Queue(maxsize)
+        self._offer_lock = threading.Lock()
+        self._thread = None
+        self._last_write = 0.0
+        self._added = 0
+
+        self.published = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.written = 0
+        self.failures = 0
+
+    def write(self, outputs):
+        raise NotImplementedError
+
+    def accepts(self, output):
+        return self.kinds is None or output.kind in self.kinds
+
+    def offer(self, output):
+        # Never blocks. With the queue full, the oldest Output makes room.
+        self.published += 1
+        self._put(output)
+
+    def _put(self, item):
+        with self._offer_lock:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                        METRICS.inc(f"sink_{self.name}_dropped")
+                    except queue.Empty:
+                        pass
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name=f"sink-{self.name}", daemon=True
+            )
+            self._thread.start()
+
+    def close(self, timeout=10):
+        # Writes what is left, giving up after timeout seconds
+        if self._thread is None:
+            return
+        self._put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning("Output sink %s did not finish writing in %ss", self.name, timeout)
+        self._thread = None
+
+    def _add(self, pending, output):
+        if self.coalesce:
+            if output.kind in pending:
+                self.coalesced += 1
+            pending[output.kind] = output
+        else:
+            pending[self._added, output.kind] = output
+        self._added += 1
+
+    def _collect(self, pending, until=None):
+        # Adds what is published to pending. Without `until`, waits for the
+        # first one and then up to linger seconds for more, with it, takes in
+        # everything up to then. False once asked to stop.
+        while True:
+            if len(pending) >= self.max_batch:
+                if until is not None:
+                    time.sleep(max(0, until - time.monotonic()))
+                return True
+            timeout = None if until is None else until - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                return True
+            try:
+                output = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                return True
+            if output is _STOP:
+                return False
+            self._add(pending, output)
+            if until is None:
+                until = time.monotonic() + self.linger
+
+    def _run(self):
+        pending = {}
+        delay = self.retry_delay
+        retry_at = 0.0
+        running = True
+        while running or pending:
+            if running and not pending:
+                running = self._collect(pending)
+            # Waits out min_interval, or the backoff after a failure, taking
+            # in what is published meanwhile
+            ready = max(retry_at, self._last_write + self.min_interval)
+            if running and time.monotonic() < ready:
+                running = self._collect(pending, ready)
+            if not pending:
+                continue
+
+            keys = list(pending)[: self.write_batch]
+            batch = [pending[key] for key in keys]
+            try:
+                with METRICS.timer(f"sink_{self.name}"):
+                    self.write(batch)
+            except Exception:
+                self.failures += 1
+                METRICS.inc(f"sink_{self.name}_failures")
+                logging.error("Output sink %s failed, retrying in %.0fs", self.name, delay)
+                logging.error(traceback.format_exc())
+                if not running:
+                    # Shutting down, no point waiting
+                    logging.warning(
+                        "Output sink %s gave up on %s", self.name, list(pending.values())
+                    )
+                    return
+                retry_at = time.monotonic() + delay
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            self._last_write = time.monotonic()
+            self.batches += 1
+            self.written += len(batch)
+            delay = self.retry_delay
+            retry_at = 0.0
+            for key in keys:
+                del pending[key]
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "published": self.published,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "written": self.written,
+            "failures": self.failures,
+        }
+
+
+class SinkFanout:
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+
+    def publish(self, output):
+        for sink in self.sinks:
+            if sink.accepts(output):
+                sink.offer(output)
+
+    def close(self, timeout=10):
+        for sink in self.sinks:
+            sink.close(timeout)
+
+    def stats(self):
+        return {sink.name: sink.stats() for sink in self.sinks}
+
+
+class SheetsSink(OutputSink):
+    # The parade state, ongoing details and temperature list to their blocks
+    # of the bot's worksheets, all in one batched call
+    name = "sheets"
+
+    def __init__(self, state, **kwargs):
+        super().__init__(**kwargs)
+        self.state = state
+
+    def write(self, outputs):
+        try:
+            with self.state.sheets_batch():
+                for output in outputs:
+                    self.state.write_output(output)
+        except Exception:
+            # None of the batch made it, so the shadows are wrong
+            self.state.GENshadow.invalidate()
+            self.state.DRshadow.invalidate()
+            raise
+
+
+class JsonFileSink(OutputSink):
+    # The latest of every kind in one JSON file, replaced as a whole so that
+    # readers never see half of it
+    name = "json"
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.latest = {}
+
+    def write(self, outputs):
+        for output in outputs:
+            self.latest[output.kind] = output.as_dict()
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.latest, f)
+        os.replace(tmp, self.path)
+
+
+class WebhookSink(OutputSink):
+    # POSTs {"text": ...} (plus "chat_id" if given, as Telegram's
+    # sendMessage wants) for each Output, rendered by summary(). One per
+    # write, so a failed POST doesn't send the ones before it again.
+    name = "webhook"
+    write_batch = 1
+
+    def __init__(self, url, chat_id=None, timeout=10, **kwargs):
+        kwargs.setdefault("kinds", (ONGOING_DETAILS, TEMPERATURE_LIST))
+        # Telegram allows about one message a second to a chat
+        kwargs.setdefault("min_interval", 1.0)
+        super().__init__(**kwargs)
+        self.url = url
+        self.chat_id = chat_id
+        self.timeout = timeout
+
+    def write(self, outputs):
+        for output in outputs:
+            body = {"text": summary(output)}
+            if self.chat_id is not None:
+                body["chat_id"] = self.chat_id
+            request = urllib.request.Request(
+                self.url,
+                data=json.dumps(body).encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            # Raises on anything but a 2xx
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+
+
+def summary(output):
+    # Short text for an Output, for chats and the like
+    if output.kind == TEMPERATURE_LIST:
+        return output.data["text"]
+    if output.kind == ONGOING_DETAILS:
+        cells = output.data["cells"]
+        lines = [f"{len(cells)} details out at {output.time.strftime('%H:%M')}"]
+        lines += [", ".join(cell.splitlines()) for cell in cells]
+        return "\n".join(lines)
+    if output.kind == PS:
+        counts = output.data["status_counts"]
+        lines = [f"Parade state at {output.time.strftime('%H:%M')}"]
+        lines += [f"{status}: {n}" for status, n in sorted(counts.items())]
+        return "\n".join(lines)
+    return json.dumps(output.data)
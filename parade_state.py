@@ -0,0 +1,634 @@
+# Parade state tracking
+#
+# Everything the bot knows (the roster, ongoing details) and does with a
+# message, without any of the WhatsApp or Google start up. The heavy packages
+# are only imported where they are needed, so importing this is cheap, and a
+# ParadeState can be driven by anything with the three worksheets, e.g. the
+# benchmarks' in-memory stand-ins. The roster is a RosterStore, pandas is only
+# needed for the temperature list.
+#
+# Given a StateJournal, every change is also journalled, so that the state can
+# be restored after a restart, see state_journal.py.
+#
+# Outputs are written to the sheets from flush(), or, once use_sinks() is
+# called, published to output sinks that write them from their own threads,
+# see output_sinks.py.
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from functools import partial
+import logging
+import threading
+import traceback
+
+from message_parser import REPLY, sender_name
+from metrics import METRICS
+from name_matching import RosterMatcher
+from output_sinks import ONGOING_DETAILS, PS, TEMPERATURE_LIST, Output, SinkFanout
+from roster_store import RosterStore
+from structured_logging import event, events_enabled
+from sheet_output import ShadowSheet, WriteBehind, grid_to_cells
+from utility_functions import Vehicle
+from vehicle_registry import VehicleRegistry
+from whatsapp_scraper import SeenMessages
+
+SPREADSHEET_KEY = "1qxDItGZJWAXTyvR6HK8p2g4gF49rrtwQ6sTfZe7z9I4"
+PS_WORKSHEET = "MHN Parade State"  # Parade State
+GEN_WORKSHEET = "Auto_Generated"  # Machine Generated Sheet
+DR_WORKSHEET = "Daily Reporting"  # Daily reporting sheet
+
+
+class ParadeState:
+    def __init__(
+        self,
+        PSsheet,
+        GENsheet,
+        DRsheet,
+        write_debounce=0,
+        journal=None,
+        remarks_max_age=timedelta(hours=8),
+        sheets_batch=None,
+        detail_max_age=timedelta(hours=24),
+        history=None,
+        verify_interval=timedelta(minutes=15),
+    ):
+        self.PSsheet = PSsheet
+        self.GENsheet = GENsheet
+        self.DRsheet = DRsheet
+
+        self.roster = None
+        # When the roster was last read from the sheet, kept across restarts
+        self.roster_loaded_at = None
+        # REMARKS are only read again for the temperature list once older than this
+        self.remarks_loaded_at = None
+        self.remarks_max_age = remarks_max_age
+        self.roster_matcher = None
+        self.ongoingDetails = VehicleRegistry()
+        # Details nobody sent an RTU for are dropped on refresh once older than this
+        self.detail_max_age = detail_max_age
+        # Messages that were parsed, so a restart knows where to carry on
+        self.applied_messages = SeenMessages()
+        self.last_message_time = None
+        self.journal = journal
+        # MovementHistory, every movement and RTU kept for querying later
+        self.history = history
+        # Held while the state is changed or read for output, for runtimes
+        # that parse and write from different threads
+        self.lock = threading.RLock()
+
+        # What was last written to the generated blocks, so only changes are sent
+        self.GENshadow = ShadowSheet(GENsheet, (1, 1, 100, 8))  # A1:H100
+        self.DRshadow = ShadowSheet(DRsheet, (2, 2, 100, 2))  # B2:B100
+        # They are read back to look for edits made by hand this often
+        self.verify_interval = verify_interval
+        self.verified_at = datetime.today()
+
+        # Parsing only marks outputs as dirty, they are written once per poll
+        self.outputs = WriteBehind(debounce=write_debounce)
+        self.outputs.register("PS", self.update_PS)
+        self.outputs.register("ongoingDetails", self.update_ongoingDetails)
+        # Sends every write of a flush together, see SheetsClient.batch
+        self.sheets_batch = sheets_batch or nullcontext
+        # SinkFanout, see use_sinks()
+        self.sinks = None
+
+    @classmethod
+    def from_spreadsheet(cls, sh, **kwargs):
+        # sh: gspread Spreadsheet, or a SheetsClient in front of one
+        kwargs.setdefault("sheets_batch", getattr(sh, "batch", None))
+        return cls(
+            sh.worksheet(PS_WORKSHEET),
+            sh.worksheet(GEN_WORKSHEET),
+            sh.worksheet(DR_WORKSHEET),
+            **kwargs,
+        )
+
+    def use_sinks(self, sinks):
+        # From now on, outputs are published to the sinks instead of being
+        # written in flush(). Include a SheetsSink for the sheets to still be
+        # written. Returns the started SinkFanout, to close() on exit.
+        self.sinks = SinkFanout(sinks)
+        for kind in [PS, ONGOING_DETAILS]:
+            self.outputs.register(kind, partial(self.publish, kind))
+        self.sinks.start()
+        return self.sinks
+
+    def output(self, kind):
+        # Output of the state as it is now, see output_sinks.py
+        with self.lock:
+            if kind == PS:
+                data = {
+                    "columns": ["S/N"] + self.roster.columns,
+                    "rows": self.roster.rows(),
+                    "status_counts": self.roster.status_counts(),
+                }
+            elif kind == ONGOING_DETAILS:
+                data = {
+                    "details": [veh.as_dict() for veh in self.ongoingDetails],
+                    "cells": list(self.ongoingDetails.cells()),
+                }
+            else:
+                raise ValueError(f"No such output: {kind}")
+        return Output(kind, data)
+
+    def publish(self, kind):
+        self.sinks.publish(self.output(kind))
+
+    def write_output(self, output):
+        # An Output to its block of the sheets
+        if output.kind == PS:
+            cells = {(2, 9): str(output.time)}  # I2
+            cells.update(grid_to_cells([output.data["columns"]] + output.data["rows"]))
+            n = self.GENshadow.write(cells)
+            logging.info("Parade State updated at: %s (%d cells)", output.time, n)
+        elif output.kind == ONGOING_DETAILS:
+            cells = {(2, 2): str(output.time)}  # B2
+            cells.update(
+                grid_to_cells(
+                    [[cell] for cell in output.data["cells"]], first_row=5, first_col=2
+                )
+            )
+            self.DRshadow.write(cells)
+        elif output.kind == TEMPERATURE_LIST:
+            self.DRsheet.batch_update(
+                [
+                    {"range": "A2", "values": [[str(output.time)]]},
+                    {"range": "A5", "values": [[output.data["text"]]]},
+                ]
+            )
+
+    def flush(self, force=False):
+        # Write out everything that changed
+        try:
+            # With batching, this is where the writes actually go out
+            with METRICS.timer("sheet_flush"), self.sheets_batch():
+                self.outputs.flush(force=force)
+        except Exception:
+            METRICS.inc("sheet_write_errors")
+            # None of the batched writes made it, so the shadows are wrong
+            logging.error("Sending the batched writes failed\n%s", traceback.format_exc())
+            self.GENshadow.invalidate()
+            self.DRshadow.invalidate()
+            self.outputs.mark_dirty("PS")
+            self.outputs.mark_dirty("ongoingDetails")
+        if self.history is not None:
+            self.history.sync()
+        if self.journal is not None:
+            self.journal.sync()
+            if force or self.journal.needs_snapshot():
+                self.snapshot()
+
+    ###########################################################################
+    # Journalled changes. Everything that changes the state goes through
+    # these, so that replaying the journal gives the same state back.
+    ###########################################################################
+
+    def _journal(self, op, **fields):
+        if self.journal is not None:
+            self.journal.append(op, **fields)
+        # The same changes as events. Not the roster, which is the whole
+        # table, nor messages, which have their own.
+        if op not in ("roster", "message") and events_enabled():
+            event("state_delta", op=op, **fields)
+
+    def _set_rows(self, rows, column, value):
+        rows = list(rows)
+        if not rows:
+            # e.g. nobody on the message matched, nothing to journal
+            return
+        self.roster.set(rows, column, value)
+        self._journal("set", rows=rows, column=column, value=value)
+
+    def _add_detail(self, veh):
+        self.ongoingDetails.add(veh)
+        self._journal("detail", vehicle=veh.as_dict())
+        if self.history is not None:
+            self.history.start(veh, veh.started or datetime.today())
+
+    def _pop_detail(self, plate, when=None, returned=True):
+        # returned: False when the detail is given up on rather than RTU'd
+        veh = self.ongoingDetails.pop(plate)
+        self._journal("rtu", plate=plate)
+        if self.history is not None:
+            self.history.end(plate, when or datetime.today(), returned=returned)
+        return veh
+
+    def expire_details(self, now=None):
+        # Drops details older than detail_max_age, e.g. when the RTU was missed
+        now = now or datetime.today()
+        with self.lock:
+            expired = self.ongoingDetails.stale(now - self.detail_max_age)
+            for veh in expired:
+                self._pop_detail(veh.plate, now, returned=False)
+                logging.info("Detail expired: %r", veh)
+            if expired:
+                self.outputs.mark_dirty("ongoingDetails")
+        return expired
+
+    def record_message(self, key, message_time):
+        # Called once a message has been parsed
+        self.applied_messages.add(key)
+        if self.last_message_time is None or message_time > self.last_message_time:
+            self.last_message_time = message_time
+        self._journal("message", key=key, time=message_time.isoformat())
+
+    def _apply(self, record):
+        op = record["op"]
+        if op == "roster":
+            self.roster = roster_from_json(record["roster"])
+            self.roster_loaded_at = _from_iso(record.get("loaded_at"))
+        elif op == "set":
+            self.roster.set(record["rows"], record["column"], record["value"])
+        elif op == "detail":
+            self.ongoingDetails.add(Vehicle.from_dict(record["vehicle"]))
+        elif op == "rtu":
+            self.ongoingDetails.pop(record["plate"], None)
+        elif op == "message":
+            message_time = datetime.fromisoformat(record["time"])
+            self.applied_messages.add(record["key"])
+            if self.last_message_time is None or message_time > self.last_message_time:
+                self.last_message_time = message_time
+        else:
+            logging.warning("Unknown journal record: %s", record)
+
+    def snapshot(self):
+        # Whole state to the journal's snapshot, which also empties the journal
+        with self.lock:
+            if self.roster is None:
+                return
+            self.journal.write_snapshot(
+                {
+                    "roster": roster_to_json(self.roster),
+                    "ongoingDetails": [v.as_dict() for v in self.ongoingDetails],
+                    "applied_messages": list(self.applied_messages),
+                    "last_message_time": self.last_message_time.isoformat()
+                    if self.last_message_time
+                    else None,
+                    "roster_loaded_at": self.roster_loaded_at.isoformat()
+                    if self.roster_loaded_at
+                    else None,
+                }
+            )
+        logging.info("State snapshot written: %s", self.journal.stats())
+
+    def restore(self):
+        # Latest snapshot plus the journal after it. False if there was
+        # nothing to restore, in which case load_roster() is needed.
+        start = datetime.now()
+        snapshot, records = self.journal.load()
+        if snapshot is None and not records:
+            return False
+
+        with self.lock:
+            if snapshot is not None:
+                self.roster = roster_from_json(snapshot["roster"])
+                self.ongoingDetails = VehicleRegistry(
+                    Vehicle.from_dict(v) for v in snapshot["ongoingDetails"]
+                )
+                for key in snapshot["applied_messages"]:
+                    self.applied_messages.add(key)
+                if snapshot["last_message_time"]:
+                    self.last_message_time = datetime.fromisoformat(
+                        snapshot["last_message_time"]
+                    )
+                # None for snapshots from before it was kept
+                self.roster_loaded_at = _from_iso(snapshot.get("roster_loaded_at"))
+            for record in records:
+                self._apply(record)
+            if self.roster is None:
+                # Journal without a roster in it, nothing usable
+                return False
+
+            self.roster_matcher = RosterMatcher.from_store(self.roster)
+            self.GENshadow.invalidate()
+            self.DRshadow.invalidate()
+            self.outputs.mark_dirty("PS")
+            self.outputs.mark_dirty("ongoingDetails")
+
+        logging.info(
+            "Restored %d people, %d details and %d journal records in %s",
+            len(self.roster),
+            len(self.ongoingDetails),
+            len(records),
+            datetime.now() - start,
+        )
+        return True
+
+    def refresh(self, is_morning=None):
+        # Reloads the roster and regenerates the temperature list, as done
+        # every weekday morning or when asked to through the A4 flag
+        if is_morning is None:
+            is_morning = datetime.today().hour < 12
+        self.load_roster()
+        self.expire_details()
+        self.outputs.mark_dirty("PS")
+        self.generate_temperature_list(is_morning=is_morning)
+
+    def check_refresh_flag(self):
+        # 'Daily Reporting'!A4 is ticked to ask for a refresh
+        if self.DRsheet.get("A4") == [["TRUE"]]:
+            self.refresh()
+            self.DRsheet.update_cell(4, 1, "FALSE")
+            return True
+        return False
+
+    def verify_outputs(self, force=False):
+        # Every verify_interval, reads back the generated blocks, and marks
+        # any that were edited by hand to be written again in full. True if
+        # anything needs writing.
+        now = datetime.today()
+        if not force and now - self.verified_at < self.verify_interval:
+            return False
+        self.verified_at = now
+        drifted = False
+        for name, shadow in [("PS", self.GENshadow), ("ongoingDetails", self.DRshadow)]:
+            if shadow.verify():
+                logging.warning("%s was changed on the sheet, rewriting it", name)
+                self.outputs.mark_dirty(name)
+                drifted = True
+        return drifted
+
+    def match_name(self, name):
+        # Using longest common substring similarity (lcsstr).
+        # This is due to name variations being often rearrangements of each other.
+        # The matching occurs in two steps.
+        # First, the rank _must_ match.
+        # Second, from those with matching ranks, match len(lcsstr) > 3
+        # The heavy lifting is done by roster_matcher, built in load_roster(),
+        # which also caches the result for repeat names.
+        # Returns the S/N of the matched row, or None
+        with METRICS.timer("match_name"):
+            sn = self.roster_matcher.match(name)
+        if sn is None:
+            METRICS.inc("match_failures")
+        event("name_matched", name=name, sn=sn)
+        return sn
+
+    def match_rows(self, *names):
+        # S/N of every row matched by any of the names, without duplicates
+        rows = []
+        for name in names:
+            if name:
+                sn = self.match_name(name)
+                if sn is not None and sn not in rows:
+                    rows.append(sn)
+        return rows
+
+    def parse_reply(self, parsed, name, vcom_name):
+        # This is a reply to a message.
+        # This is quite annoying as nsometimes we get replies to replies.
+        # That we mean that we see only the sender, and not the full details.
+        logging.info("Parsing Reply: %s commanded by %s", name, vcom_name)
+
+        # Selecting the person who indicated an update
+        row = self.match_rows(name, vcom_name)
+        veh = None
+
+        # This is a good reply, praise the lord
+        # In addition, name and vcom_name should both be populated
+        # Unless one of them isn't our people, but then I don't
+        # care about it anyway.
+        if parsed.has_details:
+            # Normally the case, unless detail left before bot started
+            veh = self.ongoingDetails.get(parsed.plate)
+
+        # This is a shitty reply :<
+        # Name and only name is always populated for shitty replies
+        elif len(self.ongoingDetails) > 0 and row:
+            formal_name = self.roster.get(row[0]).rank_name
+            veh = self.ongoingDetails.for_person(formal_name)
+            # Found the detail
+            if veh:
+                row = self.roster.with_rank_name(veh.to, veh.vcom)
+        else:
+            # I don't understand how ongoingDetails can be empty and still parsing a reply
+            pass
+
+        # Updating latest message
+        # The time it was sent, which is also right for messages parsed late
+        self._set_rows(
+            row,
+            "LatestUpdate",
+            f"{parsed.time or datetime.today()}\n" + "\n".join(parsed.body),
+        )
+
+        # All 'RTU' then 'reach' messages are found, regardless of destination
+        if parsed.returned:
+            self._set_rows(row, "STATUS", "PRESENT")
+            if veh:
+                self._pop_detail(veh.plate, parsed.time)
+                logging.info("RTU: %r", veh)
+                self.outputs.mark_dirty("ongoingDetails")
+
+        self.outputs.mark_dirty("PS")
+
+    def parse_movement(self, parsed, name, vcom_name):
+        # We are sure that this is a movement from point A to B
+        # This would normally necessitate the creation of a new Vehicle class.
+        logging.info("Parsing Movement: %s commanded by %s", name, vcom_name)
+
+        # Selecting the person who indicated an update, each name matched once
+        name_row = self.match_name(name) if name else None
+        vcom_row = self.match_name(vcom_name) if vcom_name else None
+        row = []
+        for sn in (name_row, vcom_row):
+            if sn is not None and sn not in row:
+                row.append(sn)
+
+        if name_row is not None:
+            name = self.roster.get(name_row).rank_name
+        if vcom_row is not None:
+            vcom_name = self.roster.get(vcom_row).rank_name
+
+        # Updating Parade State
+        # The time it was sent, which is also right for messages parsed late
+        self._set_rows(
+            row,
+            "LatestUpdate",
+            f"{parsed.time or datetime.today()}\n" + "\n".join(parsed.body),
+        )
+        self._set_rows(row, "STATUS", "DETAIL")
+
+        # There is no need to check for existing detail because it is a new movement anyway
+        if parsed.plate:
+            veh = Vehicle(
+                model=parsed.model,
+                plate=parsed.plate,
+                to=name,
+                purpose=parsed.purpose,
+                vcom=vcom_name,
+                started=parsed.time or datetime.today(),
+            )
+            self._add_detail(veh)
+            logging.info("New movement logged: %r", veh)
+            self.outputs.mark_dirty("ongoingDetails")
+
+        self.outputs.mark_dirty("PS")
+
+    def parse_message(self, parsed):
+        # parsed: ParsedMessage, see message_parser.tokenize
+        # Suppose this is a reply to a reply, so no 'TO:'
+        # This is assuming I saved their contacts
+        # e.g. ['NAME', 'NAME', 'RTU', 'Reached', TIMESTAMP]
+        # Unexpected behaviour if we are assessing fam for external people
+        # in which case vcom and to is the same person.
+        name = parsed.to or sender_name(parsed.sender)
+        if parsed.kind == REPLY:
+            self.parse_reply(parsed, name, parsed.vc)
+        else:
+            self.parse_movement(parsed, name, parsed.vc)
+
+    def initialize_PS(self, keep_remarks=False):
+        # The parade state as the sheet has it, without the title row
+        roster = RosterStore.from_values(
+            self.PSsheet.get_all_values()[1:], keep_remarks=keep_remarks
+        )
+        logging.debug("INITIALIZATION: %d people, %s", len(roster), roster.columns)
+        return roster
+
+    def load_roster(self):
+        # (Re)loads the parade state, and rebuilds the name matcher against it.
+        # The new matcher starts with an empty name cache.
+        roster = self.initialize_PS()
+        roster_matcher = RosterMatcher.from_store(roster)
+        with self.lock:
+            if self.roster_matcher is not None:
+                logging.info("Dropping name cache: %s", self.roster_matcher.cache.info())
+            self.roster = roster
+            self.roster_matcher = roster_matcher
+            self.roster_loaded_at = self.remarks_loaded_at = datetime.today()
+            self._journal(
+                "roster",
+                roster=roster_to_json(roster),
+                loaded_at=self.roster_loaded_at.isoformat(),
+            )
+            # The roster may have changed shape, so rewrite it in full next time
+            self.GENshadow.invalidate()
+
+    def update_PS(self):
+        # Only the cells that changed since the last write are sent
+        with METRICS.timer("update_PS"):
+            self.write_output(self.output(PS))
+
+    def update_ongoingDetails(self):
+        with METRICS.timer("update_ongoingDetails"):
+            self.write_output(self.output(ONGOING_DETAILS))
+
+    def refresh_remarks(self):
+        # REMARKS as the sheet has them now, without touching anything else
+        fresh = RosterStore.from_values(
+            self.PSsheet.get_all_values()[1:], keep_remarks=True
+        )
+        with self.lock:
+            for person in fresh:
+                if person.sn in self.roster:
+                    if self.roster.get(person.sn).remarks != person.remarks:
+                        self._set_rows([person.sn], "REMARKS", person.remarks)
+            self.remarks_loaded_at = datetime.today()
+
+    def temperature_report(self, is_morning=True):
+        # From the live roster, using the per STATUS and PLATOON counts kept by
+        # the roster, and one pass over it for who to list
+        today = datetime.today()
+        if is_morning:
+            time_str = "0800hrs"
+        else:
+            time_str = "1500hrs"
+
+        with self.lock:
+            counts = self.roster.status_counts()
+            present_by_platoon = Counter()
+            for (platoon, status), n in self.roster.platoon_status_counts().items():
+                if "PRESENT" in status:
+                    present_by_platoon[platoon] += n
+            present = sum(n for status, n in counts.items() if "PRESENT" in status)
+            present_or_rest = sum(
+                n for status, n in counts.items() if "PRESENT" in status or "REST" in status
+            )
+
+            parts = [
+                "*Temperature Monitoring*\n\n",
+                "Grouping : CMTL (Mandai Hill Node)\n",
+                f"Date: {today.strftime('%d%m%y')}\n",
+                f"Time: {time_str}\n\n",
+                f"{'='*22}\n\n",
+                f"Total Strength: {len(self.roster)}\n",
+                f"Present Strength: {present_or_rest + 1}\n",
+                "({0[HQ PLATOON]} from HQ, {0[PLATOON 1]} from PLT 1, {0[PLATOON 2]} from PLT 2, 1 AMB TO)\n".format(
+                    present_by_platoon
+                ),
+                f"Temperature Taking Strength: {present}\n",
+                "({0[HQ PLATOON]} from HQ, {0[PLATOON 1]} from PLT 1, {0[PLATOON 2]} from PLT 2)\n\n\n".format(
+                    present_by_platoon
+                ),
+                "Reason for not taking (Rank/Name & Reason):",
+            ]
+
+            # Who to list, by STATUS, and everyone reporting sick together
+            group_of = {}
+            for label in counts:
+                if "RS" in label:
+                    group_of[label] = "RS"
+                elif "PRESENT" not in label:
+                    group_of[label] = label
+            groups = self.roster.grouped(group_of)
+
+            for label in sorted(counts):
+                if any([x in label for x in ["PRESENT", "RS"]]):
+                    continue
+                gp = groups[label]
+                if "AO" in label:
+                    amb_gp = [p for p in gp if "AMB DUTY" in p.remarks]
+                    parts.append("\n\nAMBULANCE DUTY (1 pax)\n" + numbered(amb_gp))
+                    ao_gp = [p for p in gp if "AMB DUTY" not in p.remarks]
+                    if len(ao_gp) > 0:
+                        parts.append(f"\n\nAO ({len(ao_gp)} pax)\n" + numbered(ao_gp))
+                else:
+                    parts.append(f"\n\n{label} ({len(gp)} pax)\n" + numbered(gp))
+
+            rs_gp = groups.get("RS", [])
+            parts.append(
+                f"\n\n{'='*22}\n\n"
+                + f"Any report sick ({len(rs_gp)} pax): (Rank/Name & Reason)\n"
+                + numbered(rs_gp)
+            )
+        return "".join(parts)
+
+    def generate_temperature_list(self, is_morning=True):
+        with METRICS.timer("temperature_list"):
+            if (
+                self.remarks_loaded_at is None
+                or datetime.today() - self.remarks_loaded_at > self.remarks_max_age
+            ):
+                self.refresh_remarks()
+            output = Output(TEMPERATURE_LIST, {"text": self.temperature_report(is_morning)})
+            if self.sinks is not None:
+                self.sinks.publish(output)
+            else:
+                self.write_output(output)
+        logging.info("Temperature List Updated at: %s", output.time)
+
+
+def numbered(people):
+    return "\n".join([f"{i}. {p.rank_name}" for i, p in enumerate(people, 1)])
+
+
+def roster_to_json(roster):
+    return {
+        "columns": ["S/N"] + roster.columns,
+        "hidden": roster.hidden,
+        "rows": roster.rows(roster.columns + roster.hidden),
+    }
+
+
+def roster_from_json(data):
+    columns = data["columns"][1:]
+    hidden = data.get("hidden", [])
+    roster = RosterStore(columns, hidden=hidden)
+    for row in data["rows"]:
+        roster.add_row(row[0], dict(zip(columns + hidden, row[1:])))
+    return roster
+
+
+def _from_iso(value):
+    return datetime.fromisoformat(value) if value else None
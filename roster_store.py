@@ -0,0 +1,232 @@
+# Roster held as one small record per person
+#
+# Every message only changes one or two people, but doing it on a DataFrame
+# (boolean masks, .loc with a list of rows) builds arrays as long as the whole
+# roster each time. Here each person is a __slots__ record keyed by S/N, with
+# a dict from RANK/NAME to S/N, so an update is a couple of dict lookups and
+# attribute sets. A DataFrame is only built when something wants one.
+#
+# How many people have each STATUS, in total and per PLATOON, is also kept up
+# to date as people change, so the temperature list's counts don't need to go
+# through the whole roster. Listing who has a STATUS does, once.
+#
+# Memory is kept to one record per person plus the RANK/NAME index: columns
+# the bot knows nothing about are kept in a dict per person only for people
+# who have them, and nothing else is indexed per person.
+from collections import Counter
+from operator import attrgetter
+
+# Sheet column -> Person attribute
+FIELDS = {
+    "RANK": "rank",
+    "NAME": "name",
+    "PLATOON": "platoon",
+    "VOCATION": "vocation",
+    "STATUS": "status",
+    "CONTACT": "contact",
+    "REMARKS": "remarks",
+    "LatestUpdate": "latest_update",
+    "RANK/NAME": "rank_name",
+}
+
+
+class Person:
+    __slots__ = ("sn",) + tuple(FIELDS.values())
+
+    def __init__(self, sn, **values):
+        # values: by sheet column, only those in FIELDS
+        self.sn = sn
+        for attr in FIELDS.values():
+            setattr(self, attr, "")
+        for column, value in values.items():
+            setattr(self, FIELDS[column], value)
+
+    def __repr__(self):
+        return f"Person({self.sn}, {self.rank_name!r}, {self.status!r})"
+
+
+# Columns that are looked up by, or counted
+INDEXED = ("RANK", "NAME", "STATUS", "PLATOON")
+_NO_EXTRA = {}
+
+
+class RosterStore:
+    def __init__(self, columns, people=(), hidden=()):
+        # columns: sheet columns after S/N, in the order they are written out.
+        # hidden: columns that are kept, but not written out.
+        self.columns = list(columns)
+        self.hidden = list(hidden)
+        self._people = {}
+        self._by_rank_name = {}
+        # S/N -> {column: value} for columns not in FIELDS, only for people
+        # who have any
+        self._extra = {}
+        # STATUS -> count, and (PLATOON, STATUS) -> count
+        self._status = Counter()
+        self._platoon_status = Counter()
+        for person in people:
+            self.add(person)
+
+    @classmethod
+    def from_values(cls, values, keep_remarks=False):
+        # values: PSsheet.get_all_values() without the title row, i.e. the
+        # header row first. Same cleaning as the old pandas initialize_PS:
+        # only the first 7 columns (8 with REMARKS), rows with fewer than two
+        # filled columns besides S/N dropped, and RANK/NAME added.
+        # REMARKS is read either way, but only written out with keep_remarks.
+        width = 8 if keep_remarks else 7
+        header = [x.strip() for x in values[0][:8]]
+        sn_col = header.index("S/N")
+        columns = [x for i, x in enumerate(header[:width]) if i != sn_col]
+        hidden = [x for x in header[width:] if x == "REMARKS"]
+
+        store = cls(columns + ["LatestUpdate", "RANK/NAME"], hidden=hidden)
+        for row in values:
+            if row[sn_col] == "S/N":
+                continue
+            row_values = {c: v for c, v in zip(header[:width], row) if c != "S/N"}
+            if sum(1 for v in row_values.values() if v != "") < 2:
+                continue
+            for c, v in zip(header[width:], row[width:8]):
+                if c in hidden:
+                    row_values[c] = v
+            row_values["RANK/NAME"] = f"{row_values['RANK']} {row_values['NAME']}"
+            store.add_row(int(row[sn_col]), row_values)
+        return store
+
+    def add(self, person):
+        self._people[person.sn] = person
+        self._index(person)
+
+    def add_row(self, sn, values):
+        # values: {column: value}, extra columns and all
+        fields = {c: v for c, v in values.items() if c in FIELDS}
+        self.add(Person(sn, **fields))
+        if len(fields) < len(values):
+            self._extra[sn] = {c: v for c, v in values.items() if c not in FIELDS}
+
+    def _index(self, person):
+        _index_add(self._by_rank_name, person.rank_name, person.sn)
+        self._status[person.status] += 1
+        self._platoon_status[person.platoon, person.status] += 1
+
+    def _unindex(self, person):
+        _index_remove(self._by_rank_name, person.rank_name, person.sn)
+        self._status[person.status] -= 1
+        if not self._status[person.status]:
+            del self._status[person.status]
+        key = (person.platoon, person.status)
+        self._platoon_status[key] -= 1
+        if not self._platoon_status[key]:
+            del self._platoon_status[key]
+
+    def __len__(self):
+        return len(self._people)
+
+    def __iter__(self):
+        # People in sheet order
+        return iter(self._people.values())
+
+    def __contains__(self, sn):
+        return sn in self._people
+
+    def get(self, sn):
+        return self._people[sn]
+
+    def value(self, person, column):
+        if column in FIELDS:
+            return getattr(person, FIELDS[column])
+        return self._extra.get(person.sn, _NO_EXTRA).get(column, "")
+
+    def set(self, sns, column, value):
+        if column not in FIELDS:
+            for sn in sns:
+                self._extra.setdefault(sn, {})[column] = value
+            return
+        attr = FIELDS[column]
+        for sn in sns:
+            person = self._people[sn]
+            if column in INDEXED:
+                self._unindex(person)
+                setattr(person, attr, value)
+                person.rank_name = f"{person.rank} {person.name}"
+                self._index(person)
+            else:
+                setattr(person, attr, value)
+
+    def with_rank_name(self, *rank_names):
+        # S/N of everyone with any of the RANK/NAMEs, without duplicates
+        sns = []
+        for rank_name in rank_names:
+            for sn in _index_get(self._by_rank_name, rank_name):
+                if sn not in sns:
+                    sns.append(sn)
+        return sns
+
+    def status_counts(self):
+        # {STATUS: number of people}
+        return dict(self._status)
+
+    def platoon_status_counts(self):
+        # {(PLATOON, STATUS): number of people}
+        return dict(self._platoon_status)
+
+    def grouped(self, group_of):
+        # group_of: {STATUS: group}. {group: [people]}, each in sheet order,
+        # for the people whose STATUS is in group_of, in one pass
+        groups = {group: [] for group in group_of.values()}
+        for person in self._people.values():
+            group = group_of.get(person.status)
+            if group is not None:
+                groups[group].append(person)
+        return groups
+
+    def rows(self, columns=None):
+        # [[S/N, ...columns]] in sheet order, by default the columns written out
+        columns = self.columns if columns is None else columns
+        if all(c in FIELDS for c in columns):
+            get = attrgetter(*[FIELDS[c] for c in columns])
+            if len(columns) == 1:
+                return [[p.sn, get(p)] for p in self._people.values()]
+            return [[p.sn, *get(p)] for p in self._people.values()]
+        return [[p.sn] + [self.value(p, c) for c in columns] for p in self._people.values()]
+
+    def to_df(self):
+        import pandas as pd
+
+        df = pd.DataFrame(self.rows(), columns=["S/N"] + self.columns).set_index("S/N")
+        return df.convert_dtypes()
+
+
+# Most keys belong to a single person, so an index maps to the S/N itself, and
+# only to a list of S/N when several people share the key. A list per key
+# would cost more than the people themselves.
+
+
+def _index_add(index, key, sn):
+    sns = index.get(key)
+    if sns is None:
+        index[key] = sn
+    elif isinstance(sns, list):
+        sns.append(sn)
+    else:
+        index[key] = [sns, sn]
+
+
+def _index_remove(index, key, sn):
+    sns = index[key]
+    if isinstance(sns, list):
+        sns.remove(sn)
+        if len(sns) == 1:
+            index[key] = sns[0]
+    else:
+        del index[key]
+
+
+def _index_get(index, key):
+    sns = index.get(key)
+    if sns is None:
+        return []
+    if isinstance(sns, list):
+        return list(sns)
+    return [sns]
@@ -0,0 +1,97 @@
+# Scheduled jobs
+#
+# The old loop only ran the 08:10 and 14:10 jobs if an iteration happened to
+# land in that exact minute. Here each job remembers when it last ran, so a
+# job that was missed (a slow pass, a sleep that overran) runs as soon as the
+# scheduler is next checked, unless it is more than max_delay late.
+from datetime import datetime, timedelta
+import logging
+
+
+class DailyJob:
+    def __init__(self, name, hour, minute, fn, weekdays=range(5), max_delay=None):
+        # weekdays: Monday == 0. max_delay: timedelta after which a missed
+        # run is skipped instead of caught up, None to always catch up.
+        self.name = name
+        self.hour = hour
+        self.minute = minute
+        self.fn = fn
+        self.weekdays = set(weekdays)
+        self.max_delay = max_delay
+
+    def last_due(self, now):
+        # Most recent scheduled time at or before now, None if there is none
+        # in the past week
+        for days_back in range(8):
+            day = now - timedelta(days=days_back)
+            due = datetime(day.year, day.month, day.day, self.hour, self.minute)
+            if due <= now and due.weekday() in self.weekdays:
+                return due
+        return None
+
+    def __repr__(self):
+        return f"DailyJob({self.name!r}, {self.hour:02d}:{self.minute:02d})"
+
+
+class Scheduler:
+    def __init__(self, jobs, start=None):
+        # Jobs only catch up on runs missed after start
+        start = start or datetime.today()
+        self.jobs = list(jobs)
+        self.last_run = {job.name: start for job in self.jobs}
+        self.caught_up = 0
+        self.skipped = 0
+
+    def due(self, now=None):
+        # [(due time, job)] that should run now, oldest first
+        now = now or datetime.today()
+        pending = []
+        for job in self.jobs:
+            due = job.last_due(now)
+            if due is None or due <= self.last_run[job.name]:
+                continue
+            if job.max_delay is not None and now - due > job.max_delay:
+                logging.warning("Skipping %s, due at %s, too late to catch up", job, due)
+                self.last_run[job.name] = now
+                self.skipped += 1
+                continue
+            pending.append((due, job))
+        return sorted(pending, key=lambda x: x[0])
+
+    def mark_run(self, job, due, now=None):
+        now = now or datetime.today()
+        if now - due >= timedelta(minutes=1):
+            logging.info("Caught up on %s, due at %s", job, due)
+            self.caught_up += 1
+        self.last_run[job.name] = now
+
+    def run_pending(self, now=None):
+        # Runs everything due, in this thread
+        for due, job in self.due(now):
+            try:
+                job.fn()
+            finally:
+                self.mark_run(job, due)
+
+
+MORNING_REFRESH = "morning refresh"
+
+
+def default_jobs(state):
+    # What the bot runs every weekday for a ParadeState
+    return [
+        DailyJob(
+            MORNING_REFRESH,
+            8,
+            10,
+            lambda: state.refresh(is_morning=True),
+            max_delay=timedelta(hours=4),
+        ),
+        DailyJob(
+            "afternoon temperature list",
+            14,
+            10,
+            lambda: state.generate_temperature_list(is_morning=False),
+            max_delay=timedelta(hours=3),
+        ),
+    ]
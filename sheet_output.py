@@ -0,0 +1,229 @@
+# Writing to Google Sheets
+#
+# Rewriting a whole block of the sheet for every parsed message is wasteful,
+# as normally only one or two rows change. ShadowSheet keeps a copy of what
+# was last written to a block, and only sends the cells that changed.
+#
+# The copy is only right as long as nobody else writes to the block. Writes
+# only notice a change of width (e.g. columns added to the parade state), as
+# anything more would cost a read per write. Edits made by hand to the cells
+# are found by verify(), which reads the block back, and is run every so
+# often, see ParadeState.verify_outputs().
+# WriteBehind sits in front of that, so a burst of messages is written once.
+from math import inf
+import logging
+import threading
+import time
+import traceback
+
+
+def col_to_letters(col):
+    # 1 -> A, 26 -> Z, 27 -> AA
+    letters = ""
+    while col > 0:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def to_a1(row, col):
+    return f"{col_to_letters(col)}{row}"
+
+
+def grid_to_cells(grid, first_row=1, first_col=1):
+    # [[...], [...]] -> {(row, col): value}, 1-indexed
+    return {
+        (first_row + r, first_col + c): value
+        for r, values in enumerate(grid)
+        for c, value in enumerate(values)
+    }
+
+
+def cells_to_ranges(cells):
+    # Groups {(row, col): value} into one range per row, spanning the first
+    # to the last cell given for that row. Gaps are sent as None, which the
+    # Sheets API skips, so cells in between are left as they are.
+    rows = {}
+    for (row, col), value in cells.items():
+        rows.setdefault(row, {})[col] = value
+
+    ranges = []
+    for row in sorted(rows):
+        values = rows[row]
+        first, last = min(values), max(values)
+        ranges.append(
+            {
+                "range": f"{to_a1(row, first)}:{to_a1(row, last)}",
+                "values": [[values.get(c) for c in range(first, last + 1)]],
+            }
+        )
+    return ranges
+
+
+class ShadowSheet:
+    def __init__(self, worksheet, block):
+        # block: (first_row, first_col, last_row, last_col) that this sheet
+        # owns, i.e. what used to be cleared before every write
+        self.worksheet = worksheet
+        self.block = block
+        self._shadow = None  # None forces a full rewrite
+        self.full_writes = 0
+        self.partial_writes = 0
+        self.cells_sent = 0
+        self.drifts = 0
+
+    def invalidate(self):
+        # Forget what is on the sheet, e.g. after a roster reload
+        self._shadow = None
+
+    def _owned_cells(self):
+        first_row, first_col, last_row, last_col = self.block
+        return [
+            (r, c)
+            for r in range(first_row, last_row + 1)
+            for c in range(first_col, last_col + 1)
+        ]
+
+    def _drifted(self, cells):
+        # The layout changed, e.g. columns were added to the parade state.
+        # Rows coming and going are fine, the diff takes care of those.
+        def width(c):
+            return max([col for _, col in c], default=0)
+
+        return width(self._shadow) != width(cells)
+
+    def verify(self):
+        # Reads the block back (one call) and compares it with what was last
+        # written. If they differ, e.g. someone typed over a cell, the next
+        # write rewrites the whole block and True is returned.
+        shadow = self._shadow
+        if shadow is None:
+            return False
+        first_row, first_col, last_row, last_col = self.block
+        values = self.worksheet.get(
+            f"{to_a1(first_row, first_col)}:{to_a1(last_row, last_col)}"
+        )
+        # The sheet reads back as text, and empty cells as ""
+        on_sheet = {
+            cell: value
+            for cell, value in grid_to_cells(values, first_row, first_col).items()
+            if value != ""
+        }
+        expected = {
+            (row, col): str(value)
+            for (row, col), value in shadow.items()
+            if value not in ("", None)
+            and first_row <= row <= last_row
+            and first_col <= col <= last_col
+        }
+        if on_sheet == expected:
+            return False
+        self.drifts += 1
+        if self._shadow is shadow:
+            self._shadow = None
+        return True
+
+    def pending(self, cells):
+        # {(row, col): value} that needs to be sent to end up with `cells`
+        if self._shadow is None or self._drifted(cells):
+            # Blank everything in the block, in the same write as the new
+            # values so that the sheet never reads as empty
+            to_send = {cell: "" for cell in self._owned_cells()}
+            to_send.update(cells)
+            return to_send, True
+
+        to_send = {
+            cell: value for cell, value in cells.items() if self._shadow.get(cell) != value
+        }
+        for cell in self._shadow:
+            if cell not in cells:
+                to_send[cell] = ""
+        return to_send, False
+
+    def write(self, cells):
+        to_send, full = self.pending(cells)
+        if to_send:
+            try:
+                self.worksheet.batch_update(cells_to_ranges(to_send))
+            except Exception:
+                # We no longer know what is on the sheet
+                self._shadow = None
+                raise
+            self.cells_sent += len(to_send)
+            if full:
+                self.full_writes += 1
+            else:
+                self.partial_writes += 1
+        self._shadow = dict(cells)
+        return len(to_send)
+
+
+class WriteBehind:
+    # Outputs are marked dirty while messages are parsed, and written at most
+    # once per flush, so a burst of messages in one poll costs one write per
+    # output instead of one per message.
+    def __init__(self, debounce=0):
+        # debounce: minimum seconds between two writes of the same output
+        self.debounce = debounce
+        self._flush_lock = threading.Lock()
+        self._writers = {}
+        self._dirty = set()
+        self._last_write = {}
+        self.marked = {}
+        self.written = {}
+        self.failed = {}
+
+    def register(self, name, writer):
+        self._writers[name] = writer
+        self.marked[name] = 0
+        self.written[name] = 0
+        self.failed[name] = 0
+
+    def mark_dirty(self, name):
+        self._dirty.add(name)
+        self.marked[name] += 1
+
+    def is_dirty(self, name):
+        return name in self._dirty
+
+    def flush(self, force=False):
+        # Writes every dirty output whose debounce window has passed, or all
+        # of them if forced (e.g. on shutdown). A failed write stays dirty.
+        # Outputs may be marked dirty from another thread while this runs,
+        # so the mark is taken off before writing, not after.
+        with self._flush_lock:
+            now = time.monotonic()
+            for name in list(self._writers):
+                if name not in self._dirty:
+                    continue
+                if not force and now - self._last_write.get(name, -inf) < self.debounce:
+                    continue
+                self._dirty.discard(name)
+                try:
+                    self._writers[name]()
+                except Exception:
+                    self._dirty.add(name)
+                    self.failed[name] += 1
+                    logging.error("Writing %s failed, will retry on next flush", name)
+                    logging.error(traceback.format_exc())
+                    continue
+                self._last_write[name] = now
+                self.written[name] += 1
+
+    def coalesced(self):
+        # Number of writes saved per output
+        return {
+            name: max(self.marked[name] - self.written[name], 0)
+            for name in self._writers
+        }
+
+    def stats(self):
+        return {
+            name: {
+                "marked": self.marked[name],
+                "written": self.written[name],
+                "failed": self.failed[name],
+                "coalesced": self.coalesced()[name],
+            }
+            for name in self._writers
+        }
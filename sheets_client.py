@@ -0,0 +1,279 @@
+# Google Sheets calls within the quota
+#
+# Sheets allows so many requests a minute. Going over it gives a 429, which
+# used to be logged by the main loop and the update lost. SheetsClient wraps
+# the gspread spreadsheet (and its worksheets) so that every call
+#  - first takes a token from a token bucket, so we stay under the quota,
+#  - is retried on 429s and 5xx with jittered exponential backoff,
+#  - is counted, see stats().
+# Inside `with client.batch():`, writes to any of its worksheets are queued
+# and sent together as one values batchUpdate when the block ends.
+#
+# It only relies on the gspread methods the bot uses, so it works the same in
+# front of the benchmarks' stand-ins, or a spreadsheet talking to a local fake
+# Sheets server (benchmarks/fake_sheets_server.py).
+from collections import deque
+from contextlib import contextmanager
+import logging
+import random
+import threading
+import time
+
+from metrics import METRICS
+from sheet_output import to_a1
+
+# Worth retrying: over quota, and Google having a bad time
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        # rate: tokens added per second, capacity: most tokens held at once,
+        # i.e. the largest burst
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, n=1):
+        # Blocks until n tokens are available, returns the seconds waited
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    self.waited += waited
+                    return waited
+                wait = (n - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+
+def status_code(error):
+    # HTTP status of a failed call. gspread's APIError keeps the requests
+    # response on .response
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def retry_after(error):
+    # Seconds the server asked us to wait, if it did
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class SheetsClient:
+    def __init__(
+        self,
+        sh,
+        rate=1.0,
+        burst=10,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=32.0,
+        rng=None,
+        sleep=time.sleep,
+        bucket=None,
+    ):
+        # sh: gspread Spreadsheet. rate/burst: token bucket, in calls per
+        # second. Retries wait a random time up to base_delay * 2**attempt,
+        # capped at max_delay. The quota is per user, not per spreadsheet, so
+        # clients for several spreadsheets should share one bucket.
+        self.sh = sh
+        self.bucket = bucket or TokenBucket(rate, burst, sleep=sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+        self.sleep = sleep
+        self._worksheets = {}
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._recent = deque()  # monotonic time of each request sent
+
+        self.calls = 0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failed = 0
+        self.backoff_seconds = 0.0
+        self.batches = 0
+        self.batched_writes = 0
+
+    def __getattr__(self, name):
+        # Anything not wrapped goes straight to gspread, through call()
+        if name == "sh":
+            raise AttributeError(name)
+        attr = getattr(self.sh, name)
+        if callable(attr):
+            return lambda *args, **kwargs: self.call(attr, *args, **kwargs)
+        return attr
+
+    def worksheet(self, title):
+        if title not in self._worksheets:
+            self._worksheets[title] = QuotaWorksheet(self, self.call(self.sh.worksheet, title))
+        return self._worksheets[title]
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for name, n in counts.items():
+                setattr(self, name, getattr(self, name) + n)
+
+    def call(self, fn, *args, **kwargs):
+        # fn(*args, **kwargs) within the quota, retried on transient errors
+        self._count(calls=1)
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire()
+            if waited:
+                METRICS.observe("sheets_quota_wait_seconds", waited)
+            with self._stats_lock:
+                self.requests += 1
+                self._recent.append(time.monotonic())
+            try:
+                with METRICS.timer("sheets_request"):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                status = status_code(e)
+                METRICS.inc("sheets_api_errors")
+                if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    self._count(failed=1)
+                    METRICS.inc("sheets_failed_calls")
+                    raise
+                if status == 429:
+                    self._count(throttled=1)
+                    METRICS.inc("sheets_throttled")
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.rng.uniform(
+                        0, min(self.max_delay, self.base_delay * 2**attempt)
+                    )
+                attempt += 1
+                self._count(retries=1, backoff_seconds=delay)
+                logging.warning(
+                    "Sheets call %s got %s, retry %d/%d in %.1fs",
+                    getattr(fn, "__name__", fn),
+                    status,
+                    attempt,
+                    self.max_retries,
+                    delay,
+                )
+                self.sleep(delay)
+
+    ###########################################################################
+    # Batching writes
+    ###########################################################################
+
+    @contextmanager
+    def batch(self):
+        # Writes made in this thread inside the block are sent as one call per
+        # value input option when it ends. Nested blocks join the outer one.
+        # If sending fails, take it that none of it was written.
+        if getattr(self._local, "queue", None) is not None:
+            yield
+            return
+        self._local.queue = []
+        try:
+            yield
+            queue = self._local.queue
+        finally:
+            self._local.queue = None
+        self._send(queue)
+
+    def _queue(self, value_input_option, data):
+        # True if the write was queued, False if it should be sent now
+        queue = getattr(self._local, "queue", None)
+        if queue is None:
+            return False
+        queue.extend((value_input_option, d) for d in data)
+        return True
+
+    def _send(self, queue):
+        by_option = {}
+        for option, d in queue:
+            by_option.setdefault(option, []).append(d)
+        for option, data in by_option.items():
+            self.call(
+                self.sh.values_batch_update,
+                {"valueInputOption": option, "data": data},
+            )
+            self._count(batches=1, batched_writes=len(data))
+
+    def stats(self):
+        # Quota use: requests in the last minute is what counts against the
+        # per-minute quota
+        with self._stats_lock:
+            cutoff = time.monotonic() - 60
+            while self._recent and self._recent[0] < cutoff:
+                self._recent.popleft()
+            return {
+                "calls": self.calls,
+                "requests": self.requests,
+                "requests_last_minute": len(self._recent),
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "failed": self.failed,
+                "backoff_seconds": round(self.backoff_seconds, 3),
+                "rate_limited_seconds": round(self.bucket.waited, 3),
+                "tokens_available": round(self.bucket.available(), 3),
+                "batches": self.batches,
+                "batched_writes": self.batched_writes,
+            }
+
+
+class QuotaWorksheet:
+    # A gspread Worksheet whose calls all go through a SheetsClient
+    def __init__(self, client, worksheet):
+        self.client = client
+        self.worksheet = worksheet
+        self.title = worksheet.title
+
+    def __getattr__(self, name):
+        if name == "worksheet":
+            raise AttributeError(name)
+        attr = getattr(self.worksheet, name)
+        if callable(attr):
+            return lambda *args, **kwargs: self.client.call(attr, *args, **kwargs)
+        return attr
+
+    def _range(self, range_name):
+        return f"'{self.title}'!{range_name}"
+
+    # gspread's own defaults: batch_update and update write RAW values,
+    # update_cell USER_ENTERED (so that "FALSE" ticks a checkbox off)
+
+    def batch_update(self, data, value_input_option="RAW"):
+        queued = [{"range": self._range(d["range"]), "values": d["values"]} for d in data]
+        if not self.client._queue(value_input_option, queued):
+            self.client.call(
+                self.worksheet.batch_update, data, value_input_option=value_input_option
+            )
+
+    def update(self, range_name, values, value_input_option="RAW"):
+        queued = [{"range": self._range(range_name), "values": values}]
+        if not self.client._queue(value_input_option, queued):
+            self.client.call(
+                self.worksheet.update, range_name, values, value_input_option=value_input_option
+            )
+
+    def update_cell(self, row, col, value):
+        queued = [{"range": self._range(to_a1(row, col)), "values": [[value]]}]
+        if not self.client._queue("USER_ENTERED", queued):
+            self.client.call(self.worksheet.update_cell, row, col, value)
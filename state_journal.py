@@ -0,0 +1,152 @@
+# Local journal and snapshots of the parade state
+#
+# ongoingDetails only lives in memory, so a crash or a reboot used to lose
+# every vehicle still out, and the whole morning's chat was parsed again.
+# Every change to the state is appended to a journal (one JSON object per
+# line), and every so often the whole state is written to a snapshot and the
+# journal started afresh. On start up, the latest snapshot plus whatever was
+# journalled after it gives back the state without reading the sheet.
+#
+# Records are numbered. The snapshot notes the last record it includes, so
+# records left over from a crash between writing the snapshot and emptying
+# the journal are skipped.
+import json
+import logging
+import os
+import threading
+import time
+
+JOURNAL_FILE = "journal.jsonl"
+SNAPSHOT_FILE = "snapshot.json"
+
+
+class StateJournal:
+    def __init__(self, directory, fsync_every=1, fsync_interval=None, snapshot_every=1000):
+        # fsync_every: records between fsyncs, 0 to only fsync on sync().
+        # fsync_interval: seconds after which an append fsyncs anyway, None for
+        # no limit. snapshot_every: records after which needs_snapshot() is True.
+        os.makedirs(directory, exist_ok=True)
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+
+        self.seq = 0
+        self.since_snapshot = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._file = None
+        self._lock = threading.Lock()
+
+        self.appended = 0
+        self.fsyncs = 0
+        self.snapshots = 0
+
+    def load(self):
+        # (snapshot dict or None, [records after the snapshot]). Must be
+        # called before anything is appended, so numbering carries on.
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        base = snapshot["seq"] if snapshot else 0
+
+        records = []
+        if os.path.exists(self.journal_path):
+            # Where the last whole record ends
+            end = 0
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError
+                        record = json.loads(line)
+                    except ValueError:
+                        # Half written when the power went, nothing after it
+                        break
+                    end += len(line)
+                    if record["seq"] > base:
+                        records.append(record)
+                size = f.seek(0, os.SEEK_END)
+            if size > end:
+                # Cut off, or the next record appended would be glued onto
+                # it and lost along with everything after it
+                logging.warning(
+                    "Journal ends with %d bytes of a partial record, removing them",
+                    size - end,
+                )
+                os.truncate(self.journal_path, end)
+
+        self.seq = records[-1]["seq"] if records else base
+        self.since_snapshot = len(records)
+        return snapshot, records
+
+    def append(self, op, **fields):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.journal_path, "a")
+            self.seq += 1
+            record = {"seq": self.seq, "op": op, **fields}
+            self._file.write(json.dumps(record, default=str) + "\n")
+            self._unsynced += 1
+            self.since_snapshot += 1
+            self.appended += 1
+
+            if (self.fsync_every and self._unsynced >= self.fsync_every) or (
+                self.fsync_interval is not None
+                and time.monotonic() - self._last_sync >= self.fsync_interval
+            ):
+                self._sync()
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.fsyncs += 1
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        # Everything appended so far is on disk after this
+        with self._lock:
+            self._sync()
+
+    def needs_snapshot(self):
+        return self.since_snapshot >= self.snapshot_every
+
+    def write_snapshot(self, data):
+        # data: JSON-able state as of the last record appended. Nothing may be
+        # appended while this runs, see ParadeState.snapshot().
+        with self._lock:
+            data = dict(data, seq=self.seq, created=time.time())
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            # Everything in the journal is in the snapshot now
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.journal_path, "w")
+            self._unsynced = 0
+            self.since_snapshot = 0
+            self.snapshots += 1
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        return {
+            "seq": self.seq,
+            "appended": self.appended,
+            "fsyncs": self.fsyncs,
+            "snapshots": self.snapshots,
+            "since_snapshot": self.since_snapshot,
+        }
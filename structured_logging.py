@@ -0,0 +1,191 @@
+# Logging off the hot path
+#
+# Every log call used to write to log.txt there and then, from whichever
+# thread made it, and the file was truncated on every restart. setup_logging()
+# puts a QueueHandler on the root logger instead, so that logging only queues
+# the record. A listener thread formats it and writes it out, to log.txt as
+# before (now appended to, and rotated by size), or to events.jsonl for
+# events.
+#
+# Log calls pass their values as arguments rather than in f-strings, e.g.
+# logging.info("RTU: %r", veh), so nothing is formatted for a level that is
+# off, and what is logged is formatted on the listener thread. The arguments
+# should not be changed after the call.
+#
+# Events are what happened as fields rather than text: a message parsed, a
+# name matched, a change to the state. One JSON object per line:
+#
+#   {"time": "2026-10-17T13:45:02.114", "event": "name_matched", "name": "CPL Wei Tan", "sn": 12}
+#
+# There are several for every message, and writing them out takes the
+# listener about as long as the rest of the log, so they are off unless
+# setup_logging() is given an events_path.
+import atexit
+from datetime import datetime
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+
+from metrics import METRICS
+
+EVENTS = logging.getLogger("events")
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%d/%m/%y %H:%M:%S"
+
+
+def event(name, /, **fields):
+    # fields: JSON-able values, or anything with a str(). Any field names,
+    # including "name". The record is made here rather than by EVENTS.info(),
+    # which also looks up the caller's file and line, unused for events.
+    if EVENTS.isEnabledFor(logging.INFO):
+        record = logging.LogRecord(
+            EVENTS.name, logging.INFO, "", 0, "%s %s", (name, fields), None
+        )
+        record.event = name
+        record.fields = fields
+        EVENTS.handle(record)
+
+
+def events_enabled():
+    # For when working out the fields costs something, e.g.
+    #   if events_enabled():
+    #       event("message_parsed", ...)
+    return EVENTS.isEnabledFor(logging.INFO)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+        }
+        if hasattr(record, "event"):
+            entry["event"] = record.event
+            entry.update(record.fields)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Never blocks. If the listener falls behind (e.g. the disk is stuck) and
+    # the queue fills up, records are dropped and counted.
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            METRICS.inc("log_records_dropped")
+
+    def prepare(self, record):
+        # QueueHandler formats the message here, in the thread logging it.
+        # Only the traceback is, as it can't wait.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class BufferedFileHandler(RotatingFileHandler):
+    # Doesn't flush after every record. The listener flushes once it has
+    # caught up, so a burst is written out in a few writes.
+    #
+    # RotatingFileHandler seeks to the end of the file for its size before
+    # every record, which also flushes, so the size is kept count of here
+    # instead. It counts characters rather than bytes, which is close
+    # enough for when to rotate.
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._size = os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            if self.maxBytes > 0 and self._size + len(msg) >= self.maxBytes:
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(msg)
+            self._size += len(msg)
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._size = 0
+
+    def flush(self):
+        pass
+
+    def flush_now(self):
+        super().flush()
+
+
+class DrainingQueueListener(QueueListener):
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush_now()
+        return self.queue.get(block)
+
+    # stop() writes out everything queued. The stock one fails when the
+    # queue is full, as it can't queue the sentinel without blocking.
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        # Also from atexit, after a stop() already
+        if self._thread is None:
+            return
+        # The thread ends on the sentinel without flushing what is left
+        super().stop()
+        for handler in self.handlers:
+            handler.flush_now()
+
+
+def setup_logging(
+    path="log.txt",
+    events_path=None,
+    level=logging.INFO,
+    max_bytes=10 * 2**20,
+    backups=5,
+    queue_size=10000,
+):
+    # Replaces the root logger's handlers. Events are only written with an
+    # events_path, e.g. "events.jsonl".
+    # Returns the QueueListener, which is stopped (and so flushed) at exit.
+    text = BufferedFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    text.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+    text.addFilter(lambda record: not hasattr(record, "event"))
+    handlers = [text]
+
+    if events_path:
+        events = BufferedFileHandler(
+            events_path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+        )
+        events.setFormatter(JsonLinesFormatter())
+        events.addFilter(lambda record: hasattr(record, "event"))
+        handlers.append(events)
+        EVENTS.setLevel(logging.NOTSET)
+    else:
+        EVENTS.setLevel(logging.CRITICAL + 1)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(queue.Queue(queue_size)))
+    root.setLevel(level)
+
+    listener = DrainingQueueListener(root.handlers[0].queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,47 @@
+# The chat fixture for benchmarks/check_scraper_js.py, which needs Chrome, has
+# what the bot looks for on the page
+import os
+from html.parser import HTMLParser
+
+FIXTURE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "benchmarks",
+    "fixtures",
+    "whatsapp_chat.html",
+)
+# WhatsappBot.TO_UPDATE, quoted for the XPath in open_chat
+TO_UPDATE = "'Mandai TOs'"
+
+
+class Titles(HTMLParser):
+    # title attribute of every element, and of the ones in #main's header
+    def __init__(self):
+        super().__init__()
+        self.titles = []
+        self.header_titles = []
+        self._in_main = self._in_header = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if attrs.get("id") == "main":
+            self._in_main = True
+        if tag == "header" and self._in_main:
+            self._in_header = True
+        if "title" in attrs and tag != "title":
+            self.titles.append(attrs["title"])
+            if self._in_header:
+                self.header_titles.append(attrs["title"])
+
+    def handle_endtag(self, tag):
+        if tag == "header":
+            self._in_header = False
+
+
+def test_header_title_is_what_open_chat_compares_to():
+    with open(FIXTURE, encoding="utf-8") as f:
+        titles = Titles()
+        titles.feed(f.read())
+    # current_chat reads "#main header span[title]"
+    assert titles.header_titles == [TO_UPDATE.strip("'")]
+    # and open_chat clicks //*[contains(@title, 'Mandai TOs')]
+    assert all(TO_UPDATE.strip("'") in title for title in titles.titles)
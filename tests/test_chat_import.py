@@ -0,0 +1,43 @@
+# Reading a chat export into updates
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_import import ImportStats, group_messages, in_range, updates  # noqa: E402
+from message_parser import MOVEMENT, REPLY  # noqa: E402
+
+EXPORT = [
+    "17/10/2026, 08:05 - Wei Tan (CPL, PLT 1): 1x 5ton MOV",
+    "TO: CPL Wei Tan",
+    "VC: 3SG Lim Jun",
+    "MID: 41234",
+    "Purpose: Training",
+    "17/10/2026, 08:06 - Jun Lim (3SG, PLT 1): Noted",
+    "17/10/2026, 11:40 - Wei Tan (CPL, PLT 1): RTU",
+    "Reached",
+]
+
+
+def parse(lines, stats=None):
+    stats = stats or ImportStats()
+    return list(updates(in_range(group_messages(iter(lines), stats), stats)))
+
+
+def test_two_line_rtu_reply_returns_the_detail():
+    (_, _, movement), (_, sent, reply) = parse(EXPORT)
+    assert movement.kind == MOVEMENT
+    assert movement.plate == "41234"
+    # Nothing quoted to skip, "RTU" is what was said
+    assert reply.kind == REPLY
+    assert reply.body[0] == "RTU"
+    assert reply.returned
+    assert reply.sender == "Wei Tan (CPL, PLT 1):"
+    assert (sent.hour, sent.minute) == (11, 40)
+
+
+def test_unreadable_date_is_counted_and_skipped():
+    stats = ImportStats()
+    lines = ["[08:00, 99/99/2026] Wei Tan (CPL, PLT 1): RTU", "Reached"] + EXPORT
+    assert len(parse(lines, stats)) == 2
+    assert stats.errors == 1
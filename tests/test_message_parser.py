@@ -0,0 +1,52 @@
+# Reading messages with tokenize
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_parser import MOVEMENT, REPLY, split_message, start_line, tokenize  # noqa: E402
+
+
+def test_movement():
+    parsed = tokenize(
+        "1x 5ton MOV\nTO: CPL Wei Tan\nVC: 3SG Lim Jun\nMID: 41234\nPurpose: Training\n13:45"
+    )
+    assert parsed.kind == MOVEMENT
+    assert (parsed.model, parsed.to, parsed.vc) == ("5ton", "CPL Wei Tan", "3SG Lim Jun")
+    assert (parsed.plate, parsed.purpose) == ("41234", "Training")
+
+
+def test_header_without_count():
+    # A first line starting with a digit is the header, as it always was
+    lines = split_message("5ton MOV\nTO: CPL Wei Tan\nVC: 3SG Lim Jun\nMID: 41234\n13:45")
+    assert start_line(lines) == 0
+    parsed = tokenize("\n".join(lines))
+    assert parsed.kind == MOVEMENT
+    assert (parsed.model, parsed.to, parsed.plate) == ("5ton", "CPL Wei Tan", "41234")
+
+
+def test_quoted_name_starting_with_digit_is_not_a_header():
+    parsed = tokenize(
+        "3SG Lim Jun\n1x 5ton MOV\nTO: CPL Wei Tan\nVC: 3SG Lim Jun\nMID: 41234\nRTU reached\n14:02"
+    )
+    assert parsed.kind == REPLY
+    assert parsed.body[0] == "1x 5ton MOV"
+    assert parsed.returned
+
+
+def test_reply_to_a_reply():
+    parsed = tokenize("CPL Wei Tan\nCPL Wei Tan\nRTU\nReached\n14:05")
+    assert parsed.kind == REPLY
+    assert parsed.to is None and not parsed.has_details
+    assert parsed.returned
+
+
+def test_not_an_update():
+    assert tokenize("Noted") is None
+    assert tokenize("Detail forecast\nTO: CPL Wei Tan") is None
+
+
+def test_empty_lines_are_skipped():
+    parsed = tokenize("1x ouv MOV\n\nTO: CPL Wei Tan\nVC: 3SG Lim Jun\n\nMID: 12:34\n13:45")
+    assert parsed.lines[1] == "TO: CPL Wei Tan"
+    assert parsed.plate == "12:34"
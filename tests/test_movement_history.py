@@ -0,0 +1,100 @@
+# MovementHistory queries, and opening the store again after a crash
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import movement_history  # noqa: E402
+from movement_history import COLUMNS, STRINGS_FILE, MovementHistory  # noqa: E402
+from utility_functions import Vehicle  # noqa: E402
+
+DAY = datetime(2026, 10, 12)
+
+
+def vehicle(plate, to="LCP LIM KAI", vcom="CPL TAN WEI"):
+    return Vehicle("OUV", plate, to, "ADMIN", vcom)
+
+
+def ids(details):
+    return [d.id for d in details]
+
+
+def test_long_detail_found_on_every_day_it_was_out(tmp_path):
+    history = MovementHistory(tmp_path)
+    long = history.start(vehicle("40001"), DAY + timedelta(hours=8))
+    short = history.start(vehicle("40002"), DAY + timedelta(days=2, hours=9))
+    history.end("40002", DAY + timedelta(days=2, hours=10))
+    history.end("40001", DAY + timedelta(days=4, hours=8))
+
+    noon = DAY + timedelta(days=3, hours=12)
+    assert ids(history.between(noon, noon + timedelta(hours=1))) == [long.id]
+    assert ids(history.between(DAY + timedelta(days=2), noon)) == [long.id, short.id]
+    late = DAY + timedelta(days=4, hours=9)
+    assert history.between(late, late + timedelta(hours=1)) == []
+
+
+def test_ongoing_detail_found_after_the_day_it_started(tmp_path):
+    history = MovementHistory(tmp_path)
+    detail = history.start(vehicle("40001"), DAY + timedelta(hours=8))
+    later = DAY + timedelta(days=5)
+    assert ids(history.between(later, later + timedelta(hours=1))) == [detail.id]
+
+
+def test_reopen_after_partial_row(tmp_path):
+    history = MovementHistory(tmp_path)
+    history.start(vehicle("40001"), DAY + timedelta(hours=8))
+    history.end("40001", DAY + timedelta(hours=11))
+    history.close()
+    # The power went after the first two columns of the next row
+    day_dir = tmp_path / DAY.strftime("%Y-%m-%d")
+    for name, fmt in list(COLUMNS.items())[:2]:
+        with open(day_dir / f"{name}.{fmt}", "ab") as f:
+            f.write(b"\1" * 8)
+
+    history = MovementHistory(tmp_path)
+    assert history.events == 2
+    history.start(vehicle("40002"), DAY + timedelta(hours=12))
+    history.close()
+
+    history = MovementHistory(tmp_path)
+    assert history.events == 3
+    assert [d.plates for d in history.ongoing()] == [["40002"]]
+    assert ids(history.for_plate("40001", DAY, DAY + timedelta(days=1))) == [0]
+
+
+def test_reopen_after_partial_string(tmp_path):
+    history = MovementHistory(tmp_path)
+    history.start(vehicle("40001"), DAY + timedelta(hours=8))
+    history.close()
+    # The power went half way through adding a name
+    with open(tmp_path / STRINGS_FILE, "a") as f:
+        f.write('"LCP PART')
+
+    history = MovementHistory(tmp_path)
+    history.start(vehicle("40002", to="LCP NEW NAME"), DAY + timedelta(hours=9))
+    history.close()
+
+    history = MovementHistory(tmp_path)
+    assert [d.people for d in history.ongoing()] == [
+        ["LCP LIM KAI", "CPL TAN WEI"],
+        ["LCP NEW NAME", "CPL TAN WEI"],
+    ]
+
+
+def test_sync_only_the_files_written_to(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(movement_history.os, "fsync", synced.append)
+    history = MovementHistory(tmp_path)
+    history.start(vehicle("40001"), DAY + timedelta(hours=8))
+    history.sync()
+    # The columns, and strings.jsonl for the new strings
+    assert len(synced) == len(COLUMNS) + 1
+
+    synced.clear()
+    history.sync()
+    assert synced == []
+    history.end("40001", DAY + timedelta(hours=9))
+    history.sync()
+    assert len(synced) == len(COLUMNS)
+    history.close()
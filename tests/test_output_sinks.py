@@ -0,0 +1,47 @@
+# Retrying a webhook that fails part way through
+import io
+import json
+import os
+import sys
+import time
+import urllib.error
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import output_sinks  # noqa: E402
+from output_sinks import ONGOING_DETAILS, TEMPERATURE_LIST, Output, WebhookSink  # noqa: E402
+
+
+class FlakyWebhook:
+    # urlopen that fails the POSTs numbered in `fail` (from 1)
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.posts = 0
+        self.received = []
+
+    def __call__(self, request, timeout=None):
+        self.posts += 1
+        if self.posts in self.fail:
+            raise urllib.error.URLError("down")
+        self.received.append(json.loads(request.data)["text"])
+        return io.BytesIO(b"{}")
+
+
+def test_failed_post_does_not_send_the_ones_before_again(monkeypatch):
+    webhook = FlakyWebhook(fail={2})
+    monkeypatch.setattr(output_sinks.urllib.request, "urlopen", webhook)
+    sink = WebhookSink("http://localhost/", linger=0.05, min_interval=0, retry_delay=0.01)
+    sink.start()
+    sink.offer(Output(TEMPERATURE_LIST, {"text": "temperatures"}))
+    sink.offer(Output(ONGOING_DETAILS, {"cells": ["41234 OUV"]}))
+    # Closing gives up on a failed write, so wait for the retry first
+    deadline = time.monotonic() + 5
+    while sink.stats()["written"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sink.close()
+
+    assert webhook.received[0] == "temperatures"
+    assert len(webhook.received) == 2
+    assert webhook.received[1].endswith("41234 OUV")
+    assert sink.stats()["written"] == 2
+    assert sink.stats()["failures"] == 1
@@ -0,0 +1,65 @@
+# Crash and restart of the StateJournal
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state_journal import StateJournal  # noqa: E402
+
+
+def crash(journal, tail):
+    # What is left after the power went in the middle of writing a record
+    journal.close()
+    with open(journal.journal_path, "ab") as f:
+        f.write(tail)
+
+
+def test_append_after_partial_record_survives_restart(tmp_path):
+    journal = StateJournal(tmp_path)
+    journal.load()
+    journal.append("set", rows=[1], column="STATUS", value="DETAIL")
+    journal.append("set", rows=[2], column="STATUS", value="DETAIL")
+    crash(journal, b'{"seq": 3, "op": "rt')
+
+    # Restart, carry on, restart again
+    journal = StateJournal(tmp_path)
+    _, records = journal.load()
+    assert [r["op"] for r in records] == ["set", "set"]
+    journal.append("rtu", plate="41234")
+    journal.append("rtu", plate="41235")
+    journal.close()
+
+    _, records = StateJournal(tmp_path).load()
+    assert [r["op"] for r in records] == ["set", "set", "rtu", "rtu"]
+    assert [r["seq"] for r in records] == [1, 2, 3, 4]
+
+
+def test_record_without_newline_is_dropped(tmp_path):
+    # The whole JSON made it, but not the newline
+    journal = StateJournal(tmp_path)
+    journal.load()
+    journal.append("set", rows=[1], column="STATUS", value="DETAIL")
+    crash(journal, json.dumps({"seq": 2, "op": "rtu", "plate": "41234"}).encode())
+
+    journal = StateJournal(tmp_path)
+    _, records = journal.load()
+    assert [r["seq"] for r in records] == [1]
+    journal.append("rtu", plate="41235")
+    journal.close()
+
+    _, records = StateJournal(tmp_path).load()
+    assert [(r["seq"], r["op"]) for r in records] == [(1, "set"), (2, "rtu")]
+    assert records[-1]["plate"] == "41235"
+
+
+def test_whole_journal_is_left_alone(tmp_path):
+    journal = StateJournal(tmp_path)
+    journal.load()
+    journal.append("set", rows=[1], column="STATUS", value="DETAIL")
+    journal.close()
+    size = os.path.getsize(journal.journal_path)
+
+    _, records = StateJournal(tmp_path).load()
+    assert len(records) == 1
+    assert os.path.getsize(journal.journal_path) == size
@@ -0,0 +1,56 @@
+# BufferedFileHandler only writing out when flushed, and still rotating, and
+# everything written out once logging stops
+import json
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_logging import BufferedFileHandler, event, setup_logging  # noqa: E402
+
+
+def record(i):
+    return logging.makeLogRecord({"msg": "record %d", "args": (i,)})
+
+
+def test_records_stay_buffered_until_flush_now(tmp_path):
+    path = tmp_path / "log.txt"
+    handler = BufferedFileHandler(path, maxBytes=10**6, backupCount=1, encoding="utf-8")
+    for i in range(101):
+        handler.handle(record(i))
+    assert os.path.getsize(path) == 0
+    handler.flush_now()
+    assert os.path.getsize(path) == sum(len(f"record {i}\n") for i in range(101))
+    handler.close()
+
+
+def test_rotates_at_max_bytes(tmp_path):
+    path = tmp_path / "log.txt"
+    # An existing file counts towards the size
+    path.write_text("x" * 90 + "\n")
+    handler = BufferedFileHandler(path, maxBytes=100, backupCount=2, encoding="utf-8")
+    for i in range(10):
+        handler.handle(record(i))
+    handler.close()
+    assert (tmp_path / "log.txt.1").read_text().startswith("x" * 90)
+    assert not (tmp_path / "log.txt.2").exists()
+    assert path.read_text() == "".join(f"record {i}\n" for i in range(10))
+
+
+def test_stop_writes_out_everything(tmp_path):
+    listener = setup_logging(tmp_path / "log.txt", tmp_path / "events.jsonl")
+    try:
+        logging.info("hello %s", "there")
+        event("name_matched", name="CPL TAN WEI", sn=12)
+    finally:
+        listener.stop()
+        # Again at exit
+        listener.stop()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.setLevel(logging.WARNING)
+    assert (tmp_path / "log.txt").read_text().endswith(" - INFO - hello there\n")
+    entry = json.loads((tmp_path / "events.jsonl").read_text())
+    assert (entry["event"], entry["name"], entry["sn"]) == ("name_matched", "CPL TAN WEI", 12)
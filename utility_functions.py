@@ -1,11 +1,12 @@
 # Import required packages
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
 from datetime import datetime
 
 
 class Vehicle:
-    def __init__(self, model, plate, to, purpose, vcom=None):
+    # One per ongoing detail, so kept small
+    __slots__ = ("model", "plate", "to", "purpose", "vcom", "started")
+
+    def __init__(self, model, plate, to, purpose, vcom=None, started=None):
         self.model = model
         self.plate = plate
         # self.avi = datetime.strptime(avi, "%d/%m/%Y").date()  # Parses dd/mm/yyyy
@@ -13,16 +14,29 @@ class Vehicle:
         self.to = to
         self.vcom = vcom
         self.purpose = purpose
+        # When the movement was sent, None for details from before this was kept
+        self.started = started
 
-    def __repr__(self):
+    def as_dict(self):
         return {
             "model": self.model,
             "plate": self.plate,
             "to": self.to,
             "purpose": self.purpose,
             "vcom": self.vcom,
+            "started": self.started.isoformat() if self.started else None,
         }
 
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        if data.get("started"):
+            data["started"] = datetime.fromisoformat(data["started"])
+        return cls(**data)
+
+    def __repr__(self):
+        return f"Vehicle({self.as_dict()})"
+
     def __str__(self):
         return_str = (
             f"Model: {self.model}\n"
@@ -35,6 +49,20 @@ class Vehicle:
 
 
 class Detail:
+    # A movement, from the message sending the vehicle(s) out to the RTU.
+    # Kept by MovementHistory, see movement_history.py. end_time is None
+    # while still out.
+    __slots__ = (
+        "id",
+        "vehicles",
+        "supporting_unit",
+        "reporting_location",
+        "destination",
+        "start_time",
+        "end_time",
+        "returned",
+    )
+
     def __init__(
         self,
         vehicles,
@@ -43,20 +71,53 @@ class Detail:
         destination=None,
         start_time=None,
         end_time=None,
+        id=None,
+        returned=None,
     ):
         if not isinstance(vehicles, list):
             vehicles = [vehicles]
         self.vehicles = vehicles
 
         if not supporting_unit:
-            self.supporting_unit = {
+            supporting_unit = {
                 "Name": None,
                 "Purpose": None,
                 "POC": None,
                 "POC Contact": None,
             }
+        self.supporting_unit = supporting_unit
 
         self.reporting_location = reporting_location
-        self.desination = desination
+        self.destination = destination
         self.start_time = start_time
         self.end_time = end_time
+        self.id = id
+        # True for an RTU, False if it was dropped without one (expired, or
+        # the plate sent out again), None while still out
+        self.returned = returned
+
+    @property
+    def ongoing(self):
+        return self.end_time is None
+
+    @property
+    def plates(self):
+        return [v.plate for v in self.vehicles]
+
+    @property
+    def people(self):
+        # RANK/NAME of everyone on it, TOs and VCOMs
+        return [x for v in self.vehicles for x in (v.to, v.vcom) if x]
+
+    def duration(self, now=None):
+        # How long it was (or has been) out
+        return (self.end_time or now or datetime.today()) - self.start_time
+
+    def overlaps(self, start, end):
+        # Out at any point between start and end
+        return self.start_time < end and (self.end_time is None or self.end_time > start)
+
+    def __repr__(self):
+        return (
+            f"Detail({self.id}, {self.plates}, {self.start_time} -> {self.end_time})"
+        )
@@ -0,0 +1,99 @@
+# Ongoing details, by plate and by who is on them
+#
+# A reply that only has the sender to go on ("RTU reached" from the TO) used
+# to go through every ongoing vehicle looking for one with that TO or VCOM.
+# VehicleRegistry keeps the vehicles by plate, with dicts from TO and from
+# VCOM to plate, so finding someone's detail is a couple of dict lookups.
+#
+# What goes on the Daily Reporting sheet is also kept per vehicle, so writing
+# the list out doesn't format every vehicle again after each message.
+from roster_store import _index_add, _index_get, _index_remove
+
+
+class VehicleRegistry:
+    def __init__(self, vehicles=()):
+        self._vehicles = {}
+        self._cells = {}
+        self._by_to = {}
+        self._by_vcom = {}
+        # Order the vehicles were added in, the oldest wins a lookup by person
+        self._order = {}
+        self._added = 0
+        self._view = None
+        for veh in vehicles:
+            self.add(veh)
+
+    def __len__(self):
+        return len(self._vehicles)
+
+    def __iter__(self):
+        # Vehicles in the order they were first added
+        return iter(self._vehicles.values())
+
+    def __contains__(self, plate):
+        return plate in self._vehicles
+
+    def get(self, plate, default=None):
+        return self._vehicles.get(plate, default)
+
+    def add(self, veh):
+        # A plate that is already out is replaced, but keeps its place
+        old = self._vehicles.get(veh.plate)
+        if old is not None:
+            self._unindex(old)
+        else:
+            self._order[veh.plate] = self._added
+            self._added += 1
+        self._vehicles[veh.plate] = veh
+        self._cells[veh.plate] = f"{veh.plate}\n{str(veh)}"
+        _index_add(self._by_to, veh.to, veh.plate)
+        if veh.vcom:
+            _index_add(self._by_vcom, veh.vcom, veh.plate)
+        self._view = None
+
+    def _unindex(self, veh):
+        _index_remove(self._by_to, veh.to, veh.plate)
+        if veh.vcom:
+            _index_remove(self._by_vcom, veh.vcom, veh.plate)
+
+    def pop(self, plate, *default):
+        if plate not in self._vehicles:
+            if default:
+                return default[0]
+            raise KeyError(plate)
+        veh = self._vehicles.pop(plate)
+        del self._cells[plate]
+        del self._order[plate]
+        self._unindex(veh)
+        self._view = None
+        return veh
+
+    def with_person(self, rank_name):
+        # Vehicles with rank_name as the TO or the VCOM, oldest first
+        plates = _index_get(self._by_to, rank_name) + _index_get(self._by_vcom, rank_name)
+        plates = sorted(set(plates), key=self._order.__getitem__)
+        return [self._vehicles[plate] for plate in plates]
+
+    def for_person(self, rank_name):
+        # The detail rank_name is on, or None
+        vehicles = self.with_person(rank_name)
+        return vehicles[0] if vehicles else None
+
+    def stale(self, before):
+        # Vehicles that went out before `before`. Those from before start
+        # times were kept never go stale. They are dropped by
+        # ParadeState.expire_details, so that it is journalled.
+        return [v for v in self._vehicles.values() if v.started and v.started < before]
+
+    def cells(self):
+        # One "<plate>\n<vehicle>" per vehicle, as written to Daily Reporting.
+        # The list is only rebuilt after a change.
+        if self._view is None:
+            self._view = list(self._cells.values())
+        return self._view
+
+    def stats(self):
+        return {
+            "vehicles": len(self._vehicles),
+            "people": len(self._by_to) + len(self._by_vcom),
+        }
@@ -0,0 +1,291 @@
+# Reading messages off WhatsApp Web
+#
+# Going through Selenium element by element costs a WebDriver round trip per
+# call, i.e. several per message on every poll. Instead, one script is run in
+# the page that returns everything needed for all incoming messages, and
+# messages are remembered by their data-id so each is only handled once.
+#
+# Rather than scanning the whole chat, a MutationObserver can also be put into
+# the page, which queues up incoming messages as WhatsApp renders them. The
+# queue is then cheap enough to drain every second or so.
+#
+# WhatsApp Web only renders the most recent messages of a chat, and loads
+# older ones as it is scrolled up. After downtime, scroll_back scrolls up until
+# it gets to the last message handled, and rendered_messages then reads them
+# out oldest first, a batch at a time.
+from collections import OrderedDict
+from datetime import datetime
+import logging
+import os
+import time
+
+from metrics import METRICS
+
+# [data-id, data-pre-plain-text, text] of a .message-in element.
+# data-pre-plain-text is null for deleted messages.
+READ_MESSAGE_JS = """
+var readMessage = function (el) {
+    var row = el.closest("[data-id]") || el.querySelector("[data-id]");
+    var meta = el.querySelector(".copyable-text[data-pre-plain-text]");
+    return [
+        row ? row.getAttribute("data-id") : null,
+        meta ? meta.getAttribute("data-pre-plain-text") : null,
+        el.innerText,
+    ];
+};
+"""
+
+# Every incoming message currently rendered
+EXTRACT_MESSAGES_JS = (
+    READ_MESSAGE_JS
+    + """
+return Array.from(document.querySelectorAll(".message-in")).map(readMessage);
+"""
+)
+
+# Queues every .message-in added to the page from now on. Safe to run again,
+# the observer is only installed once per page load.
+INSTALL_OBSERVER_JS = (
+    READ_MESSAGE_JS
+    + """
+var maxQueued = arguments[0];
+if (!window.__paradeObserver) {
+    window.__paradeQueue = [];
+    window.__paradeObserver = new MutationObserver(function (mutations) {
+        mutations.forEach(function (mutation) {
+            mutation.addedNodes.forEach(function (node) {
+                if (node.nodeType !== Node.ELEMENT_NODE) {
+                    return;
+                }
+                var found = node.matches(".message-in")
+                    ? [node]
+                    : Array.from(node.querySelectorAll(".message-in"));
+                found.forEach(function (el) {
+                    window.__paradeQueue.push(readMessage(el));
+                });
+            });
+        });
+        // Nobody is draining, keep only the newest
+        if (window.__paradeQueue.length > maxQueued) {
+            window.__paradeQueue.splice(0, window.__paradeQueue.length - maxQueued);
+        }
+    });
+    window.__paradeObserver.observe(document.body, {childList: true, subtree: true});
+}
+return true;
+"""
+)
+
+# Empties the queue. null means the observer is gone, e.g. the page reloaded.
+DRAIN_QUEUE_JS = """
+if (!window.__paradeObserver) {
+    return null;
+}
+var queued = window.__paradeQueue;
+window.__paradeQueue = [];
+return queued;
+"""
+
+# Title of the chat that is open, null if none is
+CURRENT_CHAT_JS = """
+var title = document.querySelector("#main header span[title]");
+return title ? title.getAttribute("title") : null;
+"""
+
+# [number of incoming messages rendered, data-id, data-pre-plain-text, text],
+# the last three of the oldest one
+OLDEST_MESSAGE_JS = (
+    READ_MESSAGE_JS
+    + """
+var rendered = document.querySelectorAll(".message-in");
+if (!rendered.length) {
+    return [0, null, null, null];
+}
+return [rendered.length].concat(readMessage(rendered[0]));
+"""
+)
+
+# Incoming messages arguments[0] to arguments[0] + arguments[1], oldest first
+EXTRACT_RANGE_JS = (
+    READ_MESSAGE_JS
+    + """
+var rendered = document.querySelectorAll(".message-in");
+return Array.from(rendered)
+    .slice(arguments[0], arguments[0] + arguments[1])
+    .map(readMessage);
+"""
+)
+
+# Scrolls the open chat to the top (arguments[0] true), which has WhatsApp
+# load older messages, or back to the bottom. false if there is nothing to
+# scroll.
+SCROLL_CHAT_JS = """
+var pane = document.querySelector("#main .message-in");
+while (pane && pane.scrollHeight <= pane.clientHeight) {
+    pane = pane.parentElement;
+}
+if (!pane) {
+    return false;
+}
+pane.scrollTop = arguments[0] ? 0 : pane.scrollHeight;
+return true;
+"""
+
+SCREENSHOT_PATH = ".\\screenshot.png"
+# Creating this file asks for a screenshot, which is taken on the next poll
+SCREENSHOT_REQUEST = "screenshot.request"
+
+
+def extract_messages(driver):
+    # [(message_id, pre_plain_text, text)] in the order they are displayed
+    return [tuple(x) for x in driver.execute_script(EXTRACT_MESSAGES_JS)]
+
+
+def install_observer(driver, max_queued=1000):
+    driver.execute_script(INSTALL_OBSERVER_JS, max_queued)
+
+
+def drain_messages(driver, max_queued=1000):
+    # [(message_id, pre_plain_text, text)] added since the last drain, in the
+    # order they were rendered. Puts the observer back if it went missing.
+    with METRICS.timer("drain"):
+        queued = driver.execute_script(DRAIN_QUEUE_JS)
+    if queued is None:
+        install_observer(driver, max_queued)
+        return []
+    return [tuple(x) for x in queued]
+
+
+def oldest_message(driver):
+    # (number of incoming messages rendered, (message_id, pre_plain_text,
+    # text) of the oldest, None if there are none)
+    count, *oldest = driver.execute_script(OLDEST_MESSAGE_JS)
+    return count, tuple(oldest) if count else None
+
+
+def scroll_chat(driver, to_top=True):
+    return driver.execute_script(SCROLL_CHAT_JS, to_top)
+
+
+def scroll_back(
+    driver,
+    until,
+    seen_messages,
+    max_scrolls=200,
+    max_messages=5000,
+    wait=1.5,
+    patience=3,
+    sleep=time.sleep,
+):
+    # Scrolls the open chat up until the oldest message rendered was sent
+    # before `until`, or was already handled. Stops at the top of the chat,
+    # i.e. after `patience` scrolls that loaded nothing, and gives up after
+    # max_scrolls or with max_messages rendered, as the browser keeps every
+    # one of them. Returns (messages rendered, whether it got back far enough).
+    count, oldest = oldest_message(driver)
+    scrolls = stuck = 0
+    while count:
+        if message_key(*oldest) in seen_messages:
+            return count, True
+        # Deleted messages have no time, keep going
+        if oldest[1] and parse_pre_plain_text(oldest[1])[0] < until:
+            return count, True
+        if scrolls >= max_scrolls or count >= max_messages:
+            break
+
+        scroll_chat(driver, to_top=True)
+        scrolls += 1
+        METRICS.inc("backfill_scrolls")
+        sleep(wait)
+
+        previous = count
+        count, oldest = oldest_message(driver)
+        if count > previous:
+            stuck = 0
+        else:
+            stuck += 1
+            if stuck >= patience:
+                # Nothing older to load
+                return count, True
+    return count, False
+
+
+def rendered_messages(driver, batch=200):
+    # Every incoming message rendered, oldest first, `batch` per round trip.
+    # Yields lists of (message_id, pre_plain_text, text), so that only one
+    # batch is held at a time however far back the chat was scrolled.
+    start = 0
+    while True:
+        rows = driver.execute_script(EXTRACT_RANGE_JS, start, batch)
+        if not rows:
+            return
+        yield [tuple(x) for x in rows]
+        start += len(rows)
+
+
+def current_chat(driver):
+    return driver.execute_script(CURRENT_CHAT_JS)
+
+
+def take_screenshot(driver, path=SCREENSHOT_PATH):
+    # Only when something went wrong or one was asked for, they are slow
+    try:
+        driver.save_screenshot(path)
+    except Exception:
+        logging.warning("Could not take a screenshot", exc_info=True)
+
+
+def screenshot_if_requested(driver):
+    # Takes a screenshot if SCREENSHOT_REQUEST exists, and removes it
+    if os.path.exists(SCREENSHOT_REQUEST):
+        take_screenshot(driver)
+        os.remove(SCREENSHOT_REQUEST)
+        return True
+    return False
+
+
+def message_key(message_id, pre_plain_text, text):
+    # Some messages have no data-id, fall back to what they say
+    return message_id or f"{pre_plain_text}{text}"
+
+
+def parse_pre_plain_text(pre_plain_text):
+    # "[13:45, 17/10/2026] CPL Tan: " -> (datetime, "13:45, 17/10/2026", "CPL Tan:")
+    sender_str = pre_plain_text.split("]")[-1].strip()
+    time_str = pre_plain_text[pre_plain_text.find("[") + 1 : pre_plain_text.find("]")]
+
+    hour_str, date_str = time_str.split(",")
+    hour, minute = [int(x) for x in hour_str.split(":")]
+    day, month, year = [int(x) for x in date_str.split("/")]
+    message_time = datetime(year, month, day, hour % 24, minute)
+
+    # sanity check wtf why they switch the day and dates
+    if (message_time - datetime.today()).days > 1:
+        month, day, year = [int(x) for x in date_str.split("/")]
+        message_time = datetime(year, month, day, hour % 24, minute)
+
+    return message_time, time_str, sender_str
+
+
+class SeenMessages:
+    # Bounded set of message keys that were already handled. Only the most
+    # recent ones matter, as older messages are no longer rendered anyway.
+    def __init__(self, maxsize=2000):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        # Oldest first
+        return iter(self._keys)
+
+    def add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)